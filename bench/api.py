@@ -0,0 +1,85 @@
+# HTTP API load test: keep-alive clients mixing list reads, lookups and writes
+#
+#   python -m bench.api --clients 16 --requests 4000
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+
+from src.api import ApiServer
+from src.database import Database
+
+
+async def client(port: int, count: int, offset: int, latencies: list):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        for i in range(count):
+            n = offset + i
+            if n % 10 == 0:
+                body = json.dumps({'name': f"Bench farmer {n}"}).encode()
+                head = f"POST /farmers HTTP/1.1\r\nHost: bench\r\nContent-Length: {len(body)}\r\n\r\n"
+            else:
+                path = ('/shipments?limit=50', '/products', '/shipments/1', '/farmers/1/holdings')[n % 4]
+                body = b''
+                head = f"GET {path} HTTP/1.1\r\nHost: bench\r\n\r\n"
+            start = time.perf_counter()
+            writer.write(head.encode() + body)
+            headers = await reader.readuntil(b'\r\n\r\n')
+            length = int(headers.lower().split(b'content-length:')[1].split(b'\r\n')[0])
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+
+async def load(port: int, clients: int, requests: int) -> list:
+    latencies = []
+    per_client = requests // clients
+    await asyncio.gather(*(client(port, per_client, c * per_client, latencies) for c in range(clients)))
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure API requests per second")
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=4000)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--port', type=int, default=8766)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'))
+        api = ApiServer(db, args.workers)
+        ready = threading.Event()
+        servers = []
+
+        def started(server):
+            servers.append(server)
+            ready.set()
+
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=lambda: loop.run_until_complete(api.serve('127.0.0.1', args.port, started)),
+                                  daemon=True)
+        thread.start()
+        ready.wait()
+        try:
+            start = time.perf_counter()
+            latencies = sorted(asyncio.run(load(args.port, args.clients, args.requests)))
+            elapsed = time.perf_counter() - start
+        finally:
+            loop.call_soon_threadsafe(servers[0].close)
+            thread.join(timeout=5)
+            api.close()
+            db.close()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(f"{len(latencies)} requests from {args.clients} clients in {elapsed:.2f}s  ->  "
+          f"{len(latencies) / elapsed:,.0f} requests/s  (p50 {p50:.1f} ms, p99 {p99:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# Multi-process write stress test: N processes, each with its own Database,
+# selling, transferring and saving shipments against one file at once
+#
+#   python -m bench.concurrency --writers 8 --ops 300
+#
+# Stock and holdings are set up smaller than what the writers try to sell and
+# transfer, so they race for the last units. Fails if any write errors out,
+# stock or a holding goes negative, more is sold than there was, or a ledger
+# disagrees with the history afterwards.
+
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+from src.database import Database
+from src.schema import LEDGERS
+from src.services import FarmerService, InventoryService, ShipmentService
+
+
+def setup(db_path: str, stock: int, holding: int) -> dict:
+    db = Database(db_path)
+    try:
+        inventory, farmers = InventoryService(db), FarmerService(db)
+        product_id = inventory.add_product("Stress product")
+        sender, receiver = farmers.add_farmer("Stress sender"), farmers.add_farmer("Stress receiver")
+        with db.transaction() as cursor:
+            # Bought but not yet given out, so it is in stock for direct sales
+            cursor.execute("INSERT INTO shipments (notes) VALUES ('stress stock')")
+            shipment_id = cursor.lastrowid
+            cursor.execute('INSERT INTO shipment_products (shipment_id, product_id, unit_price, quantity, subtotal) '
+                           'VALUES (?, ?, 1, ?, ?)', (shipment_id, product_id, stock + holding, stock + holding))
+            cursor.execute('INSERT INTO farmer_purchases (shipment_id, farmer_id, product_id, quantity, unit_price, '
+                           'total_paid) VALUES (?, ?, ?, ?, 1, ?)', (shipment_id, sender, product_id, holding, holding))
+            db.refresh_shipment_summary(shipment_id)
+    finally:
+        db.close()
+    return {'product_id': product_id, 'sender': sender, 'receiver': receiver}
+
+
+def writer(db_path: str, ids: dict, ops: int, seed: int, results):
+    rng = random.Random(seed)
+    counts = {'sold': 0, 'out_of_stock': 0, 'transferred': 0, 'not_held': 0, 'shipments': 0, 'errors': 0}
+    db = Database(db_path)
+    shipments, inventory, farmers = ShipmentService(db), InventoryService(db), FarmerService(db)
+    try:
+        for _ in range(ops):
+            op = rng.randrange(3)
+            try:
+                if op == 0:
+                    inventory.direct_sell(ids['receiver'], ids['product_id'], 1, 2.0)
+                    counts['sold'] += 1
+                elif op == 1:
+                    farmers.transfer(ids['sender'], ids['receiver'], ids['product_id'], 1, "stress")
+                    counts['transferred'] += 1
+                else:
+                    # A shipment brings in as much as it hands out, leaving stock alone
+                    shipments.create("stress", [{
+                        'product_id': ids['product_id'], 'unit_price': 1.0, 'quantity': 2.0,
+                        'farmers': [{'farmer_id': ids['receiver'], 'quantity': 2.0, 'unit_price': 1.5}],
+                    }])
+                    counts['shipments'] += 1
+            except ValueError:
+                counts['out_of_stock' if op == 0 else 'not_held'] += 1
+            except Exception as e:
+                print(f"writer {seed}: {type(e).__name__}: {e}", file=sys.stderr)
+                counts['errors'] += 1
+    finally:
+        db.close()
+    results.put(counts)
+
+
+def check(db_path: str, ids: dict, totals: dict, stock: int, holding: int) -> list:
+    db = Database(db_path)
+    try:
+        problems = []
+        current = db.execute_query('SELECT current_stock FROM product_stock WHERE product_id = ?',
+                                   (ids['product_id'],))[0]['current_stock']
+        held = FarmerService(db).holding(ids['sender'], ids['product_id'])
+        if totals['errors']:
+            problems.append(f"{totals['errors']} writes failed")
+        if current < 0 or totals['sold'] > stock or abs(current - (stock - totals['sold'])) > 1e-6:
+            problems.append(f"stock {current} after selling {totals['sold']} of {stock}")
+        if held < 0 or totals['transferred'] > holding or abs(held - (holding - totals['transferred'])) > 1e-6:
+            problems.append(f"sender holds {held} after transferring {totals['transferred']} of {holding}")
+        for name in LEDGERS:
+            if db.verify_ledger(name):
+                problems.append(f"{name} disagrees with the history")
+        return problems
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent writers from several processes on one database")
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--ops', type=int, default=300, help="writes per process (default: 300)")
+    parser.add_argument('--stock', type=int, default=200, help="units on hand for direct sales (default: 200)")
+    parser.add_argument('--holding', type=int, default=200, help="units the sender can transfer (default: 200)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'stress.db')
+        ids = setup(db_path, args.stock, args.holding)
+
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=writer, args=(db_path, ids, args.ops, seed, results))
+                     for seed in range(args.writers)]
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+        counts = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+
+        totals = {key: sum(c[key] for c in counts) for key in counts[0]}
+        problems = check(db_path, ids, totals, args.stock, args.holding)
+
+    writes = args.writers * args.ops
+    print(f"{writes} writes from {args.writers} processes in {elapsed:.2f}s  ->  {writes / elapsed:,.0f} writes/s")
+    print(', '.join(f"{key} {value}" for key, value in totals.items()))
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    if not problems:
+        print("OK: no failed writes, no oversells, ledgers in step")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
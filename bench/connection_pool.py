@@ -0,0 +1,60 @@
+# Connection pool benchmark: pooled Database vs. open-per-call connections
+#
+#   python -m bench.connection_pool --queries 5000
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+from src.database import Database
+
+QUERIES = [
+    ('SELECT id, name FROM products ORDER BY name', ()),
+    ('SELECT id, name FROM farmers ORDER BY name', ()),
+    ('SELECT * FROM shipments WHERE id = ?', (1,)),
+]
+
+
+def open_per_call(db_path: str, query: str, params: tuple):
+    # Behaviour of Database.execute_query before connections were pooled
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    results = [dict(row) for row in cursor.fetchall()]
+    conn.close()
+    return results
+
+
+def run(label: str, fn, count: int) -> float:
+    start = time.perf_counter()
+    for i in range(count):
+        query, params = QUERIES[i % len(QUERIES)]
+        fn(query, params)
+    elapsed = time.perf_counter() - start
+    qps = count / elapsed
+    print(f"{label:<16} {count} queries in {elapsed:.3f}s  ->  {qps:,.0f} queries/s")
+    return qps
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare pooled and open-per-call query throughput")
+    parser.add_argument('--queries', type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        db = Database(db_path)
+        try:
+            baseline = run("open-per-call", lambda q, p: open_per_call(db_path, q, p), args.queries)
+            pooled = run("pooled", db.execute_query, args.queries)
+        finally:
+            db.close()
+    print(f"speedup: {pooled / baseline:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# Synthetic database generator for benchmarks
+#
+#   python -m bench.datagen /tmp/bench.db --scale 2 --seed 7
+#
+# Builds a database through the real Database schema (migrations, triggers,
+# ledgers) with realistic proportions: shipments spread over several years,
+# each with a handful of products split across a few farmers, plus direct
+# sales, transfers and returns.
+
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from src.database import Database
+
+# Row counts at scale 1; everything grows linearly with --scale
+BASE_COUNTS = {
+    'products': 200,
+    'farmers': 100,
+    'shipments': 2000,
+    'direct_sales': 2000,
+    'transfers': 1000,
+    'returns': 500,
+}
+PRODUCTS_PER_SHIPMENT = (3, 15)
+FARMERS_PER_PRODUCT = (1, 4)
+HISTORY_DAYS = 3 * 365
+CHUNK = 5000
+
+
+def scaled_counts(scale: float) -> dict:
+    return {name: max(1, int(count * scale)) for name, count in BASE_COUNTS.items()}
+
+
+def _timestamp(rng: random.Random, now: datetime) -> str:
+    moment = now - timedelta(seconds=rng.randrange(HISTORY_DAYS * 86400))
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _flush(db: Database, query: str, rows: list):
+    if rows:
+        with db.transaction() as cursor:
+            cursor.executemany(query, rows)
+        rows.clear()
+
+
+def generate(db_path: str, scale: float = 1.0, seed: int = 1) -> dict:
+    """Create (or extend) the database at ``db_path``; returns row counts."""
+    rng = random.Random(seed)
+    counts = scaled_counts(scale)
+    now = datetime.now()
+    db = Database(db_path)
+    try:
+        with db.transaction() as cursor:
+            cursor.executemany('INSERT OR IGNORE INTO products (name) VALUES (?)',
+                               [(f"Product {i:06d}",) for i in range(counts['products'])])
+            cursor.executemany('INSERT OR IGNORE INTO farmers (name) VALUES (?)',
+                               [(f"Farmer {i:06d}",) for i in range(counts['farmers'])])
+        product_ids = [r['id'] for r in db.execute_query('SELECT id FROM products')]
+        farmer_ids = [r['id'] for r in db.execute_query('SELECT id FROM farmers')]
+
+        # Running farmer x product holdings, so transfers and returns never
+        # move more than a farmer has (the app refuses those)
+        held = {}
+        items, purchases = [], []
+        item_sql = '''INSERT INTO shipment_products (shipment_id, product_id, unit_price, quantity, subtotal)
+                      VALUES (?, ?, ?, ?, ?)'''
+        purchase_sql = '''INSERT INTO farmer_purchases
+                          (shipment_id, farmer_id, product_id, quantity, unit_price, total_paid, created_at)
+                          VALUES (?, ?, ?, ?, ?, ?, ?)'''
+        for _ in range(counts['shipments']):
+            created_at = _timestamp(rng, now)
+            shipment_id = db.execute_update('INSERT INTO shipments (created_at, notes) VALUES (?, ?)',
+                                            (created_at, f"Supplier delivery {rng.randrange(10**6)}"))
+            for product_id in rng.sample(product_ids, min(len(product_ids), rng.randint(*PRODUCTS_PER_SHIPMENT))):
+                unit_price = round(rng.uniform(10, 500), 2)
+                quantity = rng.randint(10, 500)
+                items.append((shipment_id, product_id, unit_price, quantity, unit_price * quantity))
+                buyers = rng.sample(farmer_ids, min(len(farmer_ids), rng.randint(*FARMERS_PER_PRODUCT)))
+                remaining = quantity
+                for i, farmer_id in enumerate(buyers):
+                    share = remaining if i == len(buyers) - 1 else rng.randint(1, max(1, remaining - (len(buyers) - i - 1)))
+                    remaining -= share
+                    price = round(unit_price * rng.uniform(1.05, 1.4), 2)
+                    purchases.append((shipment_id, farmer_id, product_id, share, price, share * price, created_at))
+                    held[farmer_id, product_id] = held.get((farmer_id, product_id), 0) + share
+            if len(items) >= CHUNK:
+                _flush(db, item_sql, items)
+                _flush(db, purchase_sql, purchases)
+        _flush(db, item_sql, items)
+        _flush(db, purchase_sql, purchases)
+
+        sales = []
+        for _ in range(counts['direct_sales']):
+            quantity = rng.randint(1, 20)
+            price = round(rng.uniform(15, 600), 2)
+            farmer_id, product_id = rng.choice(farmer_ids), rng.choice(product_ids)
+            sales.append((None, farmer_id, product_id, quantity, price, quantity * price, _timestamp(rng, now)))
+            held[farmer_id, product_id] = held.get((farmer_id, product_id), 0) + quantity
+        holders = list(held)
+        _flush(db, purchase_sql, sales)
+
+        transfers = []
+        for _ in range(counts['transfers']):
+            source, product_id = rng.choice(holders)
+            target = rng.choice(farmer_ids)
+            quantity = min(held[source, product_id], rng.randint(1, 10))
+            if target == source or quantity <= 0:
+                continue
+            held[source, product_id] -= quantity
+            held[target, product_id] = held.get((target, product_id), 0) + quantity
+            transfers.append((source, target, product_id, quantity,
+                              f"Moved stock {rng.randrange(10**6)}", _timestamp(rng, now)))
+        _flush(db, '''INSERT INTO transfers (from_farmer_id, to_farmer_id, product_id, quantity, note, created_at)
+                      VALUES (?, ?, ?, ?, ?, ?)''', transfers)
+
+        returns = []
+        for _ in range(counts['returns']):
+            farmer_id, product_id = rng.choice(holders)
+            quantity = min(held[farmer_id, product_id], rng.randint(1, 5))
+            if quantity <= 0:
+                continue
+            held[farmer_id, product_id] -= quantity
+            returns.append((farmer_id, product_id, quantity,
+                            round(quantity * rng.uniform(15, 600), 2), f"Damaged {rng.randrange(10**6)}",
+                            _timestamp(rng, now)))
+        _flush(db, '''INSERT INTO returns (farmer_id, product_id, quantity, refund_amount, note, created_at)
+                      VALUES (?, ?, ?, ?, ?, ?)''', returns)
+
+        # Bulk rows bypass the shipment save path, so build its summary in one pass
+        db.rebuild_ledger('shipment_summary')
+        db.execute_update('ANALYZE')
+
+        return {table: db.execute_query(f'SELECT COUNT(*) AS n FROM {table}')[0]['n']
+                for table in ('products', 'farmers', 'shipments', 'shipment_products',
+                              'farmer_purchases', 'transfers', 'returns')}
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic shipments database")
+    parser.add_argument('db_path')
+    parser.add_argument('--scale', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    counts = generate(args.db_path, args.scale, args.seed)
+    print(f"Generated in {time.perf_counter() - start:.1f}s: "
+          + ', '.join(f"{n:,} {table}" for table, n in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# Hot queries of the screens and services, for the plan snapshots and timings in bench/
+#
+# Kept out of src/ so the app does not import every query module (and NumPy,
+# through profitability) just to build this table.
+
+from typing import Optional, Sequence, Tuple
+
+from src.distribution import WEIGHT_QUERIES
+from src.profitability import SALES_QUERY
+from src.queries import (
+    FARMER_HOLDINGS, FARMERS_LIST, PRODUCTS_LIST, SHIPMENT_RECEIPT, SHIPMENTS_BETWEEN, SHIPMENTS_BY_SUMMARY,
+    SHIPMENTS_LIST, STOCK_LIST, page_query, rows_query, shipment_filters
+)
+from src.rollups import report_query
+from src.schema import SHIPMENT_SUMMARY_SOURCE
+from src.search import match_expression, screen_filter, search_query
+
+
+def _filtered_page(query: str, sort_keys: Sequence[str], where: Tuple[Optional[str], tuple],
+                   descending: bool = False) -> Tuple[str, tuple]:
+    return page_query(query, sort_keys, descending, where=where[0], where_params=where[1])
+
+
+# Every query the screens run on a hot path, with representative parameters.
+# bench/query_plans.py snapshots their plans and bench/run.py times them.
+HOT_QUERIES = {
+    'shipments_first_page': page_query(SHIPMENTS_LIST, ('created_at', 'id'), descending=True),
+    'shipments_next_page': page_query(SHIPMENTS_LIST, ('created_at', 'id'), descending=True,
+                                      after=('2025-01-01 00:00:00', 1)),
+    'products_first_page': page_query(PRODUCTS_LIST, ('name',)),
+    'products_next_page': page_query(PRODUCTS_LIST, ('name',), after=('M',)),
+    'farmers_first_page': page_query(FARMERS_LIST, ('name',)),
+    'farmers_next_page': page_query(FARMERS_LIST, ('name',), after=('M',)),
+    'farmers_refresh_rows': rows_query(FARMERS_LIST, 'id', (1, 2)),
+    'stock_refresh_rows': rows_query(STOCK_LIST, 'id', (1,)),
+    'stock_first_page': page_query(STOCK_LIST, ('name',)),
+    'stock_next_page': page_query(STOCK_LIST, ('name',), after=('M',)),
+    'shipment_summary_refresh': (f'{SHIPMENT_SUMMARY_SOURCE} WHERE s.id = ?', (1,)),
+    'shipment_details': ('''
+        SELECT p.name, sp.unit_price, sp.quantity, sp.subtotal
+        FROM shipment_products sp
+        JOIN products p ON sp.product_id = p.id
+        WHERE sp.shipment_id = ?
+    ''', (1,)),
+    'farmer_holdings': (FARMER_HOLDINGS, (1,)),
+    'farmer_holding': ('SELECT quantity FROM farmer_holdings WHERE farmer_id = ? AND product_id = ?', (1, 1)),
+    'shipment_receipt': (SHIPMENT_RECEIPT, (1, 1)),
+    'shipments_between': (SHIPMENTS_BETWEEN, ('2025-01-01', '2025-01-31')),
+    'distribution_history': (WEIGHT_QUERIES['history'], ('[1, 2]', '[1, 2]')),
+    'distribution_standing': (WEIGHT_QUERIES['standing'], ('[1, 2]', '[1, 2]')),
+    'report_total_daily': (report_query('day', 'total'), ('2025-01-01', '2025-12-31')),
+    'report_products_daily': (report_query('day', 'product'), ('2025-01-01', '2025-12-31')),
+    'report_farmer_daily': (report_query('day', 'farmer', filtered=True), (1, '2025-01-01', '2025-12-31')),
+    'profit_sales': (SALES_QUERY, (0,)),
+    'shipments_by_id': page_query(SHIPMENTS_LIST, ('id',), descending=True, after=(100,)),
+    'shipments_by_products': page_query(SHIPMENTS_BY_SUMMARY, ('product_count', 'id'), descending=True,
+                                        after=(3, 100)),
+    'shipments_by_farmers': page_query(SHIPMENTS_BY_SUMMARY, ('farmer_count', 'id'), after=(3, 100)),
+    'shipments_by_total': page_query(SHIPMENTS_BY_SUMMARY, ('total_paid', 'id'), descending=True,
+                                     after=(5000.0, 100)),
+    'shipments_in_dates': _filtered_page(SHIPMENTS_LIST, ('created_at', 'id'),
+                                         shipment_filters(date_from='2025-01-01', date_to='2025-03-31'),
+                                         descending=True),
+    'shipments_total_range': _filtered_page(SHIPMENTS_BY_SUMMARY, ('total_paid', 'id'),
+                                            shipment_filters(min_total=1000.0, max_total=5000.0)),
+    'shipments_of_product': _filtered_page(SHIPMENTS_LIST, ('created_at', 'id'), shipment_filters(product_id=1),
+                                           descending=True),
+    'shipments_of_farmer': _filtered_page(SHIPMENTS_BY_SUMMARY, ('total_paid', 'id'), shipment_filters(farmer_id=1),
+                                          descending=True),
+    'shipments_search_page': _filtered_page(SHIPMENTS_LIST, ('created_at', 'id'),
+                                            screen_filter('shipments', 'supplier'), descending=True),
+    'farmers_search_page': _filtered_page(FARMERS_LIST, ('name',), screen_filter('farmers', 'farmer 1')),
+    'stock_search_page': _filtered_page(STOCK_LIST, ('name',), screen_filter('products', 'tomato')),
+    'search_transfers': (search_query('transfers_search'), (match_expression('moved'), 20)),
+    'product_combo': ('SELECT id, name FROM products ORDER BY name', ()),
+    'farmer_combo': ('SELECT id, name FROM farmers ORDER BY name', ()),
+}
+
+# These pages start from the rows a search, product or farmer matches and
+# sort just those; walking the whole list in order instead would read every
+# row for a rare match
+FILTERED_SORTS = {'shipments_of_product', 'shipments_of_farmer', 'shipments_search_page',
+                  'farmers_search_page', 'stock_search_page'}
@@ -0,0 +1,77 @@
+# Import throughput: write a synthetic manifest and stream it through src.importer
+#
+#   python -m bench.importer --rows 1000000 --format csv
+
+import argparse
+import csv
+import json
+import os
+import random
+import tempfile
+import time
+
+from src.database import Database
+from src.importer import import_file
+
+FIELDS = ('type', 'shipment', 'created_at', 'notes', 'product', 'farmer', 'unit_price', 'quantity')
+
+
+def manifest_records(rows: int, products: int = 500, farmers: int = 300, seed: int = 1):
+    """Shipments of ~10 items, each split across ~4 farmers, until ``rows`` records."""
+    rng = random.Random(seed)
+    written = shipment = 0
+    while written < rows:
+        shipment += 1
+        ref = f"M{shipment}"
+        yield {'type': 'shipment', 'shipment': ref, 'created_at': f"2025-{rng.randint(1, 12):02d}-"
+               f"{rng.randint(1, 28):02d} 08:00:00", 'notes': f"Manifest {ref}"}
+        written += 1
+        for product in rng.sample(range(products), 10):
+            if written >= rows:
+                return
+            price = round(rng.uniform(10, 500), 2)
+            yield {'type': 'item', 'shipment': ref, 'product': f"Product {product}",
+                   'unit_price': price, 'quantity': 40}
+            written += 1
+            for farmer in rng.sample(range(farmers), 4):
+                if written >= rows:
+                    return
+                yield {'type': 'allocation', 'shipment': ref, 'product': f"Product {product}",
+                       'farmer': f"Farmer {farmer}", 'unit_price': round(price * 1.2, 2), 'quantity': 10}
+                written += 1
+
+
+def write_manifest(path: str, rows: int, fmt: str):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            writer = csv.DictWriter(f, FIELDS)
+            writer.writeheader()
+            writer.writerows(manifest_records(rows))
+        else:
+            for record in manifest_records(rows):
+                f.write(json.dumps(record) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the streaming manifest importer")
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--format', choices=('csv', 'jsonl'), default='csv')
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f'manifest.{args.format}')
+        write_manifest(path, args.rows, args.format)
+        db = Database(os.path.join(tmp, 'import.db'))
+        try:
+            start = time.perf_counter()
+            result = import_file(db, path, args.chunk_size)
+            elapsed = time.perf_counter() - start
+        finally:
+            db.close()
+    print(f"{result['rows']:,} rows of {args.format} in {elapsed:.1f}s: "
+          f"{result['rows'] / elapsed:,.0f} rows/s, {result['error_count']} skipped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# EXPLAIN QUERY PLAN snapshots for the hot queries in bench/hot_queries.py
+#
+#   python -m bench.query_plans            # compare against query_plans.json
+#   python -m bench.query_plans --update   # record new snapshots
+#
+# Fails when a plan differs from its snapshot, or when any plan scans a table
+# without an index or sorts through a temporary b-tree (except the queries in
+# FILTERED_SORTS, which sort only the rows a filter matched).
+
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+
+from src.database import Database
+from bench.hot_queries import FILTERED_SORTS, HOT_QUERIES
+
+SNAPSHOT_FILE = os.path.join(os.path.dirname(__file__), 'query_plans.json')
+
+TABLE_SCAN = re.compile(r'^SCAN \w+$')
+TEMP_SORT = re.compile(r'USE TEMP B-TREE')
+
+
+def collect_plans(db: Database) -> dict:
+    plans = {}
+    for name, (query, params) in HOT_QUERIES.items():
+        rows = db.execute_query(f'EXPLAIN QUERY PLAN {query}', params)
+        plans[name] = [row['detail'] for row in rows]
+    return plans
+
+
+def problems(plans: dict, snapshots: dict) -> list:
+    found = []
+    for name, plan in plans.items():
+        forbidden = (TABLE_SCAN,) if name in FILTERED_SORTS else (TABLE_SCAN, TEMP_SORT)
+        for step in plan:
+            if any(pattern.search(step) for pattern in forbidden):
+                found.append(f"{name}: {step}")
+        if name not in snapshots:
+            found.append(f"{name}: no snapshot recorded (run with --update)")
+        elif snapshots[name] != plan:
+            found.append(f"{name}: plan changed\n    was: {snapshots[name]}\n    now: {plan}")
+    return found
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Check hot query plans against their snapshots")
+    parser.add_argument('--update', action='store_true', help="rewrite the snapshot file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'plans.db'))
+        try:
+            plans = collect_plans(db)
+        finally:
+            db.close()
+
+    if args.update:
+        with open(SNAPSHOT_FILE, 'w') as f:
+            json.dump(plans, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Recorded {len(plans)} query plans in {SNAPSHOT_FILE}")
+        return 0
+
+    with open(SNAPSHOT_FILE) as f:
+        snapshots = json.load(f)
+    found = problems(plans, snapshots)
+    for problem in found:
+        print(problem)
+    if found:
+        return 1
+    print(f"{len(plans)} query plans match their snapshots")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,255 @@
+# Headless benchmark suite: hot queries, first screen pages and the shipment save path
+#
+#   python -m bench.run --scale 1 --output results.json
+#   python -m bench.run --db big.db --compare results.json
+#
+# Without --db a synthetic database is generated (see bench.datagen) in a
+# temporary directory. Qt runs on the offscreen platform, so no display is
+# needed. Timings are written as JSON; --compare prints median changes
+# against an earlier results file.
+
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt6.QtCore import QThreadPool
+from PyQt6.QtWidgets import QApplication, QMessageBox
+
+from src.database import Database
+from src.farmers import FarmersWidget
+from src.manage_widget import ManageWidget
+from src.products import ProductsWidget
+from src.profit_dashboard import ProfitabilityWidget
+from src.receipt_engine import load_shipment, shipment_receipts
+from src.reports import ReportsWidget
+from src.shipments import AddShipmentDialog, ShipmentsWidget
+from bench.datagen import generate
+from bench.hot_queries import HOT_QUERIES
+
+SCREENS = {
+    'shipments': ShipmentsWidget,
+    'products': ProductsWidget,
+    'farmers': FarmersWidget,
+    'stock': ManageWidget,
+    'reports': ReportsWidget,
+    'profitability': ProfitabilityWidget,
+}
+
+
+def summarize(times: list) -> dict:
+    times = sorted(t * 1000 for t in times)
+    return {
+        'runs': len(times),
+        'min_ms': round(times[0], 3),
+        'median_ms': round(statistics.median(times), 3),
+        'p95_ms': round(times[min(len(times) - 1, int(len(times) * 0.95))], 3),
+        'max_ms': round(times[-1], 3),
+    }
+
+
+def bench_queries(db: Database, repeat: int) -> dict:
+    results = {}
+    for name, (query, params) in HOT_QUERIES.items():
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            rows = db.fetch_rows(query, params)
+            times.append(time.perf_counter() - start)
+        results[name] = dict(summarize(times), rows=len(rows))
+    return results
+
+
+def bench_screens(db: Database, repeat: int) -> dict:
+    """Time from constructing each list screen until its first page is shown."""
+    pool = QThreadPool.globalInstance()
+    results = {}
+    for name, widget_class in SCREENS.items():
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            widget = widget_class(db)
+            pool.waitForDone()
+            QApplication.processEvents()
+            times.append(time.perf_counter() - start)
+            rows = widget.model.rowCount()
+            widget.deleteLater()
+        QApplication.processEvents()
+        results[name] = dict(summarize(times), rows=rows)
+    return results
+
+
+@contextmanager
+def unattended_dialogs():
+    """Swallow confirmation boxes; a warning means the benchmark input was wrong."""
+    information, warning = QMessageBox.information, QMessageBox.warning
+
+    def fail(parent, title, text, *args):
+        raise RuntimeError(f"save_shipment warned: {text}")
+
+    QMessageBox.information = lambda *args: QMessageBox.StandardButton.Ok
+    QMessageBox.warning = fail
+    try:
+        yield
+    finally:
+        QMessageBox.information, QMessageBox.warning = information, warning
+
+
+def bench_save_shipment(db: Database, repeat: int, products: int, farmers: int) -> dict:
+    """Enter a shipment through AddShipmentDialog, then time save_shipment."""
+    entry_times, save_times = [], []
+    with unattended_dialogs():
+        for _ in range(repeat):
+            dialog = AddShipmentDialog(db)
+            products = min(products, dialog.product_combo.count())
+            farmers = min(farmers, dialog.farmer_combo.count())
+
+            start = time.perf_counter()
+            for i in range(products):
+                dialog.product_combo.setCurrentIndex(i)
+                dialog.unit_price_spin.setValue(100)
+                dialog.quantity_spin.setValue(10 * farmers)
+                dialog.add_product_to_shipment()
+                dialog.products_table.setCurrentCell(i, 0)
+                dialog.select_product_for_farmers()
+                for j in range(farmers):
+                    dialog.farmer_combo.setCurrentIndex(j)
+                    dialog.farmer_quantity_spin.setValue(10)
+                    dialog.selling_price_spin.setValue(120)
+                    dialog.assign_to_farmer()
+            entry_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            dialog.save_shipment()
+            save_times.append(time.perf_counter() - start)
+            dialog.deleteLater()
+    QApplication.processEvents()
+    return {
+        'products': products,
+        'farmers_per_product': farmers,
+        'entry': summarize(entry_times),
+        'save': summarize(save_times),
+    }
+
+
+def bench_receipts(db: Database, shipments: int) -> dict:
+    """Fetch and render every receipt (factory, per farmer, shipment) of recent shipments."""
+    ids = [r['id'] for r in db.execute_query('SELECT id FROM shipments ORDER BY id DESC LIMIT ?', (shipments,))]
+    fetch_times, render_times, receipts = [], [], 0
+    for shipment_id in ids:
+        start = time.perf_counter()
+        shipment = load_shipment(db, shipment_id)
+        fetch_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        receipts += sum(1 for _ in shipment_receipts(shipment))
+        render_times.append(time.perf_counter() - start)
+    return {'shipments': len(ids), 'receipts': receipts,
+            'fetch': summarize(fetch_times), 'render': summarize(render_times)}
+
+
+def compare(current: dict, baseline: dict):
+    for section in ('queries', 'screens'):
+        for name, stats in current[section].items():
+            before = baseline.get(section, {}).get(name)
+            if before:
+                _print_change(f"{section}.{name}", before['median_ms'], stats['median_ms'])
+    for phase in ('entry', 'save'):
+        before = baseline.get('save_shipment', {}).get(phase)
+        if before:
+            _print_change(f"save_shipment.{phase}", before['median_ms'],
+                          current['save_shipment'][phase]['median_ms'])
+    for phase in ('fetch', 'render'):
+        before = baseline.get('receipts', {}).get(phase)
+        if before:
+            _print_change(f"receipts.{phase}", before['median_ms'], current['receipts'][phase]['median_ms'])
+
+
+def _print_change(name: str, before: float, after: float):
+    ratio = after / before if before else float('inf')
+    print(f"  {name:40s} {before:10.3f} -> {after:10.3f} ms  ({ratio:5.2f}x)")
+
+
+def run(db_path: str, args) -> dict:
+    db = Database(db_path)
+    try:
+        counts = {table: db.execute_query(f'SELECT COUNT(*) AS n FROM {table}')[0]['n']
+                  for table in ('products', 'farmers', 'shipments', 'shipment_products',
+                                'farmer_purchases', 'transfers', 'returns')}
+        return {
+            'meta': {
+                'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'sqlite': sqlite3.sqlite_version,
+                'platform': platform.platform(),
+                'scale': None if args.db else args.scale,
+                'seed': None if args.db else args.seed,
+                'counts': counts,
+            },
+            'queries': bench_queries(db, args.repeat),
+            'screens': bench_screens(db, max(1, args.repeat // 10)),
+            'save_shipment': bench_save_shipment(db, max(1, args.repeat // 10),
+                                                 args.shipment_products, args.shipment_farmers),
+            'receipts': bench_receipts(db, args.repeat),
+        }
+    finally:
+        QThreadPool.globalInstance().waitForDone()
+        db.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Run the headless benchmark suite")
+    parser.add_argument('--db', help="benchmark a copy of this database instead of generating one")
+    parser.add_argument('--scale', type=float, default=1.0, help="synthetic data scale (see bench.datagen)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=50, help="runs per query")
+    parser.add_argument('--shipment-products', type=int, default=20)
+    parser.add_argument('--shipment-farmers', type=int, default=5)
+    parser.add_argument('--output', default='bench-results.json')
+    parser.add_argument('--compare', help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        # Read first: --output may name the same file
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    app = QApplication(sys.argv[:1])
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        if args.db:
+            # Saves write to the database, so never benchmark the original
+            source = sqlite3.connect(args.db)
+            target = sqlite3.connect(db_path)
+            source.backup(target)
+            source.close()
+            target.close()
+        else:
+            start = time.perf_counter()
+            generate(db_path, args.scale, args.seed)
+            print(f"Generated scale {args.scale} database in {time.perf_counter() - start:.1f}s")
+        results = run(db_path, args)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+        f.write('\n')
+    print(f"Wrote {args.output}")
+
+    if baseline is not None:
+        print(f"Median change against {args.compare}:")
+        compare(results, baseline)
+    app.quit()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
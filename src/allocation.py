@@ -0,0 +1,94 @@
+# In-memory model of a shipment being entered: products and their farmer allocations
+
+from typing import Dict, List, Optional
+
+# Quantities are floats; allow for rounding when checking a product is fully assigned
+TOLERANCE = 1e-6
+
+
+class AllocationModel:
+    """Products of a shipment and how each is split across farmers.
+
+    Products are indexed by id and keep the row they were added at; each
+    product indexes its farmers by id. Assigned quantities and the purchase
+    and sales totals are running totals, so no operation rescans the
+    shipment.
+    """
+
+    def __init__(self):
+        self._products: Dict[int, dict] = {}
+        self._order: List[int] = []
+        self._rows: Dict[int, int] = {}
+        self.purchase_total = 0.0
+        self.sales_total = 0.0
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def __iter__(self):
+        return map(self._products.get, self._order)
+
+    def add_product(self, product_id: int, name: str, unit_price: float, quantity: float) -> int:
+        """Add a product line; returns its row."""
+        if product_id in self._products:
+            raise ValueError("Product already added")
+        subtotal = unit_price * quantity
+        self._products[product_id] = {
+            'product_id': product_id, 'name': name,
+            'unit_price': unit_price, 'quantity': quantity,
+            'subtotal': subtotal, 'assigned': 0.0, 'farmers': {},
+        }
+        self._rows[product_id] = len(self._order)
+        self._order.append(product_id)
+        self.purchase_total += subtotal
+        return self._rows[product_id]
+
+    def assign(self, product_id: int, farmer_id: int, farmer_name: str, quantity: float,
+               unit_price: float) -> dict:
+        """Allocate part of a product to a farmer; returns the allocation."""
+        product = self._products[product_id]
+        if farmer_id in product['farmers']:
+            raise ValueError("Farmer already assigned")
+        remaining = product['quantity'] - product['assigned']
+        if quantity > remaining + TOLERANCE:
+            raise ValueError(f"Only {remaining:.2f} left")
+        allocation = {
+            'farmer_id': farmer_id, 'farmer_name': farmer_name,
+            'quantity': quantity, 'unit_price': unit_price,
+            'total_paid': quantity * unit_price,
+        }
+        product['farmers'][farmer_id] = allocation
+        product['assigned'] += quantity
+        self.sales_total += allocation['total_paid']
+        return allocation
+
+    def clear_allocations(self, product_id: int):
+        """Drop every farmer allocation of a product."""
+        product = self._products[product_id]
+        self.sales_total -= sum(f['total_paid'] for f in product['farmers'].values())
+        product['farmers'] = {}
+        product['assigned'] = 0.0
+
+    def product(self, product_id: int) -> dict:
+        return self._products[product_id]
+
+    def product_at(self, row: int) -> Optional[dict]:
+        if 0 <= row < len(self._order):
+            return self._products[self._order[row]]
+        return None
+
+    def row_of(self, product_id: int) -> int:
+        return self._rows[product_id]
+
+    def remaining(self, product_id: int) -> float:
+        product = self._products[product_id]
+        return product['quantity'] - product['assigned']
+
+    def unassigned(self) -> List[str]:
+        """Names of products whose quantity is not fully allocated."""
+        return [p['name'] for p in self._products.values()
+                if abs(p['quantity'] - p['assigned']) > TOLERANCE]
+
+    def products(self) -> List[dict]:
+        """Product lines in entry order, each with a 'farmers' list, as ShipmentService.create takes them."""
+        return [dict(p, farmers=list(p['farmers'].values())) for p in self]
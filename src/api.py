@@ -0,0 +1,261 @@
+# Local HTTP/JSON API over the services, for scripts and other tools
+#
+#   python -m src.api --db shipments.db --port 8765
+#
+#   GET  /products                  stock per product, by name (?after=<name>&limit=)
+#   POST /products                  {"name"}
+#   GET  /products/<id>             one product's stock
+#   POST /sales                     direct sale {"farmer_id", "product_id", "quantity", "unit_price"}
+#   GET  /farmers                   farmers and their balances, by name (?after=<name>&limit=)
+#   POST /farmers                   {"name"}
+#   GET  /farmers/<id>/holdings
+#   POST /transfers                 {"from_farmer_id", "to_farmer_id", "product_id", "quantity", "note"}
+#   POST /returns                   {"farmer_id", "product_id", "quantity", "refund_amount", "note"}
+#   GET  /shipments                 ?sort=<queries.SHIPMENT_SORTS>&order=asc|desc&after=<key>&after=<id>
+#                                   &limit= and any of the queries.SHIPMENT_FILTERS
+#   POST /shipments                 {"notes", "products": [{"product_id", "unit_price", "quantity",
+#                                    "farmers": [{"farmer_id", "quantity", "unit_price"}]}]}
+#   GET  /shipments/<id>
+#
+# Requests are parsed on the event loop and connections kept alive between
+# them; the database work runs on a thread pool, where each worker keeps its
+# own pooled connection, so reads run side by side (WAL) while writes queue
+# on SQLite's lock. Bad requests get a 400 with {"error": message}.
+
+import argparse
+import asyncio
+import json
+import logging
+import re
+import sqlite3
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from .database import Database
+from .queries import SHIPMENT_FILTERS, SHIPMENT_SORTS
+from .services import FarmerService, InventoryService, ShipmentService, parse_number
+
+MAX_BODY = 16 * 1024 * 1024
+
+Response = Tuple[int, object]
+
+
+# Query parameters and shipment sort keys that are numbers; anything else
+# (names, dates) stays text so it compares as text in SQL
+NUMBERS = {'limit', 'product_id', 'farmer_id', 'min_total', 'max_total',
+           'id', 'product_count', 'farmer_count', 'total_paid'}
+WHOLE_NUMBERS = {'limit', 'product_id', 'farmer_id', 'id', 'product_count', 'farmer_count'}
+
+
+def _value(name: str, text: str):
+    if name not in NUMBERS:
+        return text
+    value = parse_number(text, name)
+    if name in WHOLE_NUMBERS:
+        if not value.is_integer():
+            raise ValueError(f"{name} must be a whole number")
+        return int(value)
+    return value
+
+
+def _last(params: Dict[str, List[str]], name: str, default=None):
+    return _value(name, params[name][-1]) if name in params else default
+
+
+def _not_found(what: str) -> Response:
+    return HTTPStatus.NOT_FOUND, {'error': f"{what} not found"}
+
+
+class ApiServer:
+    """Routes HTTP requests to the services; one instance per database."""
+
+    def __init__(self, db: Database, workers: int = 8):
+        self.db = db
+        self.shipments = ShipmentService(db)
+        self.inventory = InventoryService(db)
+        self.farmers = FarmerService(db)
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='api')
+        # (method, path pattern, handler(match, query params, body))
+        self.routes: List[Tuple[str, re.Pattern, Callable]] = [
+            ('GET', re.compile(r'/products'), self.list_products),
+            ('POST', re.compile(r'/products'), self.add_product),
+            ('GET', re.compile(r'/products/(\d+)'), self.get_product),
+            ('POST', re.compile(r'/sales'), self.direct_sell),
+            ('GET', re.compile(r'/farmers'), self.list_farmers),
+            ('POST', re.compile(r'/farmers'), self.add_farmer),
+            ('GET', re.compile(r'/farmers/(\d+)/holdings'), self.farmer_holdings),
+            ('POST', re.compile(r'/transfers'), self.transfer),
+            ('POST', re.compile(r'/returns'), self.record_return),
+            ('GET', re.compile(r'/shipments'), self.list_shipments),
+            ('POST', re.compile(r'/shipments'), self.create_shipment),
+            ('GET', re.compile(r'/shipments/(\d+)'), self.get_shipment),
+        ]
+
+    # Handlers, run on the worker threads
+
+    def list_products(self, match, params, body) -> Response:
+        return HTTPStatus.OK, self.inventory.stock(_last(params, 'after'), _last(params, 'limit', 200))
+
+    def add_product(self, match, params, body) -> Response:
+        return HTTPStatus.CREATED, {'id': self.inventory.add_product(body.get('name'))}
+
+    def get_product(self, match, params, body) -> Response:
+        product = self.inventory.product_stock(int(match.group(1)))
+        return (HTTPStatus.OK, product) if product else _not_found("product")
+
+    def direct_sell(self, match, params, body) -> Response:
+        sale_id = self.inventory.direct_sell(body.get('farmer_id'), body.get('product_id'),
+                                             body.get('quantity'), body.get('unit_price'))
+        return HTTPStatus.CREATED, {'id': sale_id}
+
+    def list_farmers(self, match, params, body) -> Response:
+        return HTTPStatus.OK, self.farmers.list(_last(params, 'after'), _last(params, 'limit', 200))
+
+    def add_farmer(self, match, params, body) -> Response:
+        return HTTPStatus.CREATED, {'id': self.farmers.add_farmer(body.get('name'))}
+
+    def farmer_holdings(self, match, params, body) -> Response:
+        return HTTPStatus.OK, self.farmers.holdings(int(match.group(1)))
+
+    def transfer(self, match, params, body) -> Response:
+        transfer_id = self.farmers.transfer(body.get('from_farmer_id'), body.get('to_farmer_id'),
+                                            body.get('product_id'), body.get('quantity'), body.get('note', ''))
+        return HTTPStatus.CREATED, {'id': transfer_id}
+
+    def record_return(self, match, params, body) -> Response:
+        return_id = self.farmers.record_return(body.get('farmer_id'), body.get('product_id'), body.get('quantity'),
+                                               body.get('refund_amount', 0), body.get('note', ''))
+        return HTTPStatus.CREATED, {'id': return_id}
+
+    def list_shipments(self, match, params, body) -> Response:
+        sort, after = _last(params, 'sort', 'created_at'), params.get('after')
+        if after:
+            # One value per sort key, each converted as that key; a wrong count is left to the service
+            sort_keys = SHIPMENT_SORTS[sort][1] if sort in SHIPMENT_SORTS else ()
+            if len(after) == len(sort_keys):
+                after = [_value(key, text) for key, text in zip(sort_keys, after)]
+            after = tuple(after)
+        filters = {name: _last(params, name) for name in SHIPMENT_FILTERS if name in params}
+        return HTTPStatus.OK, self.shipments.list(sort, _last(params, 'order', 'desc') == 'desc', after or None,
+                                                  _last(params, 'limit', 200), **filters)
+
+    def create_shipment(self, match, params, body) -> Response:
+        return HTTPStatus.CREATED, {'id': self.shipments.create(body.get('notes', ''), body.get('products'))}
+
+    def get_shipment(self, match, params, body) -> Response:
+        shipment = self.shipments.get(int(match.group(1)))
+        return (HTTPStatus.OK, shipment) if shipment else _not_found("shipment")
+
+    def dispatch(self, method: str, target: str, body: bytes) -> Response:
+        url = urlsplit(target)
+        path = url.path.rstrip('/') or '/'
+        allowed = False
+        for route_method, pattern, handler in self.routes:
+            match = pattern.fullmatch(path)
+            if match is None:
+                continue
+            if route_method != method:
+                allowed = True
+                continue
+            try:
+                payload = json.loads(body) if body else {}
+                if not isinstance(payload, dict):
+                    raise ValueError("request body must be a JSON object")
+                return handler(match, parse_qs(url.query), payload)
+            except (ValueError, TypeError, sqlite3.IntegrityError) as e:
+                return HTTPStatus.BAD_REQUEST, {'error': str(e)}
+            except sqlite3.Error as e:
+                logging.error(f"API {method} {path} failed: {e}")
+                return HTTPStatus.INTERNAL_SERVER_ERROR, {'error': "database error"}
+            except Exception:
+                logging.exception(f"API {method} {path} failed")
+                return HTTPStatus.INTERNAL_SERVER_ERROR, {'error': "internal error"}
+        if allowed:
+            return HTTPStatus.METHOD_NOT_ALLOWED, {'error': f"{method} not allowed on {path}"}
+        return _not_found(path)
+
+    # HTTP/1.1 on the event loop
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    break
+                request_line, *header_lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = request_line.split(' ', 2)
+                    headers = {name.strip().lower(): value.strip() for name, value in
+                               (line.split(':', 1) for line in header_lines if line)}
+                    length = int(headers.get('content-length', 0))
+                except ValueError:
+                    await self.respond(writer, HTTPStatus.BAD_REQUEST, {'error': "malformed request"}, False)
+                    break
+                if length > MAX_BODY:
+                    await self.respond(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {'error': "body too large"}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                status, payload = await loop.run_in_executor(self.executor, self.dispatch, method, target, body)
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def respond(writer: asyncio.StreamWriter, status: int, payload, keep_alive: bool):
+        data = json.dumps(payload).encode()
+        status = HTTPStatus(status)
+        writer.write(f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                     f"Content-Type: application/json\r\n"
+                     f"Content-Length: {len(data)}\r\n"
+                     f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + data)
+        await writer.drain()
+
+    async def serve(self, host: str, port: int, ready: Optional[Callable] = None):
+        server = await asyncio.start_server(self.handle, host, port, limit=64 * 1024)
+        logging.info(f"API listening on http://{host}:{port}")
+        if ready is not None:
+            ready(server)
+        async with server:
+            try:
+                await server.serve_forever()
+            except asyncio.CancelledError:
+                pass  # server.close() was called
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="HTTP/JSON API for the shipment database")
+    parser.add_argument('--db', default="shipments.db", help="database file (default: shipments.db)")
+    parser.add_argument('--host', default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=8, help="database threads (default: 8)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    db = Database(args.db)
+    api = ApiServer(db, args.workers)
+    try:
+        asyncio.run(api.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        api.close()
+        db.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
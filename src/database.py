@@ -1,140 +1,427 @@
 import sqlite3
 import hashlib
 import logging
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional
+
+from .instrumentation import QueryStats
+
+from .schema import (
+    LEDGERS, SHIPMENT_SUMMARY_SOURCE, SUMMARY_COLUMNS, TRIGGER_TARGETS, migrate, rebuild_ledger,
+    rebuild_search_index
+)
+
+
+# Applied once when a pooled connection is opened, not on every query
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA busy_timeout = 2000",
+    "PRAGMA cache_size = -65536",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+)
+
+# Writes that still find the database locked once busy_timeout has run out,
+# e.g. while another workstation holds a long transaction, are retried this
+# many times in all, sleeping RETRY_BACKOFF seconds (doubling, with jitter)
+# between attempts.
+WRITE_ATTEMPTS = 4
+RETRY_BACKOFF = 0.05
+
+WRITE_TARGET = re.compile(
+    r'^\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)\s+(\w+)',
+    re.IGNORECASE,
+)
+
+
+def written_table(query: str):
+    match = WRITE_TARGET.match(query)
+    return match.group(1).lower() if match else None
+
+
+def is_busy(error: Exception) -> bool:
+    """Whether an error means another connection holds the lock, so trying again may work."""
+    code = getattr(error, 'sqlite_errorcode', None)
+    return code is not None and code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+
+
+class TrackingCursor:
+    """Cursor wrapper that records which tables a transaction writes to,
+    and times each statement when instrumentation is on."""
+
+    def __init__(self, cursor: sqlite3.Cursor, written: set, stats: Optional[QueryStats] = None):
+        self._cursor = cursor
+        self._written = written
+        self._stats = stats
+
+    def _note(self, query: str):
+        table = written_table(query)
+        if table:
+            self._written.add(table)
+
+    def execute(self, query: str, params=()):
+        self._note(query)
+        if self._stats is None:
+            self._cursor.execute(query, params)
+        else:
+            start = time.perf_counter()
+            self._cursor.execute(query, params)
+            self._stats.record(query, params, time.perf_counter() - start, max(self._cursor.rowcount, 0))
+        return self
+
+    def executemany(self, query: str, seq_of_params):
+        self._note(query)
+        if self._stats is None:
+            self._cursor.executemany(query, seq_of_params)
+        else:
+            seq_of_params = list(seq_of_params)
+            start = time.perf_counter()
+            self._cursor.executemany(query, seq_of_params)
+            self._stats.record(query, seq_of_params, time.perf_counter() - start,
+                               max(self._cursor.rowcount, 0), many=True)
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class PooledConnection(sqlite3.Connection):
+    """A pool connection; remembers the last PRAGMA data_version read on it.
+
+    data_version values only compare on the connection that returned them,
+    and a thread can be handed a different connection after release().
+    """
+
+    data_version: Optional[int] = None
+
+
+class ConnectionPool:
+    """Long-lived SQLite connections, bound to one thread at a time.
+
+    Each thread gets its own connection on first use and keeps it until it
+    calls release() or finishes. Connections given back, or owned by threads
+    that have finished, are handed to the next thread that asks, up to
+    ``max_idle`` spare connections. Every connection opened is registered so
+    close() reaches it, wherever it ended up.
+    """
+
+    def __init__(self, db_path: str, max_idle: int = 4):
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._owners: Dict[int, tuple] = {}
+        self._idle: List[sqlite3.Connection] = []
+        self._connections: set = set()
+        self._closed = False
+
+    def _open(self) -> sqlite3.Connection:
+        # check_same_thread is off so close() and interrupt() can reach
+        # connections from the main thread; each one is still only used by
+        # the thread it is bound to.
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, factory=PooledConnection)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        conn.row_factory = sqlite3.Row
+        self._connections.add(conn)
+        return conn
+
+    def _reclaim_dead_threads(self):
+        # Threads Python did not start (e.g. QThreadPool workers) always look
+        # alive; their connections come back through release() instead.
+        for ident, (thread, conn) in list(self._owners.items()):
+            if not thread.is_alive():
+                del self._owners[ident]
+                self._park(conn)
+
+    def _park(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        if len(self._idle) < self.max_idle:
+            self._idle.append(conn)
+        else:
+            self._connections.discard(conn)
+            conn.close()
+
+    def acquire(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn
+        ident = threading.get_ident()
+        with self._lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("Connection pool is closed")
+            # An entry under our ident without a thread-local connection was
+            # left by a finished thread whose ident has been reused
+            stale = self._owners.pop(ident, None)
+            if stale is not None:
+                self._park(stale[1])
+            self._reclaim_dead_threads()
+            conn = self._idle.pop() if self._idle else self._open()
+            self._owners[ident] = (threading.current_thread(), conn)
+        self._local.conn = conn
+        return conn
+
+    def release(self):
+        """Give the calling thread's connection back to the pool."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            return
+        self._local.conn = None
+        with self._lock:
+            self._owners.pop(threading.get_ident(), None)
+            if self._closed:
+                self._connections.discard(conn)
+                conn.close()
+            else:
+                self._park(conn)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+            self._owners.clear()
+            self._idle.clear()
+        self._local = threading.local()
 
 
 class Database:
-    def __init__(self, db_path: str = "shipments.db"):
+    def __init__(self, db_path: str = "shipments.db", stats: Optional[QueryStats] = None):
         self.db_path = db_path
+        # Per-query timings are only recorded when a QueryStats is attached
+        self.stats = stats
+        self.pool = ConnectionPool(db_path)
+        self._local = threading.local()
+        self._versions: Dict[str, int] = {}
+        self._versions_lock = threading.Lock()
+        # Bumped when another connection or process is seen to have committed
+        self._external_writes = 0
         self.init_database()
 
     def get_connection(self) -> sqlite3.Connection:
-        conn = sqlite3.connect(self.db_path)
-        conn.execute("PRAGMA foreign_keys = ON")
-        conn.row_factory = sqlite3.Row
-        return conn
+        return self.pool.acquire()
+
+    def close(self):
+        self.pool.close()
+
+    def _mark_written(self, tables):
+        with self._versions_lock:
+            for table in tables:
+                for name in (table,) + TRIGGER_TARGETS.get(table, ()):
+                    self._versions[name] = self._versions.get(name, 0) + 1
+
+    def _pending_writes(self) -> set:
+        # Tables written by the transaction open on this thread
+        if not hasattr(self._local, 'written'):
+            self._local.written = set()
+        return self._local.written
+
+    def _check_external_writes(self):
+        # PRAGMA data_version changes when any other connection commits,
+        # including other processes. Which tables they wrote is unknown, so
+        # every version moves. The last value is kept on the connection, as
+        # it only compares with values read on that same connection.
+        conn = self.get_connection()
+        version = conn.execute('PRAGMA data_version').fetchone()[0]
+        seen, conn.data_version = conn.data_version, version
+        if seen is not None and version != seen:
+            with self._versions_lock:
+                self._external_writes += 1
+
+    def table_versions(self, tables) -> tuple:
+        """Change counters for ``tables``; they move whenever a commit writes them.
+
+        Screens compare these against the values they last loaded with to
+        know whether they are stale. Commits from other processes move all of
+        them.
+        """
+        self._check_external_writes()
+        with self._versions_lock:
+            return tuple(self._versions.get(table, 0) + self._external_writes for table in tables)
+
+    def _retry(self, attempt, description: str):
+        """Call ``attempt`` until it stops failing with a busy database, WRITE_ATTEMPTS times at most."""
+        delay = RETRY_BACKOFF
+        for remaining in range(WRITE_ATTEMPTS - 1, -1, -1):
+            try:
+                return attempt()
+            except sqlite3.OperationalError as e:
+                if not remaining or not is_busy(e):
+                    raise
+                logging.warning(f"{description}: database busy, retrying in {delay:.2f}s")
+                time.sleep(delay * random.uniform(0.5, 1.5))
+                delay *= 2
 
     def init_database(self):
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-
-            # All tables (exact same as original)
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS products (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT UNIQUE NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS farmers (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT UNIQUE NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS shipments (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    notes TEXT
-                )
-            ''')
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS shipment_products (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    shipment_id INTEGER REFERENCES shipments(id) ON DELETE CASCADE,
-                    product_id INTEGER REFERENCES products(id),
-                    unit_price REAL NOT NULL,
-                    quantity INTEGER NOT NULL,
-                    subtotal REAL
-                )
-            ''')
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS farmer_purchases (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    shipment_id INTEGER REFERENCES shipments(id) ON DELETE CASCADE,
-                    farmer_id INTEGER REFERENCES farmers(id),
-                    product_id INTEGER REFERENCES products(id),
-                    quantity REAL NOT NULL,
-                    unit_price REAL NOT NULL,
-                    total_paid REAL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS transfers (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    from_farmer_id INTEGER REFERENCES farmers(id),
-                    to_farmer_id INTEGER REFERENCES farmers(id),
-                    product_id INTEGER REFERENCES products(id),
-                    quantity REAL NOT NULL,
-                    note TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS returns (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    farmer_id INTEGER REFERENCES farmers(id),
-                    product_id INTEGER REFERENCES products(id),
-                    quantity REAL NOT NULL,
-                    refund_amount REAL,
-                    note TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT UNIQUE NOT NULL,
-                    password_hash TEXT NOT NULL
-                )
-            ''')
-
-            # Indexes and default admin + seed data (exact same as original)
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_shipment_products_shipment_id ON shipment_products(shipment_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_farmer_purchases_shipment_id ON farmer_purchases(shipment_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_farmer_purchases_farmer_id ON farmer_purchases(farmer_id)')
-
-            password_hash = hashlib.sha256("password123".encode()).hexdigest()
-            cursor.execute('INSERT OR IGNORE INTO users (username, password_hash) VALUES (?, ?)', ('admin', password_hash))
-
-            cursor.execute('SELECT COUNT(*) FROM products')
-            if cursor.fetchone()[0] == 0:
-                products = ['Tomato', 'Potato', 'Onion']
-                for p in products:
-                    cursor.execute('INSERT INTO products (name) VALUES (?)', (p,))
-                farmers = ['Farmer A', 'Farmer B', 'Farmer C']
-                for f in farmers:
-                    cursor.execute('INSERT INTO farmers (name) VALUES (?)', (f,))
-                cursor.execute('INSERT INTO shipments (notes) VALUES (?)', ('Sample shipment',))
-                shipment_id = cursor.lastrowid
-                cursor.execute('INSERT INTO shipment_products (shipment_id, product_id, unit_price, quantity, subtotal) VALUES (?, 1, 50.00, 100, 5000.00)', (shipment_id,))
-                cursor.execute('INSERT INTO farmer_purchases (shipment_id, farmer_id, product_id, quantity, unit_price, total_paid) VALUES (?, 1, 1, 50, 65.00, 3250.00)', (shipment_id,))
+            migrate(self)
 
-            conn.commit()
-            conn.close()
+            with self.transaction() as cursor:
+                # Default admin + seed data (exact same as original)
+                password_hash = hashlib.sha256("password123".encode()).hexdigest()
+                cursor.execute('INSERT OR IGNORE INTO users (username, password_hash) VALUES (?, ?)', ('admin', password_hash))
+
+                cursor.execute('SELECT COUNT(*) FROM products')
+                if cursor.fetchone()[0] == 0:
+                    products = ['Tomato', 'Potato', 'Onion']
+                    for p in products:
+                        cursor.execute('INSERT INTO products (name) VALUES (?)', (p,))
+                    farmers = ['Farmer A', 'Farmer B', 'Farmer C']
+                    for f in farmers:
+                        cursor.execute('INSERT INTO farmers (name) VALUES (?)', (f,))
+                    cursor.execute('INSERT INTO shipments (notes) VALUES (?)', ('Sample shipment',))
+                    shipment_id = cursor.lastrowid
+                    cursor.execute('INSERT INTO shipment_products (shipment_id, product_id, unit_price, quantity, subtotal) VALUES (?, 1, 50.00, 100, 5000.00)', (shipment_id,))
+                    cursor.execute('INSERT INTO farmer_purchases (shipment_id, farmer_id, product_id, quantity, unit_price, total_paid) VALUES (?, 1, 1, 50, 65.00, 3250.00)', (shipment_id,))
+                    self._refresh_shipment_summary(cursor, shipment_id)
         except Exception as e:
             logging.error(f"Database initialization error: {e}")
             raise
 
     def execute_query(self, query: str, params: tuple = ()) -> List[Dict[str, Any]]:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(query, params)
-        results = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        return results
+        return [dict(row) for row in self.fetch_rows(query, params)]
+
+    def fetch_rows(self, query: str, params: tuple = ()) -> List[sqlite3.Row]:
+        """Like execute_query, but returns the sqlite3.Row objects as they are."""
+        start = time.perf_counter()
+        cursor = self.get_connection().execute(query, params)
+        rows = cursor.fetchall()
+        cursor.close()
+        if self.stats is not None:
+            self.stats.record(query, params, time.perf_counter() - start, len(rows))
+        return rows
+
+    def iter_query(self, query: str, params: tuple = (), batch_size: int = 500) -> Iterator[sqlite3.Row]:
+        """Stream rows ``batch_size`` at a time instead of loading the whole result."""
+        start = time.perf_counter()
+        cursor = self.get_connection().execute(query, params)
+        count = 0
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                count += len(rows)
+                yield from rows
+        finally:
+            cursor.close()
+            if self.stats is not None:
+                self.stats.record(query, params, time.perf_counter() - start, count)
 
     def execute_update(self, query: str, params: tuple = ()) -> int:
         conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(query, params)
+        # Inside transaction() the enclosing block owns commit, rollback and retries
+        joined = conn.in_transaction
+
+        def attempt():
+            try:
+                cursor = conn.execute(query, params)
+                if not joined:
+                    conn.commit()
+                return cursor
+            except Exception:
+                # The connection outlives this call, so never leave it mid-transaction
+                if not joined:
+                    conn.rollback()
+                raise
+
+        start = time.perf_counter()
+        cursor = attempt() if joined else self._retry(attempt, "Write")
         last_row_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        if self.stats is not None:
+            self.stats.record(query, params, time.perf_counter() - start, max(cursor.rowcount, 0))
+        table = written_table(query)
+        if table:
+            if joined:
+                self._pending_writes().add(table)
+            else:
+                self._mark_written((table,))
         return last_row_id
+
+    @contextmanager
+    def transaction(self):
+        """Run a unit of work as one transaction with a single commit.
+
+        Yields a cursor. Nested calls join the outermost transaction, and any
+        exception rolls the whole unit back. The write lock is taken up front
+        (BEGIN IMMEDIATE), retrying while another process holds it, so a
+        transaction that reads before it writes cannot fail halfway through
+        on a lock and always checks what it reads against the latest data.
+        """
+        conn = self.get_connection()
+        if conn.in_transaction:
+            yield TrackingCursor(conn.cursor(), self._pending_writes(), self.stats)
+            return
+        written = self._local.written = set()
+        self._retry(lambda: conn.execute("BEGIN IMMEDIATE"), "Transaction")
+        try:
+            yield TrackingCursor(conn.cursor(), written, self.stats)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        self._mark_written(written)
+
+    def _refresh_shipment_summary(self, cursor, shipment_id: int):
+        cursor.execute(f'''
+            INSERT OR REPLACE INTO shipment_summary (shipment_id, {', '.join(SUMMARY_COLUMNS)})
+            {SHIPMENT_SUMMARY_SOURCE} WHERE s.id = ?
+        ''', (shipment_id,))
+
+    def refresh_shipment_summary(self, shipment_id: int):
+        """Recompute one shipment's summary row; joins an open transaction."""
+        with self.transaction() as cursor:
+            self._refresh_shipment_summary(cursor, shipment_id)
+
+    def rebuild_ledger(self, name: str):
+        """Recompute a derived table (see schema.LEDGERS) from the history tables."""
+        with self.transaction() as cursor:
+            rebuild_ledger(cursor, name)
+
+    def verify_ledger(self, name: str, tolerance: float = 1e-6) -> List[Dict[str, Any]]:
+        """Return the rows of a derived table that disagree with the history."""
+        source, keys, columns = LEDGERS[name]
+        join = ' AND '.join(f'l.{key} = src.{key}' for key in keys)
+        # Numbers may drift by rounding; anything else, like a timestamp, must match
+        differs = ' OR '.join(f"(l.{col} IS NOT src.{col} AND (typeof(src.{col}) = 'text'"
+                              f" OR ABS(COALESCE(l.{col}, 0) - src.{col}) > ?))" for col in columns)
+        query = f'''
+            SELECT {', '.join(f'src.{key}' for key in keys)},
+                   {', '.join(f'src.{col} AS expected_{col}, l.{col} AS {col}' for col in columns)}
+            FROM ({source}) src
+            LEFT JOIN {name} l ON {join}
+            WHERE l.{keys[0]} IS NULL OR {differs}
+        '''
+        return self.execute_query(query, (tolerance,) * len(columns))
+
+    def rebuild_search_index(self, name: str):
+        """Re-index a full-text index (see schema.SEARCH_INDEXES) from its source table."""
+        with self.transaction() as cursor:
+            rebuild_search_index(cursor, name)
+
+    def verify_search_index(self, name: str) -> bool:
+        """Whether a full-text index matches the rows of its source table."""
+        # FTS5 takes the check as an INSERT but writes nothing; it is run on
+        # the raw connection and rolled back so no table version moves
+        conn = self.get_connection()
+        joined = conn.in_transaction
+        try:
+            conn.execute(f"INSERT INTO {name} ({name}, rank) VALUES ('integrity-check', 1)")
+        except sqlite3.DatabaseError:
+            return False
+        finally:
+            if not joined and conn.in_transaction:
+                conn.rollback()
+        return True
@@ -0,0 +1,80 @@
+# Diagnostics panel: slowest queries recorded by Database instrumentation
+
+from PyQt6.QtWidgets import (
+    QDialog, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem,
+    QComboBox, QSpinBox, QPushButton, QLabel, QDialogButtonBox, QHeaderView
+)
+
+from .database import Database
+
+ORDERINGS = [
+    ("Total time", 'total_ms'),
+    ("p95 latency", 'p95_ms'),
+    ("Max latency", 'max_ms'),
+    ("Calls", 'calls'),
+]
+
+
+class DiagnosticsDialog(QDialog):
+    def __init__(self, db: Database, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.setWindowTitle("Diagnostics")
+        self.resize(1100, 600)
+
+        layout = QVBoxLayout()
+
+        controls = QHBoxLayout()
+        controls.addWidget(QLabel("Top"))
+        self.count_spin = QSpinBox()
+        self.count_spin.setRange(1, 200)
+        self.count_spin.setValue(20)
+        self.count_spin.valueChanged.connect(self.load)
+        controls.addWidget(self.count_spin)
+        controls.addWidget(QLabel("queries by"))
+        self.order_combo = QComboBox()
+        for label, key in ORDERINGS:
+            self.order_combo.addItem(label, key)
+        self.order_combo.currentIndexChanged.connect(self.load)
+        controls.addWidget(self.order_combo)
+        controls.addStretch()
+        controls.addWidget(QPushButton("Refresh", clicked=self.load))
+        controls.addWidget(QPushButton("Reset", clicked=self.reset))
+        layout.addLayout(controls)
+
+        self.table = QTableWidget()
+        self.table.setColumnCount(7)
+        self.table.setHorizontalHeaderLabels(
+            ["Total (ms)", "p95 (ms)", "Max (ms)", "Calls", "Rows", "Callers", "SQL"]
+        )
+        self.table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.table.horizontalHeader().setSectionResizeMode(6, QHeaderView.ResizeMode.Stretch)
+        layout.addWidget(self.table)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.StandardButton.Close)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
+        self.setLayout(layout)
+
+        self.load()
+
+    def load(self):
+        if self.db.stats is None:
+            self.table.setRowCount(0)
+            self.setWindowTitle("Diagnostics (instrumentation off)")
+            return
+        rows = self.db.stats.top(self.count_spin.value(), self.order_combo.currentData())
+        self.table.setRowCount(len(rows))
+        for row, g in enumerate(rows):
+            self.table.setItem(row, 0, QTableWidgetItem(f"{g['total_ms']:.1f}"))
+            self.table.setItem(row, 1, QTableWidgetItem(f"{g['p95_ms']:.1f}"))
+            self.table.setItem(row, 2, QTableWidgetItem(f"{g['max_ms']:.1f}"))
+            self.table.setItem(row, 3, QTableWidgetItem(str(g['calls'])))
+            self.table.setItem(row, 4, QTableWidgetItem(str(g['rows'])))
+            self.table.setItem(row, 5, QTableWidgetItem(g['callers']))
+            self.table.setItem(row, 6, QTableWidgetItem(g['sql']))
+
+    def reset(self):
+        if self.db.stats is not None:
+            self.db.stats.reset()
+        self.load()
@@ -0,0 +1,100 @@
+# Splits each product of a shipment across farmers by a rule, in whole units
+
+import json
+import math
+from typing import Collection, Dict, List, Optional, Sequence, Tuple
+
+from .database import Database
+
+RULES = [
+    ("Equal split", 'equal'),
+    ("Historical purchase share", 'history'),
+    ("Standing orders", 'standing'),
+]
+
+# Weight per (product, farmer), restricted to the given products and farmers
+WEIGHT_QUERIES = {
+    'history': '''
+        SELECT product_id, farmer_id, SUM(quantity) AS weight
+        FROM farmer_purchases
+        WHERE product_id IN (SELECT value FROM json_each(?))
+          AND farmer_id IN (SELECT value FROM json_each(?))
+        GROUP BY product_id, farmer_id
+    ''',
+    'standing': '''
+        SELECT product_id, farmer_id, quantity AS weight
+        FROM standing_orders
+        WHERE product_id IN (SELECT value FROM json_each(?))
+          AND farmer_id IN (SELECT value FROM json_each(?))
+    ''',
+}
+
+
+def largest_remainder(quantity: float, weights: Sequence[float]) -> List[float]:
+    """Split ``quantity`` in proportion to ``weights`` in whole units.
+
+    Each share is rounded down and the units left over go to the largest
+    remainders (earlier weights win ties), so the shares always add up to
+    ``quantity``. A fractional part of ``quantity`` goes to the share with
+    the largest remainder.
+    """
+    total = sum(weights)
+    if total <= 0:
+        raise ValueError("weights must add up to more than zero")
+    units = math.floor(quantity)
+    quotas = [units * w / total for w in weights]
+    shares = [math.floor(q) for q in quotas]
+    by_remainder = sorted(range(len(weights)), key=lambda i: (-(quotas[i] - shares[i]), i))
+    for i in by_remainder[:units - sum(shares)]:
+        shares[i] += 1
+    if quantity > units:
+        shares[by_remainder[0]] += quantity - units
+    return shares
+
+
+def load_weights(db: Database, rule: str, product_ids: Sequence[int],
+                 farmer_ids: Sequence[int]) -> Dict[int, Dict[int, float]]:
+    """product_id -> {farmer_id: weight} for the rules that read the database."""
+    weights: Dict[int, Dict[int, float]] = {}
+    if rule == 'equal':
+        return weights
+    rows = db.fetch_rows(WEIGHT_QUERIES[rule], (json.dumps(list(product_ids)), json.dumps(list(farmer_ids))))
+    for row in rows:
+        if row['weight'] > 0:
+            weights.setdefault(row['product_id'], {})[row['farmer_id']] = row['weight']
+    return weights
+
+
+def distribute(db: Database, rule: str, quantities: Dict[int, float], farmer_ids: Sequence[int],
+               assigned: Optional[Dict[int, Collection[int]]] = None
+               ) -> Tuple[Dict[int, List[Tuple[int, float]]], List[int]]:
+    """Split every product's quantity across ``farmer_ids`` by ``rule``.
+
+    ``quantities`` maps product_id to the quantity to split. ``assigned``
+    maps product_id to farmers who already have a share of it; they are
+    left out of its split, and a product every farmer has a share of gets
+    no entry. Returns product_id -> [(farmer_id, quantity)] without zero
+    shares, and the products that had no weights under the rule and were
+    split equally.
+    """
+    if not farmer_ids:
+        raise ValueError("Select at least one farmer")
+    if rule not in {r for _, r in RULES}:
+        raise ValueError(f"unknown distribution rule {rule!r}")
+    assigned = assigned or {}
+    weights = load_weights(db, rule, list(quantities), farmer_ids)
+    result, fallbacks = {}, []
+    for product_id, quantity in quantities.items():
+        taken = assigned.get(product_id, ())
+        candidates = [f for f in farmer_ids if f not in taken]
+        if not candidates:
+            continue
+        product_weights = {f: w for f, w in weights.get(product_id, {}).items() if f not in taken}
+        if not product_weights:
+            product_weights = dict.fromkeys(candidates, 1.0)
+            if rule != 'equal':
+                fallbacks.append(product_id)
+        farmers = [f for f in candidates if f in product_weights]
+        shares = largest_remainder(quantity, [product_weights[f] for f in farmers])
+        result[product_id] = [(f, share) for f, share in zip(farmers, shares) if share > 0]
+    return result, fallbacks
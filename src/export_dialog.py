@@ -0,0 +1,107 @@
+# File > Export: pick a dataset, filters and a file, then stream it out in the background
+
+from PyQt6.QtCore import QDate
+from PyQt6.QtWidgets import (
+    QDialog, QVBoxLayout, QFormLayout, QComboBox, QDateEdit, QCheckBox,
+    QDialogButtonBox, QFileDialog, QMessageBox, QLabel
+)
+
+from .database import Database
+from .exporter import EXPORTS, FORMATS, export
+from .query_runner import QueryRunner
+
+
+class ExportDialog(QDialog):
+    def __init__(self, db: Database, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.runner = QueryRunner(db, label="ExportDialog (background)", parent=self)
+        self.setWindowTitle("Export")
+        self.resize(450, 300)
+
+        layout = QVBoxLayout()
+        form = QFormLayout()
+
+        self.dataset_combo = QComboBox()
+        for name in EXPORTS:
+            self.dataset_combo.addItem(name.replace('_', ' ').title(), name)
+        self.dataset_combo.currentIndexChanged.connect(self.update_filters)
+        form.addRow("Data:", self.dataset_combo)
+
+        self.format_combo = QComboBox()
+        for fmt in FORMATS:
+            self.format_combo.addItem(fmt.upper(), fmt)
+        form.addRow("Format:", self.format_combo)
+
+        self.dates_check = QCheckBox("Only between")
+        self.from_date = QDateEdit(QDate.currentDate().addMonths(-1))
+        self.to_date = QDateEdit(QDate.currentDate())
+        for edit in (self.from_date, self.to_date):
+            edit.setCalendarPopup(True)
+            edit.setDisplayFormat("yyyy/MM/dd")
+        form.addRow(self.dates_check)
+        form.addRow("From:", self.from_date)
+        form.addRow("To:", self.to_date)
+
+        self.farmer_combo = QComboBox()
+        self.farmer_combo.addItem("All farmers", None)
+        for f in db.execute_query('SELECT id, name FROM farmers ORDER BY name'):
+            self.farmer_combo.addItem(f['name'], f['id'])
+        form.addRow("Farmer:", self.farmer_combo)
+
+        self.product_combo = QComboBox()
+        self.product_combo.addItem("All products", None)
+        for p in db.execute_query('SELECT id, name FROM products ORDER BY name'):
+            self.product_combo.addItem(p['name'], p['id'])
+        form.addRow("Product:", self.product_combo)
+        layout.addLayout(form)
+
+        self.status = QLabel()
+        layout.addWidget(self.status)
+
+        self.buttons = QDialogButtonBox(QDialogButtonBox.StandardButton.Save | QDialogButtonBox.StandardButton.Close)
+        self.buttons.accepted.connect(self.save)
+        self.buttons.rejected.connect(self.reject)
+        layout.addWidget(self.buttons)
+        self.setLayout(layout)
+
+        self.update_filters()
+
+    def update_filters(self):
+        _, date_column, filters, _ = EXPORTS[self.dataset_combo.currentData()]
+        for widget in (self.dates_check, self.from_date, self.to_date):
+            widget.setEnabled(date_column is not None)
+        self.farmer_combo.setEnabled('farmer' in filters)
+        self.product_combo.setEnabled('product' in filters)
+
+    def save(self):
+        name = self.dataset_combo.currentData()
+        fmt = self.format_combo.currentData()
+        path, _ = QFileDialog.getSaveFileName(self, "Export", f"{name}.{fmt}", f"{fmt.upper()} (*.{fmt})")
+        if not path:
+            return
+
+        _, date_column, filters, _ = EXPORTS[name]
+        date_from = date_to = None
+        if date_column is not None and self.dates_check.isChecked():
+            date_from = self.from_date.date().toString("yyyy-MM-dd")
+            date_to = self.to_date.date().toString("yyyy-MM-dd")
+        entities = {}
+        if 'farmer' in filters:
+            entities['farmer'] = self.farmer_combo.currentData()
+        if 'product' in filters:
+            entities['product'] = self.product_combo.currentData()
+
+        self.buttons.setEnabled(False)
+        self.status.setText("Exporting...")
+        self.runner.submit('export', lambda: export(self.db, name, path, fmt, date_from, date_to, **entities),
+                           lambda count: self.finished(path, count), self.failed)
+
+    def finished(self, path: str, count: int):
+        self.buttons.setEnabled(True)
+        self.status.setText(f"Exported {count:,} rows to {path}")
+
+    def failed(self, error: Exception):
+        self.buttons.setEnabled(True)
+        self.status.setText("")
+        QMessageBox.warning(self, "Error", f"Export failed: {error}")
@@ -0,0 +1,177 @@
+# Streaming export of the history and stock tables to CSV or JSON lines
+#
+#   python -m src.exporter farmer_purchases purchases.csv --from 2025-01-01 --to 2025-03-31
+#   python -m src.exporter transfers transfers.jsonl --farmer "Farmer A"
+#
+# Rows are read in batches through Database.iter_query and written as they
+# arrive, so memory use does not grow with the size of the export.
+
+import argparse
+import csv
+import json
+import logging
+import sys
+from typing import Dict, Optional, Tuple
+
+from .database import Database
+
+# name -> (query, date column or None, entity filters, order)
+# Entity filters map a filter name to the condition it adds; each ? takes
+# the filter's id.
+EXPORTS: Dict[str, tuple] = {
+    'shipments': ('''
+        SELECT s.id, s.created_at, s.notes, ss.product_count, ss.farmer_count,
+               ss.purchase_total, ss.sales_total
+        FROM shipments s
+        JOIN shipment_summary ss ON ss.shipment_id = s.id
+    ''', 's.created_at', {
+        'shipment': 's.id = ?',
+    }, 's.created_at, s.id'),
+    'farmer_purchases': ('''
+        SELECT fp.id, fp.created_at, fp.shipment_id, f.name AS farmer, p.name AS product,
+               fp.quantity, fp.unit_price, fp.total_paid
+        FROM farmer_purchases fp
+        JOIN farmers f ON f.id = fp.farmer_id
+        JOIN products p ON p.id = fp.product_id
+    ''', 'fp.created_at', {
+        'farmer': 'fp.farmer_id = ?',
+        'product': 'fp.product_id = ?',
+        'shipment': 'fp.shipment_id = ?',
+    }, 'fp.created_at, fp.id'),
+    'transfers': ('''
+        SELECT t.id, t.created_at, src.name AS from_farmer, dst.name AS to_farmer,
+               p.name AS product, t.quantity, t.note
+        FROM transfers t
+        JOIN farmers src ON src.id = t.from_farmer_id
+        JOIN farmers dst ON dst.id = t.to_farmer_id
+        JOIN products p ON p.id = t.product_id
+    ''', 't.created_at', {
+        'farmer': '(t.from_farmer_id = ? OR t.to_farmer_id = ?)',
+        'product': 't.product_id = ?',
+    }, 't.created_at, t.id'),
+    'returns': ('''
+        SELECT r.id, r.created_at, f.name AS farmer, p.name AS product,
+               r.quantity, r.refund_amount, r.note
+        FROM returns r
+        JOIN farmers f ON f.id = r.farmer_id
+        JOIN products p ON p.id = r.product_id
+    ''', 'r.created_at', {
+        'farmer': 'r.farmer_id = ?',
+        'product': 'r.product_id = ?',
+    }, 'r.created_at, r.id'),
+    'stock': ('''
+        SELECT p.id, p.name AS product, ps.total_bought, ps.total_cost, ps.total_sold,
+               ps.total_returned, ps.current_stock
+        FROM products p
+        JOIN product_stock ps ON ps.product_id = p.id
+    ''', None, {
+        'product': 'p.id = ?',
+    }, 'p.name'),
+}
+
+FORMATS = ('csv', 'jsonl')
+
+
+def export_query(name: str, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                 **entities: Optional[int]) -> Tuple[str, tuple]:
+    """Build the SQL for one export. Dates are 'YYYY-MM-DD', both inclusive."""
+    query, date_column, filters, order = EXPORTS[name]
+    conditions, params = [], []
+    if date_column is not None:
+        if date_from:
+            conditions.append(f'{date_column} >= ?')
+            params.append(date_from)
+        if date_to:
+            conditions.append(f"{date_column} < date(?, '+1 day')")
+            params.append(date_to)
+    for entity, entity_id in entities.items():
+        if entity_id is None:
+            continue
+        if entity not in filters:
+            raise ValueError(f"{name} cannot be filtered by {entity}")
+        condition = filters[entity]
+        conditions.append(condition)
+        params.extend([entity_id] * condition.count('?'))
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    return f'{query} ORDER BY {order}', tuple(params)
+
+
+def export_columns(db: Database, query: str, params: tuple) -> list:
+    cursor = db.get_connection().execute(f'SELECT * FROM ({query}) LIMIT 0', params)
+    columns = [d[0] for d in cursor.description]
+    cursor.close()
+    return columns
+
+
+def write_rows(rows, out, fmt: str, columns: list) -> int:
+    """Write rows to an open text file as they are read; returns the count."""
+    count = 0
+    if fmt == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(tuple(row))
+            count += 1
+    elif fmt == 'jsonl':
+        for row in rows:
+            out.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+            out.write('\n')
+            count += 1
+    return count
+
+
+def export(db: Database, name: str, path: str, fmt: Optional[str] = None,
+           date_from: Optional[str] = None, date_to: Optional[str] = None, **entities) -> int:
+    """Export one dataset to ``path``; the format defaults to the file extension."""
+    fmt = fmt or ('jsonl' if path.endswith(('.jsonl', '.ndjson', '.json')) else 'csv')
+    query, params = export_query(name, date_from, date_to, **entities)
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format {fmt!r}")
+    columns = export_columns(db, query, params)
+    with open(path, 'w', newline='', encoding='utf-8') as out:
+        return write_rows(db.iter_query(query, params), out, fmt, columns)
+
+
+def _lookup(db: Database, table: str, name: Optional[str]) -> Optional[int]:
+    if name is None:
+        return None
+    rows = db.execute_query(f'SELECT id FROM {table} WHERE name = ?', (name,))
+    if not rows:
+        raise ValueError(f"no {table[:-1]} named {name!r}")
+    return rows[0]['id']
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Export shipment history or stock to CSV or JSON lines")
+    parser.add_argument('dataset', choices=sorted(EXPORTS))
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=FORMATS, help="default: from the file extension")
+    parser.add_argument('--from', dest='date_from', metavar='YYYY-MM-DD')
+    parser.add_argument('--to', dest='date_to', metavar='YYYY-MM-DD')
+    parser.add_argument('--farmer', help="farmer name")
+    parser.add_argument('--product', help="product name")
+    parser.add_argument('--shipment', type=int, help="shipment id")
+    parser.add_argument('--db', default="shipments.db", help="database file (default: shipments.db)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    db = Database(args.db)
+    try:
+        entities = {
+            'farmer': _lookup(db, 'farmers', args.farmer),
+            'product': _lookup(db, 'products', args.product),
+            'shipment': args.shipment,
+        }
+        count = export(db, args.dataset, args.path, args.format, args.date_from, args.date_to, **entities)
+    except ValueError as e:
+        parser.error(str(e))
+    finally:
+        db.close()
+    logging.info(f"Exported {count:,} {args.dataset} rows to {args.path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,20 +2,45 @@
 # Farmers list, transfers, returns
 
 from PyQt6.QtWidgets import (
-    QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QTableWidget,
-    QTableWidgetItem, QLabel, QDialog, QFormLayout, QComboBox,
-    QDoubleSpinBox, QTextEdit, QDialogButtonBox, QMessageBox
+    QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QTableView,
+    QLabel, QDialog, QFormLayout, QComboBox, QSplitter, QTableWidget, QTableWidgetItem,
+    QDoubleSpinBox, QTextEdit, QDialogButtonBox, QMessageBox, QHeaderView
 )
+from PyQt6.QtCore import Qt
 from PyQt6.QtGui import QFont
 from decimal import Decimal
+import logging
+import sqlite3
 
 from .database import Database
+from .queries import FARMERS_LIST
+from .search import screen_filter
+from .search_box import SearchBox
+from .services import FarmerService
+from .table_model import PagedQueryModel
+
+
+def amount(value) -> str:
+    return f"{Decimal(str(value)).quantize(Decimal('0.01')):,.2f} DA"
+
+
+FARMER_COLUMNS = [
+    ("Name", lambda r: r['name']),
+    ("Date Added", lambda r: r['created_at'][:10].replace('-', '/')),
+    ("Total Bought (DA)", lambda r: amount(r['total_bought'])),
+    ("Refunded (DA)", lambda r: amount(r['total_refunded'])),
+    ("Net Balance (DA)", lambda r: amount(r['net_balance'])),
+    ("Last Activity", lambda r: r['last_activity'][:10].replace('-', '/') if r['last_activity'] else ""),
+]
 
 
 class FarmersWidget(QWidget):
+    DEPENDS_ON = ('farmers', 'farmer_balance', 'farmer_holdings')
+
     def __init__(self, db: Database):
         super().__init__()
         self.db = db
+        self.farmers = FarmerService(db)
         self.init_ui()
         self.load_farmers()
 
@@ -26,61 +51,108 @@ class FarmersWidget(QWidget):
         header.addWidget(QLabel("<h2>Farmers</h2>"))
         header.addStretch()
 
+        self.search_box = SearchBox("Search names and notes...")
+        self.search_box.search.connect(self.search)
+        header.addWidget(self.search_box)
+
         QPushButton("Add Farmer", clicked=self.add_farmer).setParent(self)
         header.addWidget(QPushButton("Add Farmer", clicked=self.add_farmer))
         header.addWidget(QPushButton("Transfer Products", clicked=self.transfer_products))
         header.addWidget(QPushButton("Record Return", clicked=self.record_return))
+        header.addWidget(QPushButton("Standing Orders", clicked=self.standing_orders))
 
         layout.addLayout(header)
 
-        self.table = QTableWidget()
-        self.table.setColumnCount(3)
-        self.table.setHorizontalHeaderLabels(["Name", "Date Added", "Total Bought (DA)"])
-        self.table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
-        layout.addWidget(self.table)
+        self.model = PagedQueryModel(self.db, FARMERS_LIST, ('name',), FARMER_COLUMNS,
+                                     background=True, parent=self)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.setSelectionBehavior(QTableView.SelectionBehavior.SelectRows)
+        self.table.selectionModel().currentRowChanged.connect(self.load_holdings)
+
+        self.holdings_label = QLabel("Select a farmer to see what they hold")
+        self.holdings_table = QTableWidget()
+        self.holdings_table.setColumnCount(2)
+        self.holdings_table.setHorizontalHeaderLabels(["Product", "Quantity"])
+        self.holdings_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.holdings_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        holdings = QWidget()
+        holdings_layout = QVBoxLayout(holdings)
+        holdings_layout.setContentsMargins(0, 0, 0, 0)
+        holdings_layout.addWidget(self.holdings_label)
+        holdings_layout.addWidget(self.holdings_table)
+
+        splitter = QSplitter(Qt.Orientation.Horizontal)
+        splitter.addWidget(self.table)
+        splitter.addWidget(holdings)
+        splitter.setStretchFactor(0, 3)
+        splitter.setStretchFactor(1, 2)
+        layout.addWidget(splitter)
 
         self.setLayout(layout)
 
     def load_farmers(self):
-        query = '''
-            SELECT f.id, f.name, f.created_at,
-                   COALESCE(SUM(fp.total_paid), 0) as total_bought
-            FROM farmers f
-            LEFT JOIN farmer_purchases fp ON f.id = fp.farmer_id
-            GROUP BY f.id
-            ORDER BY f.name
-        '''
-        farmers = self.db.execute_query(query)
-        self.table.setRowCount(len(farmers))
-        for row, f in enumerate(farmers):
-            self.table.setItem(row, 0, QTableWidgetItem(f['name']))
-            self.table.setItem(row, 1, QTableWidgetItem(f['created_at'][:10].replace('-', '/')))
-            total = Decimal(str(f['total_bought'])).quantize(Decimal('0.01'))
-            self.table.setItem(row, 2, QTableWidgetItem(f"{total:,.2f} DA"))
+        self.model.reload()
+        self.holdings_table.setRowCount(0)
+        self.holdings_label.setText("Select a farmer to see what they hold")
+
+    def farmers_changed(self, farmer_ids, balance: bool = True):
+        """Update the rows and holdings of the farmers a dialog wrote to, instead of reloading."""
+        if balance:
+            self.model.refresh_rows('id', farmer_ids)
+        selected = self.model.row_at(self.table.currentIndex().row())
+        if selected is not None and selected['id'] in farmer_ids:
+            self.load_holdings(self.table.currentIndex())
+
+    def load_holdings(self, current, previous=None):
+        farmer = self.model.row_at(current.row())
+        if farmer is None:
+            return
+        holdings = self.farmers.holdings(farmer['id'])
+        self.holdings_label.setText(f"<b>{farmer['name']}</b> holds {len(holdings)} products")
+        self.holdings_table.setRowCount(len(holdings))
+        for row, h in enumerate(holdings):
+            self.holdings_table.setItem(row, 0, QTableWidgetItem(h['name']))
+            self.holdings_table.setItem(row, 1, QTableWidgetItem(f"{h['quantity']:,.2f}"))
+
+    def refresh(self):
+        self.load_farmers()
+
+    def search(self, text: str):
+        self.model.set_filter(*screen_filter('farmers', text))
+        self.load_farmers()
 
     def add_farmer(self):
         from PyQt6.QtWidgets import QInputDialog
         name, ok = QInputDialog.getText(self, "Add Farmer", "Farmer name:")
         if ok and name.strip():
             try:
-                self.db.execute_update('INSERT INTO farmers (name) VALUES (?)', (name.strip(),))
+                self.farmers.add_farmer(name)
                 self.load_farmers()
-            except:
-                QMessageBox.warning(self, "Error", "Name already exists")
+            except ValueError as e:
+                QMessageBox.warning(self, "Error", str(e))
 
     def transfer_products(self):
-        TransferDialog(self.db).exec()
-        self.load_farmers()
+        dialog = TransferDialog(self.db)
+        if dialog.exec() == QDialog.DialogCode.Accepted:
+            # Transfers move stock, not money: only the holdings change
+            self.farmers_changed({dialog.from_combo.currentData(), dialog.to_combo.currentData()},
+                                 balance=False)
 
     def record_return(self):
-        ReturnDialog(self.db).exec()
-        self.load_farmers()
+        dialog = ReturnDialog(self.db)
+        if dialog.exec() == QDialog.DialogCode.Accepted:
+            self.farmers_changed({dialog.farmer_combo.currentData()})
+
+    def standing_orders(self):
+        StandingOrdersDialog(self.db).exec()
 
 
 class TransferDialog(QDialog):
     def __init__(self, db: Database):
         super().__init__()
         self.db = db
+        self.farmers = FarmerService(db)
         self.setWindowTitle("Transfer Products")
         self.resize(500, 400)
         layout = QVBoxLayout()
@@ -99,9 +171,15 @@ class TransferDialog(QDialog):
         for p in db.execute_query('SELECT id, name FROM products ORDER BY name'):
             self.product_combo.addItem(p['name'], p['id'])
 
+        self.available = QLabel()
+        self.from_combo.currentIndexChanged.connect(self.update_available)
+        self.product_combo.currentIndexChanged.connect(self.update_available)
+        self.update_available()
+
         form.addRow("From Farmer:", self.from_combo)
         form.addRow("To Farmer:", self.to_combo)
         form.addRow("Product:", self.product_combo)
+        form.addRow("Holds:", self.available)
         form.addRow("Quantity:", self.qty_spin)
         form.addRow("Note:", self.note)
         layout.addLayout(form)
@@ -112,17 +190,22 @@ class TransferDialog(QDialog):
         layout.addWidget(btns)
         self.setLayout(layout)
 
+    def update_available(self):
+        held = self.farmers.holding(self.from_combo.currentData(), self.product_combo.currentData())
+        self.available.setText(f"{held:,.2f}")
+
     def transfer(self):
-        if self.from_combo.currentData() == self.to_combo.currentData():
-            QMessageBox.warning(self, "Error", "Cannot transfer to same farmer")
+        try:
+            self.farmers.transfer(self.from_combo.currentData(), self.to_combo.currentData(),
+                                  self.product_combo.currentData(), self.qty_spin.value(),
+                                  self.note.toPlainText())
+        except ValueError as e:
+            QMessageBox.warning(self, "Error", str(e))
+            return
+        except sqlite3.Error as e:
+            logging.error(f"Failed to record transfer: {e}")
+            QMessageBox.warning(self, "Error", f"Transfer not saved: {e}")
             return
-        self.db.execute_update('''
-            INSERT INTO transfers 
-            (from_farmer_id, to_farmer_id, product_id, quantity, note)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (self.from_combo.currentData(), self.to_combo.currentData(),
-              self.product_combo.currentData(), self.qty_spin.value(),
-              self.note.toPlainText()))
         QMessageBox.information(self, "Success", "Transfer recorded")
         self.accept()
 
@@ -131,6 +214,7 @@ class ReturnDialog(QDialog):
     def __init__(self, db: Database):
         super().__init__()
         self.db = db
+        self.farmers = FarmerService(db)
         self.setWindowTitle("Record Return")
         self.resize(500, 400)
         layout = QVBoxLayout()
@@ -150,8 +234,14 @@ class ReturnDialog(QDialog):
         for p in db.execute_query('SELECT id, name FROM products ORDER BY name'):
             self.product_combo.addItem(p['name'], p['id'])
 
+        self.available = QLabel()
+        self.farmer_combo.currentIndexChanged.connect(self.update_available)
+        self.product_combo.currentIndexChanged.connect(self.update_available)
+        self.update_available()
+
         form.addRow("Farmer:", self.farmer_combo)
         form.addRow("Product:", self.product_combo)
+        form.addRow("Holds:", self.available)
         form.addRow("Quantity:", self.qty_spin)
         form.addRow("Refund Amount:", self.refund_spin)
         form.addRow("Note:", self.note)
@@ -163,12 +253,102 @@ class ReturnDialog(QDialog):
         layout.addWidget(btns)
         self.setLayout(layout)
 
+    def update_available(self):
+        held = self.farmers.holding(self.farmer_combo.currentData(), self.product_combo.currentData())
+        self.available.setText(f"{held:,.2f}")
+
     def record(self):
-        self.db.execute_update('''
-            INSERT INTO returns 
-            (farmer_id, product_id, quantity, refund_amount, note)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (self.farmer_combo.currentData(), self.product_combo.currentData(),
-              self.qty_spin.value(), self.refund_spin.value(), self.note.toPlainText()))
+        try:
+            self.farmers.record_return(self.farmer_combo.currentData(), self.product_combo.currentData(),
+                                       self.qty_spin.value(), self.refund_spin.value(), self.note.toPlainText())
+        except ValueError as e:
+            QMessageBox.warning(self, "Error", str(e))
+            return
+        except sqlite3.Error as e:
+            logging.error(f"Failed to record return: {e}")
+            QMessageBox.warning(self, "Error", f"Return not saved: {e}")
+            return
         QMessageBox.information(self, "Success", "Return recorded")
         self.accept()
+
+
+class StandingOrdersDialog(QDialog):
+    """What each farmer usually takes; the "Standing orders" distribution rule splits by it."""
+
+    def __init__(self, db: Database):
+        super().__init__()
+        self.db = db
+        self.farmers = FarmerService(db)
+        self.setWindowTitle("Standing Orders")
+        self.resize(500, 450)
+        layout = QVBoxLayout()
+
+        form = QFormLayout()
+        self.farmer_combo = QComboBox()
+        for f in db.execute_query('SELECT id, name FROM farmers ORDER BY name'):
+            self.farmer_combo.addItem(f['name'], f['id'])
+        self.farmer_combo.currentIndexChanged.connect(self.load_orders)
+        form.addRow("Farmer:", self.farmer_combo)
+        layout.addLayout(form)
+
+        self.orders_table = QTableWidget()
+        self.orders_table.setColumnCount(2)
+        self.orders_table.setHorizontalHeaderLabels(["Product", "Quantity"])
+        self.orders_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.orders_table.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
+        self.orders_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        layout.addWidget(self.orders_table)
+
+        edit = QHBoxLayout()
+        self.product_combo = QComboBox()
+        for p in db.execute_query('SELECT id, name FROM products ORDER BY name'):
+            self.product_combo.addItem(p['name'], p['id'])
+        self.qty_spin = QDoubleSpinBox()
+        self.qty_spin.setRange(0.01, 999999)
+        edit.addWidget(self.product_combo)
+        edit.addWidget(self.qty_spin)
+        edit.addWidget(QPushButton("Set", clicked=self.set_order))
+        edit.addWidget(QPushButton("Remove Selected", clicked=self.remove_order))
+        layout.addLayout(edit)
+
+        btns = QDialogButtonBox(QDialogButtonBox.StandardButton.Close)
+        btns.rejected.connect(self.reject)
+        layout.addWidget(btns)
+        self.setLayout(layout)
+
+        self.load_orders()
+
+    def load_orders(self):
+        orders = self.db.execute_query('''
+            SELECT so.product_id, p.name, so.quantity
+            FROM standing_orders so
+            JOIN products p ON p.id = so.product_id
+            WHERE so.farmer_id = ?
+            ORDER BY p.name
+        ''', (self.farmer_combo.currentData(),))
+        self.orders_table.setRowCount(len(orders))
+        for row, o in enumerate(orders):
+            item = QTableWidgetItem(o['name'])
+            item.setData(Qt.ItemDataRole.UserRole, o['product_id'])
+            self.orders_table.setItem(row, 0, item)
+            self.orders_table.setItem(row, 1, QTableWidgetItem(f"{o['quantity']:,.2f}"))
+
+    def save(self, product_id: int, quantity: float):
+        farmer_id = self.farmer_combo.currentData()
+        if farmer_id is None or product_id is None:
+            return
+        try:
+            self.farmers.set_standing_order(farmer_id, product_id, quantity)
+        except sqlite3.Error as e:
+            logging.error(f"Failed to save standing order: {e}")
+            QMessageBox.warning(self, "Error", f"Standing order not saved: {e}")
+            return
+        self.load_orders()
+
+    def set_order(self):
+        self.save(self.product_combo.currentData(), self.qty_spin.value())
+
+    def remove_order(self):
+        item = self.orders_table.item(self.orders_table.currentRow(), 0)
+        if item is not None:
+            self.save(item.data(Qt.ItemDataRole.UserRole), 0)
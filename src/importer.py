@@ -0,0 +1,329 @@
+# Streaming import of supplier manifests (shipments, line items, farmer allocations)
+#
+#   python -m src.importer manifest.csv --db shipments.db
+#   python -m src.importer manifest.jsonl --chunk-size 20000 --no-create
+#
+# One record per line, CSV with a header row or JSON lines, with a `type` of:
+#   shipment    shipment, created_at, notes
+#   item        shipment, product, unit_price, quantity
+#   allocation  shipment, product, farmer, unit_price, quantity
+# `shipment` is a reference local to the file; items and allocations must
+# come after the shipment row they refer to, and allocations after their
+# item, one item line per product per shipment. Rows are written in chunks,
+# one transaction per chunk, so a failed import keeps the chunks before it.
+# Malformed or invalid rows (bad JSON, quantities and prices that are not
+# positive numbers, allocations beyond their item's quantity) are skipped
+# and reported by line number.
+#
+# Memory: besides the current chunk, only shipments that are still open are
+# held with their items. Once a shipment is written, all of its items are
+# fully assigned and a later shipment row has started, it is closed and only
+# its reference is kept; rows for it after that are rejected. Files that
+# list each shipment's rows together never hit that, and an import holds
+# little more than one reference per shipment.
+
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple, Union
+
+from .allocation import TOLERANCE
+from .database import Database
+from .schema import SHIPMENT_SUMMARY_SOURCE
+from .services import parse_positive
+
+RECORD_TYPES = ('shipment', 'item', 'allocation')
+MAX_REPORTED_ERRORS = 100
+
+
+def _from_json(count: int) -> str:
+    # Select list over json_each(?) of a chunk's rows as JSON arrays
+    return ', '.join(f"json_extract(value, '$[{i}]')" for i in range(count))
+
+
+def _counted_lines(f, counter: list) -> Iterator[str]:
+    # Tracks characters consumed for progress; tell() is unavailable while
+    # csv is iterating the file
+    for line in f:
+        counter[0] += len(line)
+        yield line
+
+
+def read_records(path: str, counter: Optional[list] = None) -> Iterator[Tuple[int, Union[dict, str]]]:
+    """Yield (line number, record) pairs from a CSV or JSON-lines file.
+
+    JSON lines come through as their text; ShipmentImporter.run parses them
+    so that a malformed line is skipped like any other bad record.
+    """
+    counter = counter if counter is not None else [0]
+    with open(path, newline='', encoding='utf-8') as f:
+        lines = _counted_lines(f, counter)
+        if path.endswith(('.jsonl', '.ndjson', '.json')):
+            for number, line in enumerate(lines, 1):
+                if line.strip():
+                    yield number, line
+        else:
+            reader = csv.DictReader(lines)
+            for record in reader:
+                yield reader.line_num, record
+
+
+class ShipmentImporter:
+    """Writes manifest records to the database in chunked transactions.
+
+    Product and farmer names are resolved through in-memory caches loaded
+    once up front; unknown names are created unless ``create_missing`` is
+    off. Invalid records are skipped and reported in the result.
+    """
+
+    def __init__(self, db: Database, chunk_size: int = 10000, create_missing: bool = True,
+                 progress: Optional[Callable[[dict], None]] = None):
+        self.db = db
+        self.chunk_size = chunk_size
+        self.create_missing = create_missing
+        self.progress = progress
+        self.products = {r['name']: r['id'] for r in db.execute_query('SELECT id, name FROM products')}
+        self.farmers = {r['name']: r['id'] for r in db.execute_query('SELECT id, name FROM farmers')}
+        # Open shipments: file reference -> [shipment id (None until written),
+        # created_at, {product name: [unit price, quantity, quantity assigned,
+        # line]}]; allocations are checked against their item and take their
+        # unit cost from it
+        self.shipments: Dict[str, list] = {}
+        # References of shipments written in full, see close_finished()
+        self.closed: Set[str] = set()
+        self._latest: Optional[str] = None
+        self._pending_shipments: List[Tuple[str, Optional[str], str]] = []
+        self._items: List[tuple] = []
+        self._allocations: List[tuple] = []
+        self._buffered = 0
+        self.counts = {kind: 0 for kind in RECORD_TYPES}
+        self.errors: List[Tuple[int, str]] = []
+        self.error_count = 0
+
+    def _name(self, cache: Dict[str, int], table: str, name) -> str:
+        # Unknown names are created when the chunk is written, see flush()
+        name = str(name or '').strip()
+        if not name:
+            raise ValueError(f"missing {table[:-1]} name")
+        if name not in cache and not self.create_missing:
+            raise ValueError(f"unknown {table[:-1]} {name!r}")
+        return name
+
+    def _shipment(self, record: dict) -> Tuple[str, dict]:
+        ref = str(record.get('shipment') or '').strip()
+        if ref in self.closed:
+            raise ValueError(f"shipment {ref!r} was already written in full")
+        if ref not in self.shipments:
+            raise ValueError(f"unknown shipment reference {ref!r}")
+        return ref, self.shipments[ref][2]
+
+    def add(self, record: dict, line: int = 0):
+        kind = record.get('type')
+        if kind == 'shipment':
+            ref = str(record.get('shipment') or '').strip()
+            if not ref:
+                raise ValueError("missing shipment reference")
+            if ref in self.shipments or ref in self.closed:
+                raise ValueError(f"duplicate shipment reference {ref!r}")
+            created_at = record.get('created_at') or None
+            self.shipments[ref] = [None, created_at, {}]
+            self._latest = ref
+            self._pending_shipments.append((ref, created_at, record.get('notes') or ''))
+        elif kind == 'item':
+            ref, items = self._shipment(record)
+            unit_price = parse_positive(record['unit_price'], "unit_price")
+            quantity = parse_positive(record['quantity'], "quantity")
+            product = self._name(self.products, 'products', record.get('product'))
+            if product in items:
+                # A second line would change the unit cost of allocations already read
+                raise ValueError(f"duplicate item for product {product!r} in shipment {ref!r}")
+            items[product] = [unit_price, quantity, 0.0, line]
+            self._items.append((ref, product, unit_price, quantity, unit_price * quantity))
+        elif kind == 'allocation':
+            ref, items = self._shipment(record)
+            unit_price = parse_positive(record['unit_price'], "unit_price")
+            quantity = parse_positive(record['quantity'], "quantity")
+            # Checked against the shipment's items before any name is looked up,
+            # so a bad allocation never creates a product
+            product = str(record.get('product') or '').strip()
+            item = items.get(product)
+            if item is None:
+                raise ValueError(f"no item for product {product!r} in shipment {ref!r}")
+            if item[2] + quantity > item[1] + TOLERANCE:
+                raise ValueError(f"allocations exceed the {item[1]:g} of product {product!r} in shipment {ref!r}")
+            farmer = self._name(self.farmers, 'farmers', record.get('farmer'))
+            item[2] += quantity
+            self._allocations.append((ref, farmer, product, quantity, unit_price, unit_price * quantity, item[0]))
+        else:
+            raise ValueError(f"unknown record type {kind!r}")
+        self.counts[kind] += 1
+        self._buffered += 1
+
+    def pending(self) -> int:
+        return self._buffered
+
+    def flush(self):
+        """Write buffered records and refresh the summaries they touch, in one transaction."""
+        if not self.pending():
+            return
+        with self.db.transaction() as cursor:
+            # Names first seen in this chunk are created with it; a failed import
+            # stops here, so the caches are not rolled back with it
+            products = {product for _, product, *_ in self._items}
+            farmers = {farmer for _, farmer, *_ in self._allocations}
+            for cache, table, names in ((self.products, 'products', products), (self.farmers, 'farmers', farmers)):
+                for name in sorted(names - cache.keys()):
+                    cursor.execute(f'INSERT INTO {table} (name) VALUES (?)', (name,))
+                    cache[name] = cursor.lastrowid
+
+            for ref, created_at, notes in self._pending_shipments:
+                if created_at:
+                    cursor.execute('INSERT INTO shipments (created_at, notes) VALUES (?, ?)', (created_at, notes))
+                else:
+                    cursor.execute('INSERT INTO shipments (notes) VALUES (?)', (notes,))
+                self.shipments[ref][0] = cursor.lastrowid
+            touched = {self.shipments[ref][0] for ref, _, _ in self._pending_shipments}
+
+            items = []
+            for ref, product, *values in self._items:
+                shipment_id = self.shipments[ref][0]
+                touched.add(shipment_id)
+                items.append((shipment_id, self.products[product], *values))
+            # One INSERT ... SELECT per table and chunk: executemany pays the
+            # statement and trigger setup again for every row
+            cursor.execute(f'''
+                INSERT INTO shipment_products (shipment_id, product_id, unit_price, quantity, subtotal)
+                SELECT {_from_json(5)} FROM json_each(?)
+            ''', (json.dumps(items),))
+
+            allocations = []
+            for ref, farmer, product, *values in self._allocations:
+                shipment_id, created_at, _ = self.shipments[ref]
+                touched.add(shipment_id)
+                allocations.append((shipment_id, self.farmers[farmer], self.products[product], *values, created_at))
+            cursor.execute(f'''
+                INSERT INTO farmer_purchases
+                (shipment_id, farmer_id, product_id, quantity, unit_price, total_paid, unit_cost, created_at)
+                SELECT {_from_json(7)}, COALESCE(json_extract(value, '$[7]'), CURRENT_TIMESTAMP) FROM json_each(?)
+            ''', (json.dumps(allocations),))
+
+            cursor.executemany(f'''
+                INSERT OR REPLACE INTO shipment_summary
+                (shipment_id, product_count, farmer_count, purchase_total, sales_total)
+                {SHIPMENT_SUMMARY_SOURCE} WHERE s.id = ?
+            ''', [(shipment_id,) for shipment_id in sorted(touched)])
+        self._pending_shipments.clear()
+        self._items.clear()
+        self._allocations.clear()
+        self._buffered = 0
+        self.close_finished()
+
+    def close_finished(self):
+        """Drop written shipments whose items are all assigned, keeping only their references.
+
+        The shipment still being read is left open, since more items for it
+        may follow.
+        """
+        for ref, (shipment_id, _, items) in list(self.shipments.items()):
+            if ref == self._latest or shipment_id is None:
+                continue
+            if all(quantity - assigned <= TOLERANCE for _, quantity, assigned, _ in items.values()):
+                del self.shipments[ref]
+                self.closed.add(ref)
+
+    def run(self, records: Iterator[Tuple[int, Union[dict, str]]], total_bytes: int = 0,
+            counter: Optional[list] = None) -> dict:
+        start = time.perf_counter()
+        rows = 0
+        for line, record in records:
+            rows += 1
+            try:
+                if isinstance(record, str):
+                    record = json.loads(record)
+                    if not isinstance(record, dict):
+                        raise ValueError("not a JSON object")
+                self.add(record, line)
+            except (KeyError, TypeError, ValueError) as e:
+                self._error(line, str(e) if not isinstance(e, KeyError) else f"missing {e}")
+            if self.pending() >= self.chunk_size:
+                self.flush()
+                self._report(rows, start, total_bytes, counter)
+        self.flush()
+        self._report(rows, start, total_bytes, counter)
+        # Items whose allocations never added up; reported at the item's line
+        for _, _, items in self.shipments.values():
+            for _, quantity, assigned, line in items.values():
+                if quantity - assigned > TOLERANCE:
+                    self._error(line, f"item written, but only {assigned:g} of {quantity:g} assigned to farmers")
+        return {
+            'rows': rows,
+            'seconds': time.perf_counter() - start,
+            'counts': dict(self.counts),
+            'error_count': self.error_count,
+            'errors': list(self.errors),
+        }
+
+    def _error(self, line: int, message: str):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    def _report(self, rows: int, start: float, total_bytes: int, counter: Optional[list]):
+        if self.progress is None:
+            return
+        done = counter[0] / total_bytes if total_bytes and counter else None
+        self.progress({'rows': rows, 'seconds': time.perf_counter() - start,
+                       'fraction': done, 'errors': self.error_count})
+
+
+def import_file(db: Database, path: str, chunk_size: int = 10000, create_missing: bool = True,
+                progress: Optional[Callable[[dict], None]] = None) -> dict:
+    """Stream a manifest file into the database; returns counts and skipped rows."""
+    counter = [0]
+    importer = ShipmentImporter(db, chunk_size, create_missing, progress)
+    return importer.run(read_records(path, counter), os.path.getsize(path), counter)
+
+
+def _print_progress(p: dict):
+    done = f"{p['fraction']:6.1%}  " if p['fraction'] is not None else ''
+    rate = p['rows'] / p['seconds'] if p['seconds'] else 0
+    print(f"\r{done}{p['rows']:,} rows  {rate:,.0f} rows/s  {p['errors']} skipped",
+          end='', file=sys.stderr, flush=True)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Import shipments, items and allocations from CSV or JSON lines")
+    parser.add_argument('path')
+    parser.add_argument('--db', default="shipments.db", help="database file (default: shipments.db)")
+    parser.add_argument('--chunk-size', type=int, default=10000, help="records per transaction")
+    parser.add_argument('--no-create', action='store_true',
+                        help="skip rows naming unknown products or farmers instead of creating them")
+    parser.add_argument('--quiet', action='store_true', help="no progress output")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    db = Database(args.db)
+    try:
+        result = import_file(db, args.path, args.chunk_size, not args.no_create,
+                             None if args.quiet else _print_progress)
+    finally:
+        db.close()
+    if not args.quiet:
+        print(file=sys.stderr)
+
+    for line, message in result['errors']:
+        logging.warning(f"line {line}: {message}")
+    counts = result['counts']
+    logging.info(f"Imported {counts['shipment']:,} shipments, {counts['item']:,} items and "
+                 f"{counts['allocation']:,} allocations in {result['seconds']:.1f}s; "
+                 f"{result['error_count']:,} rows skipped or incomplete")
+    return 1 if result['error_count'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
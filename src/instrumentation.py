@@ -0,0 +1,118 @@
+# Query timing for the Database layer: ring buffer, slow-query log, top-N report
+
+import logging
+import os
+import sys
+import threading
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+# Frames from these files are plumbing, not the code that asked for the query
+_PLUMBING = tuple(
+    os.path.join(os.path.dirname(__file__), name)
+    for name in ('database.py', 'instrumentation.py', 'table_model.py', 'query_runner.py', 'services.py')
+)
+
+
+def params_shape(params, many: bool = False) -> str:
+    """Describe parameters by type only, never by value."""
+    if many:
+        params = list(params)
+        first = params[0] if params else ()
+        return f"{len(params)} x {params_shape(first)}"
+    if isinstance(params, dict):
+        return '{' + ', '.join(f'{k}: {type(v).__name__}' for k, v in params.items()) + '}'
+    return '(' + ', '.join(type(p).__name__ for p in params) + ')'
+
+
+def calling_site() -> str:
+    """Class and method of the first caller outside the database plumbing."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if not filename.startswith(_PLUMBING) and 'contextlib' not in filename:
+            owner = frame.f_locals.get('self')
+            if owner is not None:
+                return f"{type(owner).__name__}.{frame.f_code.co_name}"
+            return f"{os.path.basename(filename)}:{frame.f_code.co_name}"
+        frame = frame.f_back
+    return "?"
+
+
+class QueryStats:
+    """Recent query timings, kept in a fixed-size ring buffer.
+
+    Each record holds the SQL, the shape of its parameters, wall time, rows
+    returned or changed, and the calling site (or the context label set by
+    the caller, e.g. the screen a background page is loaded for). Queries
+    slower than ``slow_ms`` are also logged as warnings.
+    """
+
+    def __init__(self, capacity: int = 5000, slow_ms: float = 100.0):
+        self.slow_ms = slow_ms
+        self._records = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self._context = threading.local()
+
+    def set_context(self, label: Optional[str]):
+        self._context.label = label
+
+    def record(self, sql: str, params, elapsed: float, rows: int, many: bool = False):
+        sql = ' '.join(sql.split())
+        caller = getattr(self._context, 'label', None) or calling_site()
+        ms = elapsed * 1000
+        entry = {
+            'sql': sql,
+            'params': params_shape(params, many),
+            'ms': ms,
+            'rows': rows,
+            'caller': caller,
+        }
+        with self._lock:
+            self._records.append(entry)
+        if ms >= self.slow_ms:
+            logging.warning(f"Slow query ({ms:.1f} ms, {rows} rows) from {caller}: "
+                            f"{sql[:300]} {entry['params']}")
+
+    def records(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._records)
+
+    def reset(self):
+        with self._lock:
+            self._records.clear()
+
+    def top(self, n: int = 10, by: str = 'total_ms') -> List[Dict[str, Any]]:
+        """Aggregate the buffer per statement and return the ``n`` worst by
+        ``total_ms``, ``p95_ms``, ``max_ms`` or ``calls``."""
+        groups: Dict[str, Dict[str, Any]] = {}
+        for entry in self.records():
+            group = groups.setdefault(entry['sql'], {
+                'sql': entry['sql'], 'calls': 0, 'rows': 0, 'times': [], 'callers': set(),
+            })
+            group['calls'] += 1
+            group['rows'] += entry['rows']
+            group['times'].append(entry['ms'])
+            group['callers'].add(entry['caller'])
+
+        summary = []
+        for group in groups.values():
+            times = sorted(group.pop('times'))
+            group['total_ms'] = sum(times)
+            group['p95_ms'] = times[min(len(times) - 1, int(len(times) * 0.95))]
+            group['max_ms'] = times[-1]
+            group['callers'] = ', '.join(sorted(group['callers']))
+            summary.append(group)
+        summary.sort(key=lambda g: g[by], reverse=True)
+        return summary[:n]
+
+    def report(self, n: int = 10) -> str:
+        lines = []
+        for by in ('total_ms', 'p95_ms'):
+            lines.append(f"Top {n} queries by {by}:")
+            for g in self.top(n, by):
+                lines.append(
+                    f"  {g['total_ms']:9.1f} ms total  {g['p95_ms']:7.1f} ms p95  "
+                    f"{g['calls']:6d} calls  {g['rows']:8d} rows  [{g['callers']}]  {g['sql'][:120]}"
+                )
+        return '\n'.join(lines)
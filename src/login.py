@@ -3,8 +3,9 @@
 
 from PyQt6.QtWidgets import (
     QDialog, QVBoxLayout, QFormLayout, QLineEdit, QLabel,
-    QDialogButtonBox, QMessageBox, QFont
+    QDialogButtonBox, QMessageBox
 )
+from PyQt6.QtGui import QFont
 from PyQt6.QtCore import Qt
 import hashlib
 import logging
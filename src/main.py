@@ -5,8 +5,10 @@ import sys
 import logging
 from PyQt6.QtWidgets import QApplication
 from PyQt6.QtGui import QIcon
+from PyQt6.QtCore import QThreadPool
 
 from .database import Database
+from .instrumentation import QueryStats
 from .login import LoginDialog
 from .main_window import MainWindow
 
@@ -21,7 +23,11 @@ def main():
     app = QApplication(sys.argv)
     app.setStyle("Fusion")
 
-    db = Database()
+    db = Database(stats=QueryStats(slow_ms=100.0))
+    app.aboutToQuit.connect(lambda: logging.info("Query diagnostics at exit:\n" + db.stats.report()))
+    # Let background queries finish before their connections are closed
+    app.aboutToQuit.connect(QThreadPool.globalInstance().waitForDone)
+    app.aboutToQuit.connect(db.close)
 
     login = LoginDialog(db)
     if login.exec() == login.DialogCode.Accepted:
@@ -29,6 +35,7 @@ def main():
         window.showMaximized()
         sys.exit(app.exec())
     else:
+        db.close()
         sys.exit(0)
 
 
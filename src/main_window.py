@@ -3,7 +3,7 @@
 
 from PyQt6.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QPushButton,
-    QFrame, QLabel, QMessageBox, QStyleFactory
+    QFrame, QLabel, QMessageBox, QStyleFactory, QStackedWidget
 )
 from PyQt6.QtGui import QFont, QAction, QKeySequence
 from PyQt6.QtCore import Qt
@@ -12,14 +12,23 @@ from .shipments import ShipmentsWidget
 from .products import ProductsWidget
 from .farmers import FarmersWidget
 from .receipts import ReceiptsWidget
+from .reports import ReportsWidget
+from .profit_dashboard import ProfitabilityWidget
 from .manage_widget import ManageWidget
 from .database import Database
+from .diagnostics import DiagnosticsDialog
+from .export_dialog import ExportDialog
+from .table_model import PagedQueryModel
 
 
 class MainWindow(QMainWindow):
     def __init__(self, db: Database):
         super().__init__()
         self.db = db
+        # Screens are built once and kept; each remembers the table versions
+        # it was last up to date with (see Database.table_versions)
+        self.screens = {}
+        self.screen_versions = {}
         self.init_ui()
         self.show_shipments()
 
@@ -58,6 +67,14 @@ class MainWindow(QMainWindow):
         self.manage_btn.clicked.connect(self.show_manage)
         sidebar_layout.addWidget(self.manage_btn)
 
+        self.reports_btn = QPushButton("Reports")
+        self.reports_btn.clicked.connect(self.show_reports)
+        sidebar_layout.addWidget(self.reports_btn)
+
+        self.profitability_btn = QPushButton("Profitability")
+        self.profitability_btn.clicked.connect(self.show_profitability)
+        sidebar_layout.addWidget(self.profitability_btn)
+
         sidebar_layout.addStretch()
 
         self.logout_btn = QPushButton("Logout")
@@ -72,11 +89,17 @@ class MainWindow(QMainWindow):
         self.content_area.setFrameShape(QFrame.Shape.Box)
         self.content_layout = QVBoxLayout()
         self.content_area.setLayout(self.content_layout)
+        self.stack = QStackedWidget()
+        self.content_layout.addWidget(self.stack)
         main_layout.addWidget(self.content_area)
 
         # Menu bar & status bar
         menubar = self.menuBar()
         file_menu = menubar.addMenu("File")
+        export_action = QAction("Export...", self)
+        export_action.setShortcut(QKeySequence("Ctrl+E"))
+        export_action.triggered.connect(self.show_export)
+        file_menu.addAction(export_action)
         logout_action = QAction("Logout", self)
         logout_action.setShortcut(QKeySequence("Ctrl+L"))
         logout_action.triggered.connect(self.logout)
@@ -91,48 +114,72 @@ class MainWindow(QMainWindow):
         new_shipment_action.setShortcut(QKeySequence("Ctrl+N"))
         new_shipment_action.triggered.connect(self.new_shipment)
         tools_menu.addAction(new_shipment_action)
+        diagnostics_action = QAction("Diagnostics", self)
+        diagnostics_action.setShortcut(QKeySequence("Ctrl+D"))
+        diagnostics_action.triggered.connect(self.show_diagnostics)
+        tools_menu.addAction(diagnostics_action)
 
         self.statusBar().showMessage("Ready")
 
-    def clear_content(self):
-        while self.content_layout.count():
-            child = self.content_layout.takeAt(0)
-            if child.widget():
-                child.widget().deleteLater()
+    def show_screen(self, widget_class, status: str):
+        current = self.stack.currentWidget()
+        if current is not None and type(current) is not widget_class:
+            # Nobody is waiting for the screen being left; its pages load on return
+            for model in current.findChildren(PagedQueryModel):
+                model.cancel()
+
+        widget = self.screens.get(widget_class)
+        if widget is None:
+            widget = widget_class(self.db)
+            self.screens[widget_class] = widget
+            self.stack.addWidget(widget)
+            # A screen that reloads itself after its own writes is up to date
+            # too, so switching back to it does not load it again
+            for model in widget.findChildren(PagedQueryModel):
+                model.refreshed.connect(lambda cls=widget_class: self.record_versions(cls))
+        else:
+            versions = self.db.table_versions(widget_class.DEPENDS_ON)
+            if versions != self.screen_versions.get(widget_class):
+                widget.refresh()
+        self.record_versions(widget_class)
+
+        self.stack.setCurrentWidget(widget)
+        self.statusBar().showMessage(status)
+        return widget
+
+    def record_versions(self, widget_class):
+        self.screen_versions[widget_class] = self.db.table_versions(widget_class.DEPENDS_ON)
 
     def show_shipments(self):
-        self.clear_content()
-        self.shipments_widget = ShipmentsWidget(self.db)
-        self.content_layout.addWidget(self.shipments_widget)
-        self.statusBar().showMessage("Shipments")
+        self.shipments_widget = self.show_screen(ShipmentsWidget, "Shipments")
 
     def show_products(self):
-        self.clear_content()
-        self.products_widget = ProductsWidget(self.db)
-        self.content_layout.addWidget(self.products_widget)
-        self.statusBar().showMessage("Products")
+        self.products_widget = self.show_screen(ProductsWidget, "Products")
 
     def show_farmers(self):
-        self.clear_content()
-        self.farmers_widget = FarmersWidget(self.db)
-        self.content_layout.addWidget(self.farmers_widget)
-        self.statusBar().showMessage("Farmers")
+        self.farmers_widget = self.show_screen(FarmersWidget, "Farmers")
 
     def show_receipts(self):
-        self.clear_content()
-        self.receipts_widget = ReceiptsWidget(self.db)
-        self.content_layout.addWidget(self.receipts_widget)
-        self.statusBar().showMessage("Receipts")
+        self.receipts_widget = self.show_screen(ReceiptsWidget, "Receipts")
 
     def show_manage(self):
-        self.clear_content()
-        self.manage_widget = ManageWidget(self.db)
-        self.content_layout.addWidget(self.manage_widget)
-        self.statusBar().showMessage("Stock Management")
+        self.manage_widget = self.show_screen(ManageWidget, "Stock Management")
+
+    def show_reports(self):
+        self.reports_widget = self.show_screen(ReportsWidget, "Reports")
+
+    def show_profitability(self):
+        self.profitability_widget = self.show_screen(ProfitabilityWidget, "Profitability")
 
     def new_shipment(self):
-        if hasattr(self, 'shipments_widget'):
-            self.shipments_widget.add_shipment()
+        self.show_shipments()
+        self.shipments_widget.add_shipment()
+
+    def show_export(self):
+        ExportDialog(self.db, self).exec()
+
+    def show_diagnostics(self):
+        DiagnosticsDialog(self.db, self).exec()
 
     def logout(self):
         self.close()
@@ -0,0 +1,75 @@
+# Maintenance commands for the summary tables kept alongside the history
+#
+#   python -m src.maintenance verify
+#   python -m src.maintenance rebuild product_stock --db shipments.db
+
+import argparse
+import logging
+import sys
+
+from .database import Database
+from .schema import LEDGERS, SEARCH_INDEXES
+
+
+def verify(db: Database, names) -> int:
+    status = 0
+    for name in names:
+        if name in SEARCH_INDEXES:
+            if db.verify_search_index(name):
+                logging.info(f"{name}: in sync")
+            else:
+                logging.error(f"{name}: out of sync with {SEARCH_INDEXES[name][0]}")
+                status = 1
+            continue
+        mismatches = db.verify_ledger(name)
+        for row in mismatches[:20]:
+            logging.warning(f"{name}: {row}")
+        if mismatches:
+            logging.error(f"{name}: {len(mismatches)} row(s) out of sync")
+            status = 1
+        else:
+            logging.info(f"{name}: in sync")
+    return status
+
+
+def rebuild(db: Database, names) -> int:
+    for name in names:
+        if name in SEARCH_INDEXES:
+            db.rebuild_search_index(name)
+        else:
+            db.rebuild_ledger(name)
+        logging.info(f"{name}: rebuilt")
+    return 0
+
+
+# Everything kept in step with the history by triggers
+DERIVED = list(LEDGERS) + list(SEARCH_INDEXES)
+
+COMMANDS = {
+    'verify': verify,
+    'rebuild': rebuild,
+}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Shipment database maintenance")
+    parser.add_argument('command', choices=sorted(COMMANDS))
+    parser.add_argument('ledgers', nargs='*', metavar='ledger',
+                        help=f"derived tables to process: {', '.join(DERIVED)} (default: all)")
+    parser.add_argument('--db', default="shipments.db", help="database file (default: shipments.db)")
+    args = parser.parse_args(argv)
+    unknown = set(args.ledgers) - set(DERIVED)
+    if unknown:
+        parser.error(f"unknown ledger(s): {', '.join(sorted(unknown))}")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    db = Database(args.db)
+    try:
+        return COMMANDS[args.command](db, args.ledgers or list(DERIVED))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,17 +2,34 @@
 # Direct warehouse sales + current stock overview
 
 from PyQt6.QtWidgets import (
-    QWidget, QVBoxLayout, QGroupBox, QFormLayout, QTableWidget,
-    QTableWidgetItem, QComboBox, QDoubleSpinBox, QPushButton,
+    QWidget, QVBoxLayout, QGroupBox, QFormLayout, QTableView,
+    QComboBox, QDoubleSpinBox, QPushButton,
     QHBoxLayout, QLabel, QMessageBox
 )
 from PyQt6.QtGui import QFont
 from decimal import Decimal
+import logging
+import sqlite3
 
 from .database import Database
+from .queries import STOCK_LIST
+from .search import screen_filter
+from .search_box import SearchBox
+from .services import InventoryService
+from .table_model import PagedQueryModel
+
+
+STOCK_COLUMNS = [
+    ("Product", lambda r: r['name']),
+    ("Total Bought", lambda r: f"{Decimal(str(r['total_bought'])):,.2f}"),
+    ("Total Sold", lambda r: f"{Decimal(str(r['total_sold'])):,.2f}"),
+    ("Current Stock", lambda r: f"{Decimal(str(r['current_stock'])):,.2f}"),
+]
 
 
 class ManageWidget(QWidget):
+    DEPENDS_ON = ('products', 'farmers', 'product_stock')
+
     def __init__(self, db: Database):
         super().__init__()
         self.db = db
@@ -22,13 +39,18 @@ class ManageWidget(QWidget):
 
     def init_ui(self):
         layout = QVBoxLayout()
-        layout.addWidget(QLabel("<h2>Stock Management</h2>"))
-
-        self.table = QTableWidget()
-        self.table.setColumnCount(4)
-        self.table.setHorizontalHeaderLabels([
-            "Product", "Total Bought", "Total Sold", "Current Stock"
-        ])
+        header = QHBoxLayout()
+        header.addWidget(QLabel("<h2>Stock Management</h2>"))
+        header.addStretch()
+        self.search_box = SearchBox("Search products...")
+        self.search_box.search.connect(self.search)
+        header.addWidget(self.search_box)
+        layout.addLayout(header)
+
+        self.model = PagedQueryModel(self.db, STOCK_LIST, ('name',), STOCK_COLUMNS,
+                                     background=True, parent=self)
+        self.table = QTableView()
+        self.table.setModel(self.model)
         layout.addWidget(self.table)
 
         # Direct sale box
@@ -69,46 +91,34 @@ class ManageWidget(QWidget):
             self.product_combo.addItem(p['name'], p['id'])
 
     def load_stock(self):
-        query = '''
-            SELECT p.name,
-                   COALESCE(SUM(sp.quantity), 0) as total_bought,
-                   COALESCE(SUM(fp.quantity), 0) as total_sold,
-                   COALESCE(SUM(sp.quantity), 0) - 
-                   COALESCE(SUM(fp.quantity), 0) - 
-                   COALESCE(SUM(r.quantity), 0) as current_stock
-            FROM products p
-            LEFT JOIN shipment_products sp ON p.id = sp.product_id
-            LEFT JOIN farmer_purchases fp ON p.id = fp.product_id
-            LEFT JOIN returns r ON p.id = r.product_id
-            GROUP BY p.id
-            ORDER BY p.name
-        '''
-        data = self.db.execute_query(query)
-        self.table.setRowCount(len(data))
-        for row, item in enumerate(data):
-            self.table.setItem(row, 0, QTableWidgetItem(item['name']))
-            self.table.setItem(row, 1, QTableWidgetItem(f"{Decimal(str(item['total_bought'])):,.2f}"))
-            self.table.setItem(row, 2, QTableWidgetItem(f"{Decimal(str(item['total_sold'])):,.2f}"))
-            self.table.setItem(row, 3, QTableWidgetItem(f"{Decimal(str(item['current_stock'])):,.2f}"))
+        self.model.reload()
+
+    def refresh(self):
+        self.load_stock()
+        self.load_combos()
+
+    def search(self, text: str):
+        self.model.set_filter(*screen_filter('products', text))
+        self.load_stock()
 
     def direct_sell(self):
         farmer_id = self.farmer_combo.currentData()
         product_id = self.product_combo.currentData()
         quantity = self.quantity_spin.value()
         unit_price = self.price_spin.value()
-        total = quantity * unit_price
 
-        if quantity <= 0 or unit_price <= 0:
-            QMessageBox.warning(self, "Error", "Invalid quantity or price")
+        try:
+            InventoryService(self.db).direct_sell(farmer_id, product_id, quantity, unit_price)
+        except ValueError as e:
+            QMessageBox.warning(self, "Error", str(e))
+            return
+        except sqlite3.Error as e:
+            logging.error(f"Failed to record direct sale: {e}")
+            QMessageBox.warning(self, "Error", f"Sale not saved: {e}")
             return
 
-        self.db.execute_update('''
-            INSERT INTO farmer_purchases 
-            (farmer_id, product_id, quantity, unit_price, total_paid)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (farmer_id, product_id, quantity, unit_price, total))
-
+        # Only the sold product's stock moved; its name, the sort key, did not
+        self.model.refresh_rows('id', [product_id])
         QMessageBox.information(self, "Success", "Direct sale recorded")
-        self.load_stock()
         self.quantity_spin.setValue(0.01)
         self.price_spin.setValue(0.01)
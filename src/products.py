@@ -2,16 +2,36 @@
 # Full Products management + statistics
 
 from PyQt6.QtWidgets import (
-    QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QTableWidget,
-    QTableWidgetItem, QLabel, QMessageBox, QInputDialog
+    QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QTableView,
+    QLabel, QMessageBox, QInputDialog
 )
 from PyQt6.QtGui import QFont
 from decimal import Decimal
 
 from .database import Database
+from .queries import PRODUCTS_LIST
+from .search import screen_filter
+from .search_box import SearchBox
+from .services import InventoryService
+from .table_model import PagedQueryModel
+
+
+def amount(value) -> str:
+    return f"{Decimal(str(value)).quantize(Decimal('0.01')):,.2f}"
+
+
+PRODUCT_COLUMNS = [
+    ("Name", lambda r: r['name']),
+    ("Date Added", lambda r: r['created_at'][:10].replace('-', '/')),
+    ("Total Bought", lambda r: amount(r['total_bought'])),
+    ("Total Cost", lambda r: f"{amount(r['total_cost'])} DA"),
+    ("Current Stock", lambda r: amount(r['current_stock'])),
+]
 
 
 class ProductsWidget(QWidget):
+    DEPENDS_ON = ('products', 'product_stock')
+
     def __init__(self, db: Database):
         super().__init__()
         self.db = db
@@ -25,61 +45,41 @@ class ProductsWidget(QWidget):
         header_layout.addWidget(QLabel("<h2>Products</h2>"))
         header_layout.addStretch()
 
+        self.search_box = SearchBox("Search products...")
+        self.search_box.search.connect(self.search)
+        header_layout.addWidget(self.search_box)
+
         add_btn = QPushButton("Add Product")
         add_btn.clicked.connect(self.add_product)
         header_layout.addWidget(add_btn)
 
         layout.addLayout(header_layout)
 
-        self.table = QTableWidget()
-        self.table.setColumnCount(5)
-        self.table.setHorizontalHeaderLabels([
-            "Name", "Date Added", "Total Bought", "Total Cost", "Current Stock"
-        ])
-        self.table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.model = PagedQueryModel(self.db, PRODUCTS_LIST, ('name',), PRODUCT_COLUMNS,
+                                     background=True, parent=self)
+        self.table = QTableView()
+        self.table.setModel(self.model)
         layout.addWidget(self.table)
 
         self.setLayout(layout)
 
     def load_products(self):
-        query = '''
-            SELECT p.id, p.name, p.created_at,
-                   COALESCE(SUM(sp.quantity), 0) as total_bought,
-                   COALESCE(SUM(sp.subtotal), 0) as total_cost,
-                   COALESCE(SUM(sp.quantity), 0) - 
-                   COALESCE(SUM(fp.quantity), 0) - 
-                   COALESCE(SUM(r.quantity), 0) as current_stock
-            FROM products p
-            LEFT JOIN shipment_products sp ON p.id = sp.product_id
-            LEFT JOIN farmer_purchases fp ON p.id = fp.product_id
-            LEFT JOIN returns r ON p.id = r.product_id
-            GROUP BY p.id
-            ORDER BY p.name
-        '''
-        products = self.db.execute_query(query)
-
-        self.table.setRowCount(len(products))
-        for row, product in enumerate(products):
-            self.table.setItem(row, 0, QTableWidgetItem(product['name']))
-
-            date_str = product['created_at'][:10].replace('-', '/')
-            self.table.setItem(row, 1, QTableWidgetItem(date_str))
-
-            bought = Decimal(str(product['total_bought'])).quantize(Decimal('0.01'))
-            self.table.setItem(row, 2, QTableWidgetItem(f"{bought:,.2f}"))
-
-            cost = Decimal(str(product['total_cost'])).quantize(Decimal('0.01'))
-            self.table.setItem(row, 3, QTableWidgetItem(f"{cost:,.2f} DA"))
-
-            stock = Decimal(str(product['current_stock'])).quantize(Decimal('0.01'))
-            self.table.setItem(row, 4, QTableWidgetItem(f"{stock:,.2f}"))
+        self.model.reload()
+
+    def refresh(self):
+        self.load_products()
+
+    def search(self, text: str):
+        self.model.set_filter(*screen_filter('products', text))
+        self.load_products()
 
     def add_product(self):
         name, ok = QInputDialog.getText(self, "Add Product", "Enter product name:")
         if ok and name.strip():
             try:
-                self.db.execute_update('INSERT INTO products (name) VALUES (?)', (name.strip(),))
-                self.load_products()
-                QMessageBox.information(self, "Success", "Product added successfully")
-            except:
-                QMessageBox.warning(self, "Error", "Product name already exists")
+                InventoryService(self.db).add_product(name)
+            except ValueError as e:
+                QMessageBox.warning(self, "Error", str(e))
+                return
+            self.load_products()
+            QMessageBox.information(self, "Success", "Product added successfully")
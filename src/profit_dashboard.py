@@ -0,0 +1,227 @@
+# Profitability dashboard: margins between factory and farmer prices
+
+import time
+
+import numpy as np
+from PyQt6.QtCore import QAbstractTableModel, QDate, QModelIndex, QRectF, Qt
+from PyQt6.QtGui import QColor, QPainter
+from PyQt6.QtWidgets import (
+    QWidget, QVBoxLayout, QHBoxLayout, QLabel, QComboBox, QDateEdit, QCheckBox, QTableView,
+    QHeaderView, QSplitter
+)
+
+from .database import Database
+from .products import amount
+from .profitability import ProfitData, margins, markup_distribution, names
+from .query_runner import QueryRunner
+
+BREAKDOWNS = [("Per product", 'product'), ("Per farmer", 'farmer'), ("Per shipment", 'shipment')]
+
+# (header, margins() column, formatter)
+MARGIN_COLUMNS = [
+    ("Name", 'id', None),
+    ("Sales", 'sales', lambda v: f"{v:,}"),
+    ("Quantity", 'quantity', amount),
+    ("Revenue (DA)", 'revenue', amount),
+    ("Factory Cost (DA)", 'cost', amount),
+    ("Margin (DA)", 'margin', amount),
+    ("Margin %", 'margin_pct', lambda v: f"{v:.1f} %"),
+]
+
+
+class MarginModel(QAbstractTableModel):
+    """The arrays returned by profitability.margins, sorted with NumPy and formatted when displayed."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.groups = {}
+        self.labels = {}
+        self.order = np.empty(0, dtype=np.int64)
+        self.sort_column, self.sort_order = 5, Qt.SortOrder.DescendingOrder
+
+    def set_groups(self, groups: dict, labels: dict):
+        self.beginResetModel()
+        self.groups, self.labels = groups, labels
+        self._sort()
+        self.endResetModel()
+
+    def _sort(self):
+        key = MARGIN_COLUMNS[self.sort_column][1]
+        if not self.groups:
+            self.order = np.empty(0, dtype=np.int64)
+        elif key == 'id':
+            names = np.array([self.labels.get(int(i), "") for i in self.groups['id']])
+            self.order = np.argsort(names, kind='stable')
+        else:
+            self.order = np.argsort(self.groups[key], kind='stable')
+        if self.sort_order == Qt.SortOrder.DescendingOrder:
+            self.order = self.order[::-1]
+
+    def sort(self, column: int, order=Qt.SortOrder.AscendingOrder):
+        self.sort_column, self.sort_order = column, order
+        self.layoutAboutToBeChanged.emit()
+        self._sort()
+        self.layoutChanged.emit()
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.order)
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(MARGIN_COLUMNS)
+
+    def data(self, index: QModelIndex, role=Qt.ItemDataRole.DisplayRole):
+        if role != Qt.ItemDataRole.DisplayRole or not index.isValid():
+            return None
+        _, key, fmt = MARGIN_COLUMNS[index.column()]
+        value = self.groups[key][self.order[index.row()]]
+        if fmt is None:
+            return self.labels.get(int(value), str(value))
+        return fmt(value.item())
+
+    def headerData(self, section: int, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return MARGIN_COLUMNS[section][0]
+        return super().headerData(section, orientation, role)
+
+
+class MarkupHistogram(QWidget):
+    """Bars of markup_distribution()'s histogram; red below cost."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.distribution = None
+        self.setMinimumHeight(160)
+
+    def set_distribution(self, distribution: dict):
+        self.distribution = distribution
+        self.update()
+
+    def paintEvent(self, event):
+        if self.distribution is None or not self.distribution['counts'].any():
+            return
+        counts, edges = self.distribution['counts'], self.distribution['edges']
+        painter = QPainter(self)
+        width, height = self.width(), self.height() - 20
+        bar = width / len(counts)
+        tallest = counts.max()
+        for i, count in enumerate(counts):
+            top = height * (1 - count / tallest)
+            painter.fillRect(QRectF(i * bar + 1, top, bar - 2, height - top),
+                             QColor("#c0392b") if edges[i + 1] <= 0 else QColor("#2980b9"))
+        painter.drawText(QRectF(0, height, width, 20), Qt.AlignmentFlag.AlignLeft, f"{edges[0]:.0f} %")
+        painter.drawText(QRectF(0, height, width, 20), Qt.AlignmentFlag.AlignRight, f"{edges[-1]:.0f} %")
+        painter.end()
+
+
+class ProfitabilityWidget(QWidget):
+    DEPENDS_ON = ('shipments', 'shipment_products', 'farmer_purchases', 'products', 'farmers')
+
+    def __init__(self, db: Database):
+        super().__init__()
+        self.db = db
+        self.data = ProfitData(db)
+        self.runner = QueryRunner(db, label="ProfitabilityWidget (background)", parent=self)
+        self.loading = False
+        self.labels = {}
+        self.init_ui()
+        self.refresh()
+
+    def init_ui(self):
+        layout = QVBoxLayout()
+        layout.addWidget(QLabel("<h2>Profitability</h2>"))
+
+        controls = QHBoxLayout()
+        self.by_combo = QComboBox()
+        for label, by in BREAKDOWNS:
+            self.by_combo.addItem(label, by)
+        self.dates_check = QCheckBox("Only between")
+        self.from_date = QDateEdit(QDate.currentDate().addYears(-1))
+        self.to_date = QDateEdit(QDate.currentDate())
+        for edit in (self.from_date, self.to_date):
+            edit.setCalendarPopup(True)
+            edit.setDisplayFormat("yyyy/MM/dd")
+            edit.dateChanged.connect(self.recompute)
+        self.by_combo.currentIndexChanged.connect(self.recompute)
+        self.dates_check.toggled.connect(self.recompute)
+        controls.addWidget(self.by_combo)
+        controls.addWidget(self.dates_check)
+        controls.addWidget(self.from_date)
+        controls.addWidget(QLabel("–"))
+        controls.addWidget(self.to_date)
+        controls.addStretch()
+        layout.addLayout(controls)
+
+        self.summary_label = QLabel()
+        layout.addWidget(self.summary_label)
+
+        self.model = MarginModel(self)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.setSortingEnabled(True)
+        self.table.sortByColumn(self.model.sort_column, self.model.sort_order)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+
+        histogram = QWidget()
+        histogram_layout = QVBoxLayout(histogram)
+        histogram_layout.setContentsMargins(0, 0, 0, 0)
+        histogram_layout.addWidget(QLabel("<b>Farmer price over factory price, per sale</b>"))
+        self.histogram = MarkupHistogram()
+        histogram_layout.addWidget(self.histogram)
+        self.percentiles_label = QLabel()
+        histogram_layout.addWidget(self.percentiles_label)
+
+        splitter = QSplitter(Qt.Orientation.Vertical)
+        splitter.addWidget(self.table)
+        splitter.addWidget(histogram)
+        splitter.setStretchFactor(0, 3)
+        splitter.setStretchFactor(1, 1)
+        layout.addWidget(splitter)
+
+        self.status = QLabel()
+        layout.addWidget(self.status)
+        self.setLayout(layout)
+
+    def refresh(self):
+        # Only rows added since the last load are read
+        self.loading = True
+        self.status.setText("Loading...")
+        self.runner.submit('load', self.data.refresh, self.loaded, self.load_failed)
+
+    def loaded(self, changed: bool):
+        self.loading = False
+        if changed:
+            self.labels.clear()
+        self.recompute()
+
+    def load_failed(self, error: Exception):
+        self.loading = False
+        self.status.setText(f"Loading failed: {error}")
+
+    def recompute(self):
+        if self.loading:
+            return
+        start = time.perf_counter()
+        by = self.by_combo.currentData()
+        mask = None
+        if self.dates_check.isChecked():
+            mask = self.data.window(self.from_date.date().toString("yyyy-MM-dd"),
+                                    self.to_date.date().toString("yyyy-MM-dd"))
+        groups = margins(self.data, by, mask)
+        distribution = markup_distribution(self.data, mask)
+        if by not in self.labels:
+            self.labels[by] = names(self.db, by)
+        self.model.set_groups(groups, self.labels[by])
+
+        revenue, cost = groups['revenue'].sum(), groups['cost'].sum()
+        share = f"{100 * (revenue - cost) / revenue:.1f} %" if revenue else "–"
+        self.summary_label.setText(
+            f"<b>Revenue:</b> {amount(revenue)} DA &nbsp; <b>Factory cost:</b> {amount(cost)} DA"
+            f" &nbsp; <b>Margin:</b> {amount(revenue - cost)} DA ({share})"
+            f" &nbsp; <b>Sold below cost:</b> {distribution['below_cost']:,} sales,"
+            f" {amount(distribution['below_cost_loss'])} DA")
+        self.histogram.set_distribution(distribution)
+        self.percentiles_label.setText("    ".join(
+            f"p{p}: {v:.1f} %" for p, v in distribution['percentiles'].items()))
+        elapsed = (time.perf_counter() - start) * 1000
+        self.status.setText(f"{int(groups['sales'].sum()):,} sales, {len(groups['id']):,} rows "
+                            f"computed in {elapsed:.0f} ms")
@@ -0,0 +1,212 @@
+# Factory price vs farmer price: margins per shipment, product and farmer on NumPy arrays
+#
+#   python -m src.profitability --by product --top 20
+
+import argparse
+import sys
+import time
+from itertools import chain
+from typing import Dict, Optional
+
+import numpy as np
+
+from .database import Database
+
+# Columns are read in id order and appended, so a refresh only reads new rows
+SALES_QUERY = '''
+    SELECT id, COALESCE(shipment_id, 0), COALESCE(farmer_id, 0), COALESCE(product_id, 0),
+           quantity, unit_price, COALESCE(total_paid, quantity * unit_price), COALESCE(unit_cost, 0),
+           COALESCE(julianday(created_at), 0)
+    FROM farmer_purchases
+    WHERE id > ?
+    ORDER BY id
+'''
+SALE_COLUMNS = ('id', 'shipment_id', 'farmer_id', 'product_id', 'quantity', 'unit_price', 'total_paid', 'unit_cost',
+                'day')
+
+# Group key column of the sales for each breakdown; shipment 0 is direct sales
+GROUPS = {
+    'shipment': 'shipment_id',
+    'product': 'product_id',
+    'farmer': 'farmer_id',
+}
+
+INT_COLUMNS = {'id', 'shipment_id', 'farmer_id', 'product_id'}
+
+
+def _empty(columns) -> Dict[str, np.ndarray]:
+    return {c: np.empty(0, dtype=np.int64 if c in INT_COLUMNS else np.float64) for c in columns}
+
+
+class ProfitData:
+    """Sales held column by column in NumPy arrays.
+
+    refresh() reads only the rows added since the last call, and reloads
+    everything if rows were deleted. Each sale's factory unit cost is the
+    one stored on it when it was written, which the sales rollups and
+    reports also use.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+        self.sales = _empty(SALE_COLUMNS)
+
+    def _read(self, query: str, columns, last_id: int) -> Dict[str, np.ndarray]:
+        # Plain tuples streamed straight into one array: no Row objects and
+        # no Python list of the whole result
+        start = time.perf_counter()
+        cursor = self.db.get_connection().cursor()
+        cursor.row_factory = None
+        try:
+            cursor.execute(query, (last_id,))
+            table = np.fromiter(chain.from_iterable(cursor), dtype=np.float64).reshape(-1, len(columns))
+        finally:
+            cursor.close()
+        if self.db.stats is not None:
+            self.db.stats.record(query, (last_id,), time.perf_counter() - start, len(table))
+        return {c: table[:, i].astype(np.int64) if c in INT_COLUMNS else table[:, i].copy()
+                for i, c in enumerate(columns)}
+
+    def _append(self, name: str, query: str, columns, table: str) -> bool:
+        current = getattr(self, name)
+        last_id = int(current['id'][-1]) if len(current['id']) else 0
+        new = self._read(query, columns, last_id)
+        count = self.db.execute_query(f'SELECT COUNT(*) AS n FROM {table}')[0]['n']
+        if count != len(current['id']) + len(new['id']):
+            # Rows were deleted somewhere before last_id: start over
+            setattr(self, name, self._read(query, columns, 0))
+            return True
+        if len(new['id']):
+            setattr(self, name, {c: np.concatenate((current[c], new[c])) for c in columns})
+            return True
+        return False
+
+    def refresh(self) -> bool:
+        """Bring the arrays up to date; returns whether anything changed."""
+        return self._append('sales', SALES_QUERY, SALE_COLUMNS, 'farmer_purchases')
+
+    def window(self, date_from: Optional[str] = None, date_to: Optional[str] = None) -> np.ndarray:
+        """Mask of the sales made between two days (YYYY-MM-DD, both inclusive)."""
+        mask = np.ones(len(self.sales['id']), dtype=bool)
+        if date_from:
+            mask &= self.sales['day'] >= _julian_day(date_from)
+        if date_to:
+            mask &= self.sales['day'] < _julian_day(date_to) + 1
+        return mask
+
+
+def _julian_day(day: str) -> float:
+    # julianday() of midnight on a YYYY-MM-DD day, as SQLite computes it
+    return np.datetime64(day, 'D').astype(np.int64) + 2440587.5
+
+
+def margins(data: ProfitData, by: str, mask: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+    """Sales count, quantity, revenue, factory cost, margin and margin % per shipment, product or farmer.
+
+    Returns parallel arrays, one entry per group, keyed by column name; 'id'
+    holds the group key.
+    """
+    if by not in GROUPS:
+        raise ValueError(f"unknown breakdown {by!r}")
+    sales = data.sales
+    if mask is None:
+        mask = np.ones(len(sales['id']), dtype=bool)
+    # Keys are ids, so they index the bins directly: no sort needed
+    keys = sales[GROUPS[by]][mask]
+    quantity = sales['quantity'][mask]
+    counts = np.bincount(keys)
+    ids = np.flatnonzero(counts)
+    revenue = np.bincount(keys, weights=sales['total_paid'][mask])[ids]
+    cost = np.bincount(keys, weights=quantity * sales['unit_cost'][mask])[ids]
+    margin = revenue - cost
+    return {
+        'id': ids,
+        'sales': counts[ids],
+        'quantity': np.bincount(keys, weights=quantity)[ids],
+        'revenue': revenue,
+        'cost': cost,
+        'margin': margin,
+        'margin_pct': np.divide(100 * margin, revenue, out=np.zeros(len(ids)), where=revenue != 0),
+    }
+
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def markup_distribution(data: ProfitData, mask: Optional[np.ndarray] = None, bins: int = 30) -> dict:
+    """How far farmer prices sit above the factory price, over the sales with a known cost.
+
+    Returns the histogram of the per-sale markup % (clipped to the 1st-99th
+    percentile so outliers do not flatten it), its percentiles, and the
+    sales sold below cost with the money lost on them.
+    """
+    sales = data.sales
+    if mask is None:
+        mask = np.ones(len(sales['id']), dtype=bool)
+    known = mask & (sales['unit_cost'] > 0)
+    unit_cost = sales['unit_cost'][known]
+    unit_price = sales['unit_price'][known]
+    markup = 100 * (unit_price - unit_cost) / unit_cost
+    below = unit_price < unit_cost
+    result = {
+        'sales': int(known.sum()),
+        'below_cost': int(below.sum()),
+        'below_cost_loss': float(((unit_cost - unit_price) * sales['quantity'][known])[below].sum()),
+        'percentiles': {},
+        'counts': np.zeros(bins, dtype=np.int64),
+        'edges': np.zeros(bins + 1),
+    }
+    if len(markup):
+        # One partition for the clipping bounds and the reported percentiles
+        low, high, *points = np.percentile(markup, (1, 99) + PERCENTILES)
+        result['counts'], result['edges'] = np.histogram(np.clip(markup, low, high), bins=bins,
+                                                         range=(low, high if high > low else low + 1))
+        result['percentiles'] = dict(zip(PERCENTILES, points))
+    return result
+
+
+def names(db: Database, by: str) -> Dict[int, str]:
+    """Display name per group key."""
+    if by == 'shipment':
+        rows = db.execute_query('SELECT id, created_at FROM shipments')
+        labels = {r['id']: f"{r['created_at'][:10]} #{r['id']}" for r in rows}
+        labels[0] = "Direct sales"
+        return labels
+    table = 'products' if by == 'product' else 'farmers'
+    return {r['id']: r['name'] for r in db.execute_query(f'SELECT id, name FROM {table}')}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Margins between factory and farmer prices")
+    parser.add_argument('--db', default="shipments.db", help="database file (default: shipments.db)")
+    parser.add_argument('--by', choices=list(GROUPS), default='product')
+    parser.add_argument('--from', dest='date_from', help="first day, YYYY-MM-DD")
+    parser.add_argument('--to', dest='date_to', help="last day, YYYY-MM-DD")
+    parser.add_argument('--top', type=int, default=20, help="rows to show, by margin (default: 20)")
+    args = parser.parse_args(argv)
+
+    db = Database(args.db)
+    try:
+        data = ProfitData(db)
+        data.refresh()
+        mask = data.window(args.date_from, args.date_to)
+        groups = margins(data, args.by, mask)
+        labels = names(db, args.by)
+        distribution = markup_distribution(data, mask)
+    finally:
+        db.close()
+
+    print(f"{'Name':<30} {'Sales':>7} {'Revenue':>16} {'Cost':>16} {'Margin':>16} {'%':>7}")
+    for i in np.argsort(-groups['margin'])[:args.top]:
+        print(f"{labels.get(int(groups['id'][i]), '?'):<30.30} {groups['sales'][i]:>7} "
+              f"{groups['revenue'][i]:>16,.2f} {groups['cost'][i]:>16,.2f} "
+              f"{groups['margin'][i]:>16,.2f} {groups['margin_pct'][i]:>6.1f}%")
+    print(f"\nMarkup over factory price across {distribution['sales']:,} sales: "
+          + ", ".join(f"p{p} {v:.1f}%" for p, v in distribution['percentiles'].items()))
+    print(f"{distribution['below_cost']:,} sales below cost, "
+          f"losing {distribution['below_cost_loss']:,.2f} DA")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
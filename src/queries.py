@@ -0,0 +1,145 @@
+# Queries behind the list screens, paged by PagedQueryModel on the keys noted
+
+from typing import Optional, Sequence, Tuple
+
+# Keyed on (created_at, id), newest first, or on id
+SHIPMENTS_LIST = '''
+    SELECT s.id, s.created_at, s.notes,
+           ss.product_count, ss.farmer_count, ss.sales_total AS total_paid
+    FROM shipments s
+    JOIN shipment_summary ss ON ss.shipment_id = s.id
+'''
+
+# The same rows keyed on (product_count, id), (farmer_count, id) or
+# (total_paid, id). id comes from shipment_summary here, so both sort keys
+# are read in order off one shipment_summary index.
+SHIPMENTS_BY_SUMMARY = '''
+    SELECT ss.shipment_id AS id, s.created_at, s.notes,
+           ss.product_count, ss.farmer_count, ss.sales_total AS total_paid
+    FROM shipment_summary ss
+    JOIN shipments s ON s.id = ss.shipment_id
+'''
+
+# Ways to sort the shipments list: name -> (query, keyset sort keys)
+SHIPMENT_SORTS = {
+    'id': (SHIPMENTS_LIST, ('id',)),
+    'created_at': (SHIPMENTS_LIST, ('created_at', 'id')),
+    'product_count': (SHIPMENTS_BY_SUMMARY, ('product_count', 'id')),
+    'farmer_count': (SHIPMENTS_BY_SUMMARY, ('farmer_count', 'id')),
+    'total_paid': (SHIPMENTS_BY_SUMMARY, ('total_paid', 'id')),
+}
+
+# Shipments list filters on the result columns, one parameter each
+SHIPMENT_FILTERS = {
+    'date_from': "created_at >= ?",
+    'date_to': "created_at < date(?, '+1 day')",
+    'product_id': "id IN (SELECT shipment_id FROM shipment_products WHERE product_id = ?)",
+    'farmer_id': "id IN (SELECT shipment_id FROM farmer_purchases WHERE farmer_id = ?)",
+    'min_total': "total_paid >= ?",
+    'max_total': "total_paid <= ?",
+}
+
+# Keyed on name
+PRODUCTS_LIST = '''
+    SELECT p.id, p.name, p.created_at,
+           ps.total_bought, ps.total_cost, ps.current_stock
+    FROM products p
+    JOIN product_stock ps ON ps.product_id = p.id
+'''
+
+# Keyed on name; the totals come from farmer_balance, one row per farmer
+FARMERS_LIST = '''
+    SELECT f.id, f.name, f.created_at,
+           fb.total_bought, fb.total_refunded, fb.net_balance, fb.last_activity
+    FROM farmers f
+    JOIN farmer_balance fb ON fb.farmer_id = f.id
+'''
+
+# Keyed on name
+STOCK_LIST = '''
+    SELECT p.id, p.name, ps.total_bought, ps.total_sold, ps.current_stock
+    FROM products p
+    JOIN product_stock ps ON ps.product_id = p.id
+'''
+
+# One farmer's non-zero holdings, straight off the farmer_holdings key
+FARMER_HOLDINGS = '''
+    SELECT h.product_id, p.name, h.quantity
+    FROM farmer_holdings h
+    JOIN products p ON p.id = h.product_id
+    WHERE h.farmer_id = ? AND h.quantity != 0
+'''
+
+# Everything a shipment's receipts need in one round trip: its line items
+# ('item') and the farmer sales ('sale'), each carrying the shipment header.
+# The LEFT JOINs keep a header row for a shipment with no items yet.
+SHIPMENT_RECEIPT = '''
+    SELECT 'item' AS kind, s.created_at, s.notes, NULL AS farmer_id, NULL AS farmer,
+           p.name AS product, sp.quantity, sp.unit_price, sp.subtotal AS total
+    FROM shipments s
+    LEFT JOIN shipment_products sp ON sp.shipment_id = s.id
+    LEFT JOIN products p ON p.id = sp.product_id
+    WHERE s.id = ?
+    UNION ALL
+    SELECT 'sale', s.created_at, s.notes, fp.farmer_id, f.name,
+           p.name, fp.quantity, fp.unit_price, fp.total_paid
+    FROM farmer_purchases fp
+    JOIN shipments s ON s.id = fp.shipment_id
+    JOIN farmers f ON f.id = fp.farmer_id
+    JOIN products p ON p.id = fp.product_id
+    WHERE fp.shipment_id = ?
+'''
+
+# Shipments created between two dates, both inclusive, oldest first
+SHIPMENTS_BETWEEN = '''
+    SELECT id FROM shipments
+    WHERE created_at >= ? AND created_at < date(?, '+1 day')
+    ORDER BY created_at, id
+'''
+
+
+def page_query(query: str, sort_keys: Sequence[str], descending: bool = False,
+               after: Optional[tuple] = None, page_size: int = 200,
+               where: Optional[str] = None, where_params: tuple = ()) -> Tuple[str, tuple]:
+    """Build the keyset-paginated form of ``query``.
+
+    ``after`` holds the sort key values of the last row already fetched; the
+    page starts right after it, so no earlier rows are read again. ``where``
+    is an extra condition on the result columns, such as a search filter,
+    with ``where_params`` for its placeholders.
+    """
+    direction = "DESC" if descending else "ASC"
+    order = ', '.join(f'{key} {direction}' for key in sort_keys)
+    conditions = [where] if where else []
+    params = tuple(where_params) if where else ()
+    if after is not None:
+        keys = ', '.join(sort_keys)
+        marks = ', '.join('?' for _ in sort_keys)
+        conditions.append(f'({keys}) {"<" if descending else ">"} ({marks})')
+        params += tuple(after)
+    sql = f'SELECT * FROM ({query})'
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    return f'{sql} ORDER BY {order} LIMIT ?', params + (page_size,)
+
+
+def combine_filters(filters: Sequence[Tuple[Optional[str], Sequence]]) -> Tuple[Optional[str], tuple]:
+    """AND together (condition, params) filters; a None condition is skipped."""
+    conditions, params = [], ()
+    for condition, values in filters:
+        if condition:
+            conditions.append(f'({condition})')
+            params += tuple(values)
+    return (' AND '.join(conditions) or None), params
+
+
+def shipment_filters(**values) -> Tuple[Optional[str], tuple]:
+    """Condition for the SHIPMENT_FILTERS given by name; None values are left out."""
+    return combine_filters([(SHIPMENT_FILTERS[name], (value,))
+                            for name, value in values.items() if value is not None])
+
+
+def rows_query(query: str, column: str, values: Sequence) -> Tuple[str, tuple]:
+    """Build the form of ``query`` that re-reads only the rows whose ``column`` is in ``values``."""
+    marks = ', '.join('?' for _ in values)
+    return f'SELECT * FROM ({query}) WHERE {column} IN ({marks})', tuple(values)
@@ -0,0 +1,100 @@
+# Background execution of database reads for the GUI
+
+import logging
+import threading
+from typing import Any, Callable, Optional
+
+from PyQt6.QtCore import QObject, QThreadPool, pyqtSignal
+
+from .database import Database
+
+
+class QueryRunner(QObject):
+    """Runs database reads on a thread pool and reports back on the GUI thread.
+
+    Requests are keyed. Submitting again for a key supersedes the earlier
+    request: if it has not started it is skipped, if it is running its
+    connection is interrupted, and only the newest result is delivered.
+    cancel() drops a key's request the same way.
+    """
+
+    _done = pyqtSignal(object, int, object, object)
+
+    def __init__(self, db: Database, pool: Optional[QThreadPool] = None, label: Optional[str] = None,
+                 parent=None):
+        super().__init__(parent)
+        self.db = db
+        # Reported as the caller of these queries in QueryStats
+        self.label = label
+        self.pool = pool or QThreadPool.globalInstance()
+        self._lock = threading.Lock()
+        self._latest = {}
+        self._running = {}
+        self._handlers = {}
+        self._done.connect(self._deliver)
+
+    def submit(self, key, fn: Callable[[], Any], on_result: Callable[[Any], None],
+               on_error: Optional[Callable[[Exception], None]] = None):
+        with self._lock:
+            generation = self._supersede(key)
+        self._handlers[key] = (on_result, on_error)
+        self.pool.start(lambda: self._run(key, generation, fn))
+
+    def cancel(self, key):
+        with self._lock:
+            self._supersede(key)
+        self._handlers.pop(key, None)
+
+    def is_pending(self, key) -> bool:
+        return key in self._handlers
+
+    def _supersede(self, key) -> int:
+        generation = self._latest.get(key, 0) + 1
+        self._latest[key] = generation
+        running = self._running.get(key)
+        if running is not None:
+            running[1].interrupt()
+        return generation
+
+    def _run(self, key, generation: int, fn: Callable[[], Any]):
+        # Runs on a pool thread. Its pooled connection goes back to the pool
+        # afterwards, since QThreadPool retires idle threads without telling us.
+        try:
+            self._run_task(key, generation, fn)
+        finally:
+            self.db.pool.release()
+
+    def _run_task(self, key, generation: int, fn: Callable[[], Any]):
+        conn = self.db.get_connection()
+        with self._lock:
+            if self._latest.get(key) != generation:
+                return
+            self._running[key] = (generation, conn)
+        result = error = None
+        if self.db.stats is not None:
+            self.db.stats.set_context(self.label)
+        try:
+            result = fn()
+        except Exception as e:
+            error = e
+        finally:
+            if self.db.stats is not None:
+                self.db.stats.set_context(None)
+            with self._lock:
+                if self._running.get(key, (None,))[0] == generation:
+                    del self._running[key]
+        self._done.emit(key, generation, result, error)
+
+    def _deliver(self, key, generation: int, result, error):
+        if self._latest.get(key) != generation:
+            return
+        handlers = self._handlers.pop(key, None)
+        if handlers is None:
+            return
+        on_result, on_error = handlers
+        if error is None:
+            on_result(result)
+        elif on_error is not None:
+            on_error(error)
+        else:
+            logging.error(f"Background query failed: {error}")
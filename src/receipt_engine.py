@@ -0,0 +1,319 @@
+# Receipt rendering: factory, per-farmer and per-shipment receipts
+#
+#   python -m src.receipt_engine --shipment 12 --out receipts/
+#   python -m src.receipt_engine --from 2025-01-01 --to 2025-01-31 --out receipts/ --format pdf
+#
+# Each shipment's data comes from one query (SHIPMENT_RECEIPT). The page
+# layouts are specialised per receipt type once, at import, so rendering a
+# receipt only fills in its rows and totals. Batches are split across a
+# process pool; every worker opens its own read-only connection.
+
+import argparse
+import html
+import logging
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
+
+from .queries import SHIPMENT_RECEIPT, SHIPMENTS_BETWEEN
+
+PAGE = '''<html><head><style>
+    body {{{{ font-family: Arial; margin: 40px; }}}}
+    .title {{{{ font-size: 28px; font-weight: bold; color: {color}; text-align: center; }}}}
+    table {{{{ width: 100%; border-collapse: collapse; margin: 30px 0; }}}}
+    th, td {{{{ border: 1px solid #000; padding: 12px; text-align: left; }}}}
+    th {{{{ background: #f0f0f0; }}}}
+    .total {{{{ font-size: 20px; font-weight: bold; text-align: right; }}}}
+</style></head><body>
+    <div class="title">{title}<br>#{{number}}</div>
+    <p style="text-align:center;">{{subtitle}}Date: {{date}}</p>
+    <table><tr>{header}</tr>{{rows}}</table>
+    <div class="total">TOTAL: DA {{total:,.2f}}</div>
+</body></html>
+'''
+
+# type -> (title, colour, columns, row template)
+RECEIPT_TYPES = {
+    'factory': ("FACTORY PURCHASE RECEIPT", "blue", ("Product", "Qty", "Price", "Total"),
+                '<tr><td>{product}</td><td>{quantity:g}</td><td>DA {unit_price:,.2f}</td><td>DA {total:,.2f}</td></tr>'),
+    'farmer': ("FARMER SALE RECEIPT", "green", ("Product", "Qty", "Price", "Total"),
+               '<tr><td>{product}</td><td>{quantity:g}</td><td>DA {unit_price:,.2f}</td><td>DA {total:,.2f}</td></tr>'),
+    'shipment': ("SHIPMENT RECEIPT", "#ff6600", ("Farmer", "Product", "Qty", "Price", "Total"),
+                 '<tr><td>{farmer}</td><td>{product}</td><td>{quantity:g}</td>'
+                 '<td>DA {unit_price:,.2f}</td><td>DA {total:,.2f}</td></tr>'),
+}
+
+# Layouts with title, colour and header filled in; only {number},
+# {subtitle}, {date}, {rows} and {total} are left for each receipt (PAGE is
+# formatted twice, hence its quadrupled and doubled braces)
+TEMPLATES = {
+    kind: (PAGE.format(title=title, color=color, header=''.join(f'<th>{c}</th>' for c in columns)), row)
+    for kind, (title, color, columns, row) in RECEIPT_TYPES.items()
+}
+
+FORMATS = ('html', 'pdf')
+
+
+def fetch_shipment(conn: sqlite3.Connection, shipment_id: int) -> Optional[dict]:
+    """Header, line items and farmer sales of one shipment, from a single query."""
+    return _assemble(shipment_id, conn.execute(SHIPMENT_RECEIPT, (shipment_id, shipment_id)).fetchall())
+
+
+def load_shipment(db, shipment_id: int) -> Optional[dict]:
+    """fetch_shipment through a Database, so the query shows up in its stats."""
+    return _assemble(shipment_id, db.fetch_rows(SHIPMENT_RECEIPT, (shipment_id, shipment_id)))
+
+
+def _assemble(shipment_id: int, rows: List[sqlite3.Row]) -> Optional[dict]:
+    if not rows:
+        return None
+    shipment = {
+        'id': shipment_id,
+        'created_at': rows[0]['created_at'],
+        'notes': rows[0]['notes'],
+        'items': [],
+        'sales': [],
+    }
+    for row in rows:
+        if row['kind'] == 'item':
+            if row['product'] is not None:
+                shipment['items'].append(dict(row))
+        else:
+            shipment['sales'].append(dict(row))
+    shipment['sales'].sort(key=lambda s: (s['farmer'], s['product']))
+    return shipment
+
+
+def farmers_in(shipment: dict) -> List[Tuple[int, str]]:
+    seen = {}
+    for sale in shipment['sales']:
+        seen.setdefault(sale['farmer_id'], sale['farmer'])
+    return list(seen.items())
+
+
+def _render(kind: str, number: str, date: str, lines: List[dict], subtitle: str = '') -> str:
+    page, row = TEMPLATES[kind]
+    # A NULL quantity, price or total prints as 0 rather than failing the format
+    rows = ''.join(row.format(**{**line, 'product': html.escape(line['product'] or ''),
+                                 'farmer': html.escape(line['farmer'] or ''),
+                                 'quantity': line['quantity'] or 0, 'unit_price': line['unit_price'] or 0,
+                                 'total': line['total'] or 0})
+                   for line in lines)
+    return page.format(number=number, subtitle=subtitle, date=date, rows=rows,
+                       total=sum(line['total'] or 0 for line in lines))
+
+
+def _date(shipment: dict) -> str:
+    return datetime.fromisoformat(shipment['created_at']).strftime("%d/%m/%Y %H:%M")
+
+
+def render_receipt(shipment: dict, kind: str, farmer_id: Optional[int] = None) -> str:
+    """HTML for one receipt; ``farmer_id`` picks the farmer for 'farmer' receipts."""
+    if kind == 'factory':
+        return _render(kind, str(shipment['id']), _date(shipment), shipment['items'])
+    if kind == 'farmer':
+        lines = [s for s in shipment['sales'] if s['farmer_id'] == farmer_id]
+        name = lines[0]['farmer'] if lines else ''
+        return _render(kind, f"{shipment['id']}-{farmer_id}", _date(shipment), lines,
+                       f"{html.escape(name)}<br>")
+    if kind == 'shipment':
+        return _render(kind, str(shipment['id']), _date(shipment), shipment['sales'])
+    raise ValueError(f"unknown receipt type {kind!r}")
+
+
+def shipment_receipts(shipment: dict, kinds: Sequence[str] = tuple(RECEIPT_TYPES)) -> Iterator[Tuple[str, str]]:
+    """(file stem, html) for every receipt of a shipment, one per farmer for 'farmer'."""
+    for kind in kinds:
+        if kind == 'farmer':
+            for farmer_id, _ in farmers_in(shipment):
+                yield f"shipment-{shipment['id']}-farmer-{farmer_id}", render_receipt(shipment, kind, farmer_id)
+        elif kind == 'factory':
+            yield f"shipment-{shipment['id']}-factory", render_receipt(shipment, kind)
+        else:
+            yield f"shipment-{shipment['id']}", render_receipt(shipment, kind)
+
+
+# Everything a receipt is built from; any write to these makes cached receipts stale
+RECEIPT_TABLES = ('shipments', 'shipment_products', 'farmer_purchases', 'products', 'farmers')
+
+
+class ReceiptCache:
+    """Rendered receipts keyed by (type, entity, data version), least recently used evicted.
+
+    The data version is Database.table_versions(RECEIPT_TABLES), so a hit
+    skips both the query and the rendering until one of those tables is
+    written. A miss loads the shipment once and keeps it for the other
+    receipts of the same shipment.
+    """
+
+    def __init__(self, db, capacity: int = 256):
+        self.db = db
+        self.capacity = capacity
+        self._entries: OrderedDict = OrderedDict()
+        self._shipment: Optional[Tuple[tuple, dict]] = None
+        self.hits = self.misses = 0
+
+    def _lookup(self, key: tuple, build: Callable[[], object]):
+        key = key + (self.db.table_versions(RECEIPT_TABLES),)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+        self.misses += 1
+        value = self._entries[key] = build()
+        if len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+        return value
+
+    def _load(self, shipment_id: int) -> Optional[dict]:
+        key = (shipment_id, self.db.table_versions(RECEIPT_TABLES))
+        if self._shipment is None or self._shipment[0] != key:
+            self._shipment = (key, load_shipment(self.db, shipment_id))
+        return self._shipment[1]
+
+    def farmers(self, shipment_id: int) -> List[Tuple[int, str]]:
+        """The farmers a shipment was sold to, as (id, name)."""
+        return self._lookup(('farmers', shipment_id), lambda: farmers_in(self._load(shipment_id) or {'sales': []}))
+
+    def receipt(self, kind: str, shipment_id: int, farmer_id: Optional[int] = None) -> Optional[str]:
+        """HTML of one receipt, or None if the shipment does not exist."""
+        def build():
+            shipment = self._load(shipment_id)
+            return render_receipt(shipment, kind, farmer_id) if shipment is not None else None
+        return self._lookup((kind, shipment_id, farmer_id), build)
+
+    def clear(self):
+        self._entries.clear()
+        self._shipment = None
+
+
+def write_pdf(html_text: str, path: str):
+    # Needs a QGuiApplication; the batch workers create one
+    from PyQt6.QtGui import QPageSize, QPdfWriter, QTextDocument
+    document = QTextDocument()
+    document.setHtml(html_text)
+    writer = QPdfWriter(path)
+    writer.setPageSize(QPageSize(QPageSize.PageSizeId.A4))
+    document.print(writer)
+
+
+# A worker's QGuiApplication, kept alive for PDF output
+_app = None
+
+
+def _worker_init(fmt: str):
+    global _app
+    if fmt == 'pdf':
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        from PyQt6.QtGui import QGuiApplication
+        _app = QGuiApplication.instance() or QGuiApplication([])
+
+
+def _connect_read_only(db_path: str) -> sqlite3.Connection:
+    # As a file: URI, so ?, # and % in the path are escaped rather than read as URI syntax
+    return sqlite3.connect(Path(db_path).resolve().as_uri() + '?mode=ro', uri=True)
+
+
+def _render_chunk(db_path: str, shipment_ids: List[int], out_dir: str, kinds: Sequence[str], fmt: str) -> int:
+    conn = _connect_read_only(db_path)
+    conn.row_factory = sqlite3.Row
+    written = 0
+    try:
+        for shipment_id in shipment_ids:
+            shipment = fetch_shipment(conn, shipment_id)
+            if shipment is None:
+                continue
+            for stem, page in shipment_receipts(shipment, kinds):
+                path = os.path.join(out_dir, f"{stem}.{fmt}")
+                if fmt == 'pdf':
+                    write_pdf(page, path)
+                else:
+                    with open(path, 'w', encoding='utf-8') as f:
+                        f.write(page)
+                written += 1
+    finally:
+        conn.close()
+    return written
+
+
+def render_batch(db_path: str, shipment_ids: Sequence[int], out_dir: str,
+                 kinds: Sequence[str] = tuple(RECEIPT_TYPES), fmt: str = 'html',
+                 workers: Optional[int] = None, chunk_size: Optional[int] = None,
+                 progress: Optional[Callable[[int, int], None]] = None) -> int:
+    """Write every receipt of the given shipments to ``out_dir``; returns the file count.
+
+    Shipments are handed to worker processes ``chunk_size`` at a time (by
+    default small enough to keep every worker busy, at most 50) and
+    ``progress(done, total)`` is called as chunks finish.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format {fmt!r}")
+    os.makedirs(out_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    if chunk_size is None:
+        chunk_size = max(1, min(50, -(-len(shipment_ids) // (workers * 4))))
+    chunks = [list(shipment_ids[i:i + chunk_size]) for i in range(0, len(shipment_ids), chunk_size)]
+    written = done = 0
+    # spawn, not fork: the parent may be running Qt
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_worker_init, initargs=(fmt,)) as pool:
+        futures = {pool.submit(_render_chunk, os.path.abspath(db_path), chunk, out_dir, kinds, fmt): len(chunk)
+                   for chunk in chunks}
+        for future in as_completed(futures):
+            written += future.result()
+            done += futures[future]
+            if progress is not None:
+                progress(done, len(shipment_ids))
+    return written
+
+
+def shipments_between(conn: sqlite3.Connection, date_from: str, date_to: str) -> List[int]:
+    """Ids of shipments created between two 'YYYY-MM-DD' dates, both inclusive."""
+    return [row[0] for row in conn.execute(SHIPMENTS_BETWEEN, (date_from, date_to))]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Render shipment receipts to HTML or PDF files")
+    parser.add_argument('--shipment', type=int, action='append', help="shipment id (repeatable)")
+    parser.add_argument('--from', dest='date_from', metavar='YYYY-MM-DD')
+    parser.add_argument('--to', dest='date_to', metavar='YYYY-MM-DD')
+    parser.add_argument('--kinds', default=','.join(RECEIPT_TYPES),
+                        help=f"comma-separated receipt types (default: {','.join(RECEIPT_TYPES)})")
+    parser.add_argument('--format', choices=FORMATS, default='html')
+    parser.add_argument('--out', default='receipts', help="output directory (default: receipts)")
+    parser.add_argument('--workers', type=int, help="worker processes (default: one per CPU)")
+    parser.add_argument('--db', default="shipments.db", help="database file (default: shipments.db)")
+    args = parser.parse_args(argv)
+    kinds = [k for k in args.kinds.split(',') if k]
+    unknown = set(kinds) - set(RECEIPT_TYPES)
+    if unknown:
+        parser.error(f"unknown receipt type(s): {', '.join(sorted(unknown))}")
+    if not args.shipment and not (args.date_from and args.date_to):
+        parser.error("give --shipment or both --from and --to")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    shipment_ids = list(args.shipment or [])
+    if args.date_from and args.date_to:
+        conn = _connect_read_only(args.db)
+        try:
+            shipment_ids += shipments_between(conn, args.date_from, args.date_to)
+        finally:
+            conn.close()
+
+    start = time.perf_counter()
+    written = render_batch(args.db, shipment_ids, args.out, kinds, args.format, args.workers)
+    logging.info(f"Wrote {written:,} receipts for {len(shipment_ids):,} shipments to {args.out} "
+                 f"in {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,56 +1,142 @@
 # === Contribution by Member 3 – radjab beddiar – DevOps Project 2025 ===
 # Receipt generation (factory, farmer, shipment)
 
-from PyQt6.QtWidgets import QWidget, QVBoxLayout, QLabel, QGroupBox, QPushButton, QTextBrowser
+import time
+
+from PyQt6.QtCore import Qt
+from PyQt6.QtWidgets import (
+    QWidget, QVBoxLayout, QHBoxLayout, QLabel, QGroupBox, QPushButton, QTextBrowser,
+    QTableView, QComboBox, QFormLayout, QSplitter, QFileDialog, QMessageBox
+)
 from PyQt6.QtGui import QFont
 
+from .database import Database
+from .queries import SHIPMENTS_LIST
+from .receipt_engine import ReceiptCache, write_pdf
+from .shipments import SHIPMENT_COLUMNS
+from .table_model import PagedQueryModel
+
+RECEIPT_KINDS = [
+    ("Factory Purchase Receipt", 'factory'),
+    ("Farmer Sale Receipt", 'farmer'),
+    ("Shipment Receipt", 'shipment'),
+]
+
+
 class ReceiptsWidget(QWidget):
-    def __init__(self, db):
+    DEPENDS_ON = ('shipments', 'shipment_summary')
+
+    def __init__(self, db: Database):
         super().__init__()
         self.db = db
+        self.cache = ReceiptCache(db)
+        self.html = None
         layout = QVBoxLayout()
         layout.addWidget(QLabel("<h2>Receipts</h2>"))
 
-        group = QGroupBox("Generate Sample Receipts")
-        g_layout = QVBoxLayout()
-        QPushButton("Factory Purchase Receipt", clicked=self.factory).setParent(self)
-        g_layout.addWidget(QPushButton("Factory Purchase Receipt", clicked=self.factory))
-        g_layout.addWidget(QPushButton("Farmer Sale Receipt", clicked=self.farmer))
-        g_layout.addWidget(QPushButton("Shipment Receipt", clicked=self.shipment))
-        group.setLayout(g_layout)
-        layout.addWidget(group)
+        self.model = PagedQueryModel(self.db, SHIPMENTS_LIST, ('created_at', 'id'), SHIPMENT_COLUMNS,
+                                     descending=True, background=True, parent=self)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.setSelectionBehavior(QTableView.SelectionBehavior.SelectRows)
+        self.table.selectionModel().currentRowChanged.connect(self.shipment_selected)
+
+        group = QGroupBox("Generate Receipt")
+        form = QFormLayout()
+        self.kind_combo = QComboBox()
+        for label, kind in RECEIPT_KINDS:
+            self.kind_combo.addItem(label, kind)
+        self.kind_combo.currentIndexChanged.connect(self.kind_changed)
+        form.addRow("Receipt:", self.kind_combo)
+        self.farmer_combo = QComboBox()
+        self.farmer_combo.currentIndexChanged.connect(self.show_receipt)
+        form.addRow("Farmer:", self.farmer_combo)
+        buttons = QHBoxLayout()
+        self.save_btn = QPushButton("Save...", clicked=self.save_receipt)
+        buttons.addStretch()
+        buttons.addWidget(self.save_btn)
+        form.addRow(buttons)
+        self.status = QLabel("Select a shipment")
+        form.addRow(self.status)
+        group.setLayout(form)
 
         self.preview = QTextBrowser()
-        layout.addWidget(self.preview)
+        right = QWidget()
+        right_layout = QVBoxLayout(right)
+        right_layout.setContentsMargins(0, 0, 0, 0)
+        right_layout.addWidget(group)
+        right_layout.addWidget(self.preview)
+
+        splitter = QSplitter(Qt.Orientation.Horizontal)
+        splitter.addWidget(self.table)
+        splitter.addWidget(right)
+        splitter.setStretchFactor(0, 2)
+        splitter.setStretchFactor(1, 3)
+        layout.addWidget(splitter)
         self.setLayout(layout)
 
-    def factory(self):
-        self.preview.setHtml(self.html_template("FACTORY PURCHASE RECEIPT", "#0066cc"))
-
-    def farmer(self):
-        self.preview.setHtml(self.html_template("FARMER SALE RECEIPT", "#00aa00"))
-
-    def shipment(self):
-        self.preview.setHtml(self.html_template("SHIPMENT RECEIPT", "#ff6600"))
-
-    def html_template(self, title, color):
-        from datetime import datetime
-        now = datetime.now().strftime("%d/%m/%Y %H:%M")
-        return f"""
-        <html><head><style>
-        body {{font-family: Arial; margin: 40px;}}
-        .title {{font-size: 28px; color: {color}; text-align: center; font-weight: bold;}}
-        table {{width: 100%; border-collapse: collapse; margin: 30px 0;}}
-        th, td {{border: 1px solid #000; padding: 12px;}}
-        th {{background: #f0f0f0;}}
-        .total {{font-size: 20px; font-weight: bold; text-align: right;}}
-        </style></head><body>
-        <div class="title">{title}</div>
-        <p style="text-align:center;">Generated: {now}</p>
-        <table>
-            <tr><th>Item</th><th>Qty</th><th>Price</th><th>Subtotal</th></tr>
-            <tr><td>Sample Product</td><td>100</td><td>DA 50.00</td><td>DA 5,000.00</td></tr>
-        </table>
-        <div class="total">Total: DA 5,000.00</div>
-        </body></html>
-        """
+        self.kind_changed()
+        self.model.reload()
+
+    def refresh(self):
+        self.model.reload()
+        self.preview.clear()
+        self.html = None
+        self.save_btn.setEnabled(False)
+        self.status.setText("Select a shipment")
+
+    def selected_shipment(self):
+        return self.model.row_at(self.table.currentIndex().row())
+
+    def shipment_selected(self, current, previous=None):
+        self.load_farmers()
+        self.show_receipt()
+
+    def kind_changed(self):
+        self.farmer_combo.setEnabled(self.kind_combo.currentData() == 'farmer')
+        self.show_receipt()
+
+    def load_farmers(self):
+        shipment = self.selected_shipment()
+        self.farmer_combo.blockSignals(True)
+        self.farmer_combo.clear()
+        if shipment is not None:
+            for farmer_id, name in self.cache.farmers(shipment['id']):
+                self.farmer_combo.addItem(name, farmer_id)
+        self.farmer_combo.blockSignals(False)
+
+    def show_receipt(self):
+        shipment = self.selected_shipment()
+        kind = self.kind_combo.currentData()
+        farmer_id = self.farmer_combo.currentData() if kind == 'farmer' else None
+        self.html = None
+        if shipment is not None and (kind != 'farmer' or farmer_id is not None):
+            hits = self.cache.hits
+            start = time.perf_counter()
+            self.html = self.cache.receipt(kind, shipment['id'], farmer_id)
+            elapsed = (time.perf_counter() - start) * 1000
+            source = "cached" if self.cache.hits > hits else f"rendered in {elapsed:.1f} ms"
+            self.status.setText(f"Shipment #{shipment['id']}: {source}")
+        elif shipment is not None:
+            self.status.setText(f"Shipment #{shipment['id']} has no farmer sales")
+        if self.html is None:
+            self.preview.clear()
+        else:
+            self.preview.setHtml(self.html)
+        self.save_btn.setEnabled(self.html is not None)
+
+    def save_receipt(self):
+        if self.html is None:
+            return
+        path, _ = QFileDialog.getSaveFileName(self, "Save Receipt", "receipt.pdf",
+                                              "PDF (*.pdf);;HTML (*.html)")
+        if not path:
+            return
+        try:
+            if path.endswith('.html'):
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(self.html)
+            else:
+                write_pdf(self.html, path)
+        except OSError as e:
+            QMessageBox.warning(self, "Error", f"Receipt not saved: {e}")
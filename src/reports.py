@@ -0,0 +1,152 @@
+# Sales reports: revenue, cost and margin per day, week, month or year
+
+import time
+
+from PyQt6.QtCore import QAbstractTableModel, QDate, QModelIndex, Qt
+from PyQt6.QtWidgets import (
+    QWidget, QVBoxLayout, QHBoxLayout, QLabel, QComboBox, QDateEdit, QTableView, QHeaderView
+)
+
+from .database import Database
+from .products import amount
+from .query_runner import QueryRunner
+from .rollups import report
+
+REPORT_PERIODS = [("Daily", 'day'), ("Weekly", 'week'), ("Monthly", 'month'), ("Yearly", 'year')]
+REPORT_DIMENSIONS = [("Per product", 'product'), ("Per farmer", 'farmer'), ("Total", 'total')]
+
+REPORT_COLUMNS = [
+    ("Period", lambda r: r['period']),
+    ("Name", lambda r: r['name']),
+    ("Quantity", lambda r: amount(r['quantity'])),
+    ("Revenue (DA)", lambda r: amount(r['revenue'])),
+    ("Cost (DA)", lambda r: amount(r['cost'])),
+    ("Refunds (DA)", lambda r: amount(r['refunds'])),
+    ("Margin (DA)", lambda r: amount(r['margin'])),
+    ("Margin %", lambda r: f"{100 * r['margin'] / r['revenue']:.1f} %" if r['revenue'] else ""),
+]
+
+
+class ReportModel(QAbstractTableModel):
+    """Report rows as returned by rollups.report, formatted when displayed."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.rows = []
+
+    def set_rows(self, rows):
+        self.beginResetModel()
+        self.rows = rows
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(REPORT_COLUMNS)
+
+    def data(self, index: QModelIndex, role=Qt.ItemDataRole.DisplayRole):
+        if role != Qt.ItemDataRole.DisplayRole or not index.isValid():
+            return None
+        return REPORT_COLUMNS[index.column()][1](self.rows[index.row()])
+
+    def headerData(self, section: int, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return REPORT_COLUMNS[section][0]
+        return super().headerData(section, orientation, role)
+
+
+class ReportsWidget(QWidget):
+    DEPENDS_ON = ('products', 'farmers', 'product_sales_daily', 'farmer_sales_daily')
+
+    def __init__(self, db: Database):
+        super().__init__()
+        self.db = db
+        self.runner = QueryRunner(db, label="ReportsWidget (background)", parent=self)
+        self.started = 0.0
+        self.init_ui()
+        self.load_entities()
+
+    def init_ui(self):
+        layout = QVBoxLayout()
+        layout.addWidget(QLabel("<h2>Reports</h2>"))
+
+        controls = QHBoxLayout()
+        self.period_combo = QComboBox()
+        for label, period in REPORT_PERIODS:
+            self.period_combo.addItem(label, period)
+        self.period_combo.setCurrentIndex(2)
+        self.by_combo = QComboBox()
+        for label, by in REPORT_DIMENSIONS:
+            self.by_combo.addItem(label, by)
+        self.entity_combo = QComboBox()
+        self.from_date = QDateEdit(QDate.currentDate().addYears(-1))
+        self.to_date = QDateEdit(QDate.currentDate())
+        for edit in (self.from_date, self.to_date):
+            edit.setCalendarPopup(True)
+            edit.setDisplayFormat("yyyy/MM/dd")
+        controls.addWidget(self.period_combo)
+        controls.addWidget(self.by_combo)
+        controls.addWidget(self.entity_combo)
+        controls.addWidget(QLabel("From:"))
+        controls.addWidget(self.from_date)
+        controls.addWidget(QLabel("To:"))
+        controls.addWidget(self.to_date)
+        controls.addStretch()
+        layout.addLayout(controls)
+
+        self.model = ReportModel(self)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.horizontalHeader().setSectionResizeMode(1, QHeaderView.ResizeMode.Stretch)
+        layout.addWidget(self.table)
+
+        self.totals_label = QLabel()
+        self.status = QLabel()
+        layout.addWidget(self.totals_label)
+        layout.addWidget(self.status)
+        self.setLayout(layout)
+
+        self.by_combo.currentIndexChanged.connect(self.load_entities)
+        for combo in (self.period_combo, self.entity_combo):
+            combo.currentIndexChanged.connect(self.run_report)
+        for edit in (self.from_date, self.to_date):
+            edit.dateChanged.connect(self.run_report)
+
+    def refresh(self):
+        self.load_entities()
+
+    def load_entities(self):
+        by = self.by_combo.currentData()
+        self.entity_combo.blockSignals(True)
+        self.entity_combo.clear()
+        self.entity_combo.addItem("All", None)
+        if by != 'total':
+            table = 'products' if by == 'product' else 'farmers'
+            for e in self.db.execute_query(f'SELECT id, name FROM {table} ORDER BY name'):
+                self.entity_combo.addItem(e['name'], e['id'])
+        self.entity_combo.setEnabled(by != 'total')
+        self.entity_combo.blockSignals(False)
+        self.run_report()
+
+    def run_report(self):
+        args = (self.period_combo.currentData(), self.by_combo.currentData(),
+                self.from_date.date().toString("yyyy-MM-dd"), self.to_date.date().toString("yyyy-MM-dd"),
+                self.entity_combo.currentData())
+        self.status.setText("Loading...")
+        self.started = time.perf_counter()
+        self.runner.submit('report', lambda: report(self.db, *args), self.show_report, self.report_failed)
+
+    def show_report(self, rows):
+        self.model.set_rows(rows)
+        revenue = sum(r['revenue'] for r in rows)
+        margin = sum(r['margin'] for r in rows)
+        self.totals_label.setText(
+            f"<b>Revenue:</b> {amount(revenue)} DA &nbsp; <b>Cost:</b> {amount(sum(r['cost'] for r in rows))} DA"
+            f" &nbsp; <b>Refunds:</b> {amount(sum(r['refunds'] for r in rows))} DA"
+            f" &nbsp; <b>Margin:</b> {amount(margin)} DA")
+        elapsed = (time.perf_counter() - self.started) * 1000
+        self.status.setText(f"{len(rows):,} rows in {elapsed:.0f} ms")
+
+    def report_failed(self, error: Exception):
+        self.status.setText(f"Report failed: {error}")
@@ -0,0 +1,100 @@
+# Sales reports by day, week, month or year, answered from the daily rollups
+#
+#   python -m src.rollups --period month --by product --from 2025-01-01 --to 2025-12-31
+
+import argparse
+import csv
+import sys
+from typing import Dict, List, Optional
+
+from .database import Database
+
+# Label of the period a day (YYYY-MM-DD) falls in; weeks start on Monday
+PERIODS = {
+    'day': "day",
+    'week': "date(day, '-' || ((strftime('%w', day) + 6) % 7) || ' days')",
+    'month': "substr(day, 1, 7)",
+    'year': "substr(day, 1, 4)",
+}
+
+# What a report row is about: (rollup table, its key column, table naming the key)
+DIMENSIONS = {
+    'product': ('product_sales_daily', 'product_id', 'products'),
+    'farmer': ('farmer_sales_daily', 'farmer_id', 'farmers'),
+    'total': ('product_sales_daily', None, None),
+}
+
+MEASURES = ('quantity', 'revenue', 'cost', 'refunds', 'margin')
+
+
+def report_query(period: str, by: str, filtered: bool = False) -> str:
+    """Query merging the day buckets in a range into ``period`` rows per ``by``.
+
+    Parameters are ([entity id,] first day, last day). It reads one row per
+    day and product (or farmer) in the range, so it costs the same however
+    many sales those days hold; coarser periods group the buckets they merge.
+    Rows come out unordered.
+    """
+    if period not in PERIODS:
+        raise ValueError(f"unknown period {period!r}")
+    if by not in DIMENSIONS:
+        raise ValueError(f"unknown dimension {by!r}")
+    table, key, names = DIMENSIONS[by]
+    if filtered and key is None:
+        raise ValueError("a total report covers every product")
+    where = f'{key} = ? AND day BETWEEN ? AND ?' if filtered else 'day BETWEEN ? AND ?'
+    name = f'(SELECT name FROM {names} WHERE id = {key})' if key else "'All'"
+    return f'''
+        SELECT {PERIODS[period]} AS period, {key or 'NULL'} AS id, {name} AS name,
+               SUM(quantity) AS quantity, SUM(revenue) AS revenue, SUM(cost) AS cost,
+               SUM(refunds) AS refunds, SUM(revenue) - SUM(refunds) - SUM(cost) AS margin
+        FROM {table}
+        WHERE {where}
+        GROUP BY {'1' if key is None else '1, 2'}
+    '''
+
+
+def report(db: Database, period: str = 'month', by: str = 'product', date_from: Optional[str] = None,
+           date_to: Optional[str] = None, entity_id: Optional[int] = None) -> List[Dict]:
+    """Quantity, revenue, cost, refunds and margin per period and product, farmer or in total.
+
+    Dates are YYYY-MM-DD and both inclusive; ``entity_id`` narrows the report
+    to one product or farmer, following ``by``. Margin is revenue less
+    refunds and the cost of the goods sold.
+    """
+    span = (date_from or '0000-01-01', date_to or '9999-12-31')
+    params = span if entity_id is None else (entity_id,) + span
+    rows = db.execute_query(report_query(period, by, entity_id is not None), params)
+    rows.sort(key=lambda r: (r['period'], r['name']))
+    return rows
+
+
+REPORT_COLUMNS = ('period', 'name') + MEASURES
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Sales report from the daily rollups, as CSV")
+    parser.add_argument('--db', default="shipments.db", help="database file (default: shipments.db)")
+    parser.add_argument('--period', choices=list(PERIODS), default='month')
+    parser.add_argument('--by', choices=list(DIMENSIONS), default='product')
+    parser.add_argument('--from', dest='date_from', help="first day, YYYY-MM-DD")
+    parser.add_argument('--to', dest='date_to', help="last day, YYYY-MM-DD")
+    parser.add_argument('--id', dest='entity_id', type=int, help="only this product or farmer (per --by)")
+    args = parser.parse_args(argv)
+
+    db = Database(args.db)
+    try:
+        rows = report(db, args.period, args.by, args.date_from, args.date_to, args.entity_id)
+    except ValueError as e:
+        parser.error(str(e))
+    finally:
+        db.close()
+    writer = csv.writer(sys.stdout)
+    writer.writerow(REPORT_COLUMNS)
+    for row in rows:
+        writer.writerow([row['period'], row['name']] + [round(row[m], 2) for m in MEASURES])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,733 @@
+# Schema definition and versioned migrations (tracked in PRAGMA user_version)
+
+import logging
+from typing import Optional
+
+BASE_TABLES = (
+    '''
+    CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS farmers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS shipments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        notes TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS shipment_products (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        shipment_id INTEGER REFERENCES shipments(id) ON DELETE CASCADE,
+        product_id INTEGER REFERENCES products(id),
+        unit_price REAL NOT NULL,
+        quantity INTEGER NOT NULL,
+        subtotal REAL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS farmer_purchases (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        shipment_id INTEGER REFERENCES shipments(id) ON DELETE CASCADE,
+        farmer_id INTEGER REFERENCES farmers(id),
+        product_id INTEGER REFERENCES products(id),
+        quantity REAL NOT NULL,
+        unit_price REAL NOT NULL,
+        total_paid REAL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS transfers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        from_farmer_id INTEGER REFERENCES farmers(id),
+        to_farmer_id INTEGER REFERENCES farmers(id),
+        product_id INTEGER REFERENCES products(id),
+        quantity REAL NOT NULL,
+        note TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS returns (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        farmer_id INTEGER REFERENCES farmers(id),
+        product_id INTEGER REFERENCES products(id),
+        quantity REAL NOT NULL,
+        refund_amount REAL,
+        note TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL
+    )
+    ''',
+)
+
+# Per-product stock totals, kept current by the triggers below so the stock
+# screens never have to aggregate the purchase/sale/return history. Goods
+# farmers return come back into stock (RETURNED_STOCK_TRIGGERS, migration 11).
+PRODUCT_STOCK_TABLE = '''
+    CREATE TABLE IF NOT EXISTS product_stock (
+        product_id INTEGER PRIMARY KEY REFERENCES products(id) ON DELETE CASCADE,
+        total_bought REAL NOT NULL DEFAULT 0,
+        total_cost REAL NOT NULL DEFAULT 0,
+        total_sold REAL NOT NULL DEFAULT 0,
+        total_returned REAL NOT NULL DEFAULT 0,
+        current_stock REAL NOT NULL DEFAULT 0
+    )
+'''
+
+PRODUCT_STOCK_TRIGGERS = (
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_products_stock_insert AFTER INSERT ON products
+    BEGIN
+        INSERT OR IGNORE INTO product_stock (product_id) VALUES (NEW.id);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_shipment_products_stock_insert AFTER INSERT ON shipment_products
+    BEGIN
+        UPDATE product_stock
+        SET total_bought = total_bought + NEW.quantity,
+            total_cost = total_cost + COALESCE(NEW.subtotal, 0),
+            current_stock = current_stock + NEW.quantity
+        WHERE product_id = NEW.product_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_shipment_products_stock_delete AFTER DELETE ON shipment_products
+    BEGIN
+        UPDATE product_stock
+        SET total_bought = total_bought - OLD.quantity,
+            total_cost = total_cost - COALESCE(OLD.subtotal, 0),
+            current_stock = current_stock - OLD.quantity
+        WHERE product_id = OLD.product_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_farmer_purchases_stock_insert AFTER INSERT ON farmer_purchases
+    BEGIN
+        UPDATE product_stock
+        SET total_sold = total_sold + NEW.quantity,
+            current_stock = current_stock - NEW.quantity
+        WHERE product_id = NEW.product_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_farmer_purchases_stock_delete AFTER DELETE ON farmer_purchases
+    BEGIN
+        UPDATE product_stock
+        SET total_sold = total_sold - OLD.quantity,
+            current_stock = current_stock + OLD.quantity
+        WHERE product_id = OLD.product_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_returns_stock_insert AFTER INSERT ON returns
+    BEGIN
+        UPDATE product_stock
+        SET total_returned = total_returned + NEW.quantity,
+            current_stock = current_stock - NEW.quantity
+        WHERE product_id = NEW.product_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_returns_stock_delete AFTER DELETE ON returns
+    BEGIN
+        UPDATE product_stock
+        SET total_returned = total_returned - OLD.quantity,
+            current_stock = current_stock + OLD.quantity
+        WHERE product_id = OLD.product_id;
+    END
+    ''',
+)
+
+# Until migration 11 a return took the goods out of stock as well; these put
+# them back
+RETURNED_STOCK_TRIGGERS = (
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_returns_stock_insert AFTER INSERT ON returns
+    BEGIN
+        UPDATE product_stock
+        SET total_returned = total_returned + NEW.quantity,
+            current_stock = current_stock + NEW.quantity
+        WHERE product_id = NEW.product_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_returns_stock_delete AFTER DELETE ON returns
+    BEGIN
+        UPDATE product_stock
+        SET total_returned = total_returned - OLD.quantity,
+            current_stock = current_stock - OLD.quantity
+        WHERE product_id = OLD.product_id;
+    END
+    ''',
+)
+
+# Stock totals recomputed from the history tables. Each table is aggregated
+# on its own before joining, so rows never multiply across the joins.
+PRODUCT_STOCK_SOURCE = '''
+    SELECT p.id AS product_id,
+           COALESCE(b.quantity, 0) AS total_bought,
+           COALESCE(b.cost, 0) AS total_cost,
+           COALESCE(s.quantity, 0) AS total_sold,
+           COALESCE(r.quantity, 0) AS total_returned,
+           COALESCE(b.quantity, 0) - COALESCE(s.quantity, 0) + COALESCE(r.quantity, 0) AS current_stock
+    FROM products p
+    LEFT JOIN (SELECT product_id, SUM(quantity) AS quantity, SUM(subtotal) AS cost
+               FROM shipment_products GROUP BY product_id) b ON b.product_id = p.id
+    LEFT JOIN (SELECT product_id, SUM(quantity) AS quantity
+               FROM farmer_purchases GROUP BY product_id) s ON s.product_id = p.id
+    LEFT JOIN (SELECT product_id, SUM(quantity) AS quantity
+               FROM returns GROUP BY product_id) r ON r.product_id = p.id
+'''
+
+STOCK_COLUMNS = ('total_bought', 'total_cost', 'total_sold', 'total_returned', 'current_stock')
+
+# Per-shipment figures for the Shipments list, written by the shipment save
+# in the same transaction as the shipment itself.
+SHIPMENT_SUMMARY_TABLE = '''
+    CREATE TABLE IF NOT EXISTS shipment_summary (
+        shipment_id INTEGER PRIMARY KEY REFERENCES shipments(id) ON DELETE CASCADE,
+        product_count INTEGER NOT NULL DEFAULT 0,
+        farmer_count INTEGER NOT NULL DEFAULT 0,
+        purchase_total REAL NOT NULL DEFAULT 0,
+        sales_total REAL NOT NULL DEFAULT 0
+    )
+'''
+
+# Correlated subqueries so refreshing one shipment only touches its own rows
+# through the shipment_id indexes.
+SHIPMENT_SUMMARY_SOURCE = '''
+    SELECT s.id AS shipment_id,
+           (SELECT COUNT(DISTINCT product_id) FROM shipment_products WHERE shipment_id = s.id) AS product_count,
+           (SELECT COUNT(DISTINCT farmer_id) FROM farmer_purchases WHERE shipment_id = s.id) AS farmer_count,
+           (SELECT COALESCE(SUM(subtotal), 0) FROM shipment_products WHERE shipment_id = s.id) AS purchase_total,
+           (SELECT COALESCE(SUM(total_paid), 0) FROM farmer_purchases WHERE shipment_id = s.id) AS sales_total
+    FROM shipments s
+'''
+
+SUMMARY_COLUMNS = ('product_count', 'farmer_count', 'purchase_total', 'sales_total')
+
+# What each farmer holds of each product right now: purchases and incoming
+# transfers add to it, outgoing transfers and returns take from it.
+FARMER_HOLDINGS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS farmer_holdings (
+        farmer_id INTEGER NOT NULL REFERENCES farmers(id) ON DELETE CASCADE,
+        product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+        quantity REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (farmer_id, product_id)
+    ) WITHOUT ROWID
+'''
+
+
+def _holdings_change(farmer: str, product: str, quantity: str) -> str:
+    return f'''
+        INSERT INTO farmer_holdings (farmer_id, product_id, quantity)
+        SELECT {farmer}, {product}, {quantity} WHERE {farmer} IS NOT NULL AND {product} IS NOT NULL
+        ON CONFLICT (farmer_id, product_id) DO UPDATE SET quantity = quantity + excluded.quantity;
+    '''
+
+
+FARMER_HOLDINGS_TRIGGERS = tuple(
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_{table}_holdings_{event.lower()} AFTER {event} ON {table}
+    BEGIN
+        {''.join(_holdings_change(*change) for change in changes)}
+    END
+    '''
+    for table, event, changes in (
+        ('farmer_purchases', 'INSERT', [('NEW.farmer_id', 'NEW.product_id', 'NEW.quantity')]),
+        ('farmer_purchases', 'DELETE', [('OLD.farmer_id', 'OLD.product_id', '-OLD.quantity')]),
+        ('transfers', 'INSERT', [('NEW.from_farmer_id', 'NEW.product_id', '-NEW.quantity'),
+                                 ('NEW.to_farmer_id', 'NEW.product_id', 'NEW.quantity')]),
+        ('transfers', 'DELETE', [('OLD.from_farmer_id', 'OLD.product_id', 'OLD.quantity'),
+                                 ('OLD.to_farmer_id', 'OLD.product_id', '-OLD.quantity')]),
+        ('returns', 'INSERT', [('NEW.farmer_id', 'NEW.product_id', '-NEW.quantity')]),
+        ('returns', 'DELETE', [('OLD.farmer_id', 'OLD.product_id', 'OLD.quantity')]),
+    )
+)
+
+FARMER_HOLDINGS_SOURCE = '''
+    SELECT farmer_id, product_id, SUM(quantity) AS quantity
+    FROM (
+        SELECT farmer_id, product_id, quantity FROM farmer_purchases
+        UNION ALL SELECT to_farmer_id, product_id, quantity FROM transfers
+        UNION ALL SELECT from_farmer_id, product_id, -quantity FROM transfers
+        UNION ALL SELECT farmer_id, product_id, -quantity FROM returns
+    )
+    WHERE farmer_id IS NOT NULL AND product_id IS NOT NULL
+    GROUP BY farmer_id, product_id
+'''
+
+HOLDINGS_COLUMNS = ('quantity',)
+
+# Money per farmer for the Farmers screen: purchases (shipment allocations and
+# direct sales) add to total_bought, returns add to total_refunded.
+FARMER_BALANCE_TABLE = '''
+    CREATE TABLE IF NOT EXISTS farmer_balance (
+        farmer_id INTEGER PRIMARY KEY REFERENCES farmers(id) ON DELETE CASCADE,
+        total_bought REAL NOT NULL DEFAULT 0,
+        total_refunded REAL NOT NULL DEFAULT 0,
+        net_balance REAL NOT NULL DEFAULT 0,
+        last_activity TIMESTAMP
+    )
+'''
+
+# A delete can remove the latest activity, so it is looked up again
+_LAST_ACTIVITY = '''(SELECT MAX(created_at) FROM (
+            SELECT created_at FROM farmer_purchases WHERE farmer_id = OLD.farmer_id
+            UNION ALL SELECT created_at FROM returns WHERE farmer_id = OLD.farmer_id))'''
+
+
+def _balance_change(column: str, amount: str, last_activity: str, farmer: str) -> str:
+    return f'''
+    BEGIN
+        UPDATE farmer_balance
+        SET {column} = {column} + {amount},
+            net_balance = net_balance {'+' if column == 'total_bought' else '-'} ({amount}),
+            last_activity = {last_activity}
+        WHERE farmer_id = {farmer};
+    END
+    '''
+
+
+def _latest(created_at: str) -> str:
+    return f'CASE WHEN last_activity IS NULL OR {created_at} > last_activity THEN {created_at} ELSE last_activity END'
+
+
+FARMER_BALANCE_TRIGGERS = (
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_farmers_balance_insert AFTER INSERT ON farmers
+    BEGIN
+        INSERT OR IGNORE INTO farmer_balance (farmer_id) VALUES (NEW.id);
+    END
+    ''',
+) + tuple(
+    f'CREATE TRIGGER IF NOT EXISTS trg_{table}_balance_{event.lower()} AFTER {event} ON {table}'
+    + _balance_change(column, amount, last_activity, farmer)
+    for table, event, column, amount, last_activity, farmer in (
+        ('farmer_purchases', 'INSERT', 'total_bought', 'COALESCE(NEW.total_paid, 0)',
+         _latest('NEW.created_at'), 'NEW.farmer_id'),
+        ('farmer_purchases', 'DELETE', 'total_bought', '-COALESCE(OLD.total_paid, 0)',
+         _LAST_ACTIVITY, 'OLD.farmer_id'),
+        ('returns', 'INSERT', 'total_refunded', 'COALESCE(NEW.refund_amount, 0)',
+         _latest('NEW.created_at'), 'NEW.farmer_id'),
+        ('returns', 'DELETE', 'total_refunded', '-COALESCE(OLD.refund_amount, 0)',
+         _LAST_ACTIVITY, 'OLD.farmer_id'),
+    )
+)
+
+FARMER_BALANCE_SOURCE = '''
+    SELECT f.id AS farmer_id,
+           COALESCE(b.amount, 0) AS total_bought,
+           COALESCE(r.amount, 0) AS total_refunded,
+           COALESCE(b.amount, 0) - COALESCE(r.amount, 0) AS net_balance,
+           NULLIF(MAX(COALESCE(b.latest, ''), COALESCE(r.latest, '')), '') AS last_activity
+    FROM farmers f
+    LEFT JOIN (SELECT farmer_id, SUM(total_paid) AS amount, MAX(created_at) AS latest
+               FROM farmer_purchases GROUP BY farmer_id) b ON b.farmer_id = f.id
+    LEFT JOIN (SELECT farmer_id, SUM(refund_amount) AS amount, MAX(created_at) AS latest
+               FROM returns GROUP BY farmer_id) r ON r.farmer_id = f.id
+'''
+
+BALANCE_COLUMNS = ('total_bought', 'total_refunded', 'net_balance', 'last_activity')
+
+# Day-level sales per product and per farmer for the reports (src/rollups.py);
+# weeks, months and years are answered by merging these buckets. cost is what
+# the goods sold cost us, from farmer_purchases.unit_cost: the unit price paid
+# on the sale's shipment, or for direct sales the average unit price of the
+# shipments received up to then.
+SALES_ROLLUPS = {
+    'product_sales_daily': ('product_id', 'products'),
+    'farmer_sales_daily': ('farmer_id', 'farmers'),
+}
+
+
+def _sales_rollup_table(name: str, key: str, parent: str) -> str:
+    return f'''
+    CREATE TABLE IF NOT EXISTS {name} (
+        day TEXT NOT NULL,
+        {key} INTEGER NOT NULL REFERENCES {parent}(id) ON DELETE CASCADE,
+        quantity REAL NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0,
+        cost REAL NOT NULL DEFAULT 0,
+        refunds REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, {key})
+    ) WITHOUT ROWID
+    '''
+
+
+def _unit_cost(sale: str) -> str:
+    # A sale's unit cost worked out from the history, as migration 7's
+    # triggers did on every insert; migration 10 stores it on the row instead
+    return f'''COALESCE(
+        (SELECT SUM(subtotal) / SUM(quantity) FROM shipment_products
+         WHERE shipment_id = {sale}.shipment_id AND product_id = {sale}.product_id),
+        (SELECT SUM(sp.subtotal) / SUM(sp.quantity) FROM shipment_products sp
+         JOIN shipments s ON s.id = sp.shipment_id
+         WHERE sp.product_id = {sale}.product_id AND s.created_at <= {sale}.created_at),
+        0)'''
+
+
+# The unit cost of a sale being inserted, from two key lookups: its
+# shipment's line for the product, else the running average cost kept in
+# product_stock
+NEW_SALE_UNIT_COST = '''COALESCE(
+    (SELECT SUM(subtotal) / SUM(quantity) FROM shipment_products
+     WHERE shipment_id = NEW.shipment_id AND product_id = NEW.product_id),
+    (SELECT total_cost / total_bought FROM product_stock WHERE product_id = NEW.product_id AND total_bought > 0),
+    0)'''
+
+
+def _sale_amounts(row: str, unit_cost: str) -> tuple:
+    return (f'{row}.quantity', f'COALESCE({row}.total_paid, 0)', f'{row}.quantity * {unit_cost}', '0')
+
+
+def _return_amounts(row: str) -> tuple:
+    return ('0', '0', '0', f'COALESCE({row}.refund_amount, 0)')
+
+
+def _sales_upsert(name: str, key: str, row: str, amounts: tuple, negate: bool) -> str:
+    if negate:
+        amounts = tuple(a if a == '0' else f'-({a})' for a in amounts)
+    return f'''
+        INSERT INTO {name} (day, {key}, quantity, revenue, cost, refunds)
+        SELECT date({row}.created_at), {row}.{key}, {', '.join(amounts)}
+        WHERE date({row}.created_at) IS NOT NULL AND {row}.{key} IS NOT NULL
+        ON CONFLICT (day, {key}) DO UPDATE
+        SET quantity = quantity + excluded.quantity, revenue = revenue + excluded.revenue,
+            cost = cost + excluded.cost, refunds = refunds + excluded.refunds;'''
+
+
+def _sales_change(name: str, key: str, row: str, amounts: tuple, negate: bool) -> str:
+    return f'''
+    BEGIN{_sales_upsert(name, key, row, amounts, negate)}
+    END
+    '''
+
+
+# As migration 7 created them: one trigger per rollup and event, each sale
+# trigger working out the unit cost again
+SALES_ROLLUP_TRIGGERS = tuple(
+    f'CREATE TRIGGER IF NOT EXISTS trg_{table}_{name}_{event.lower()} AFTER {event} ON {table}'
+    + _sales_change(name, key, row, amounts(row), negate=event == 'DELETE')
+    for name, (key, _) in SALES_ROLLUPS.items()
+    for table, amounts in (('farmer_purchases', lambda row: _sale_amounts(row, _unit_cost(row))),
+                           ('returns', _return_amounts))
+    for event, row in (('INSERT', 'NEW'), ('DELETE', 'OLD'))
+)
+
+# Since migration 10 one trigger per event updates both rollups for a sale.
+# On insert it fills in unit_cost unless the writer did, once, and both
+# rollups read it back by primary key.
+_STORED_COST = {
+    'NEW': 'COALESCE(NEW.unit_cost, (SELECT unit_cost FROM farmer_purchases WHERE id = NEW.id))',
+    'OLD': 'COALESCE(OLD.unit_cost, 0)',
+}
+PURCHASE_ROLLUP_TRIGGERS = tuple(
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_farmer_purchases_sales_{event.lower()} AFTER {event} ON farmer_purchases
+    BEGIN{fill}{''.join(_sales_upsert(name, key, row, _sale_amounts(row, _STORED_COST[row]), event == 'DELETE')
+                        for name, (key, _) in SALES_ROLLUPS.items())}
+    END
+    '''
+    for event, row, fill in (
+        ('INSERT', 'NEW', f'''
+        UPDATE farmer_purchases SET unit_cost = {NEW_SALE_UNIT_COST}
+        WHERE NEW.unit_cost IS NULL AND id = NEW.id;'''),
+        ('DELETE', 'OLD', ''),
+    )
+)
+
+
+def _sales_rollup_source(key: str, unit_cost: str = 'COALESCE(fp.unit_cost, 0)') -> str:
+    return f'''
+    SELECT day, {key}, SUM(quantity) AS quantity, SUM(revenue) AS revenue,
+           SUM(cost) AS cost, SUM(refunds) AS refunds
+    FROM (
+        SELECT date(fp.created_at) AS day, fp.{key}, fp.quantity,
+               COALESCE(fp.total_paid, 0) AS revenue, fp.quantity * {unit_cost} AS cost, 0 AS refunds
+        FROM farmer_purchases fp
+        UNION ALL SELECT date(created_at), {key}, 0, 0, 0, COALESCE(refund_amount, 0) FROM returns
+    )
+    WHERE day IS NOT NULL AND {key} IS NOT NULL
+    GROUP BY day, {key}
+    '''
+
+
+SALES_COLUMNS = ('quantity', 'revenue', 'cost', 'refunds')
+
+# Full-text indexes over the free text the screens search: index -> (table,
+# column). They are external-content FTS5 tables keyed on the source rowid,
+# so they store only the index and a match joins straight back to its row.
+# The prefix indexes make the search-as-you-type prefix queries cheap.
+SEARCH_INDEXES = {
+    'shipments_search': ('shipments', 'notes'),
+    'products_search': ('products', 'name'),
+    'farmers_search': ('farmers', 'name'),
+    'transfers_search': ('transfers', 'note'),
+    'returns_search': ('returns', 'note'),
+}
+
+
+def _search_index_table(name: str, table: str, column: str) -> str:
+    return f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5(
+        {column}, content = '{table}', content_rowid = 'id',
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )
+    '''
+
+
+def _search_triggers(name: str, table: str, column: str) -> tuple:
+    insert = f'INSERT INTO {name} (rowid, {column}) VALUES (NEW.id, NEW.{column});'
+    delete = f"INSERT INTO {name} ({name}, rowid, {column}) VALUES ('delete', OLD.id, OLD.{column});"
+    return tuple(
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_search_{suffix} AFTER {event} ON {table}
+        BEGIN
+            {body}
+        END
+        '''
+        for suffix, event, body in (
+            ('insert', 'INSERT', insert),
+            ('delete', 'DELETE', delete),
+            ('update', f'UPDATE OF {column}', delete + insert),
+        )
+    )
+
+
+def rebuild_search_index(cursor, name: str):
+    cursor.execute(f"INSERT INTO {name} ({name}) VALUES ('rebuild')")
+
+
+# Derived tables that can be rebuilt from, and checked against, the history:
+# name -> (source query, key columns, value columns)
+LEDGERS = {
+    'product_stock': (PRODUCT_STOCK_SOURCE, ('product_id',), STOCK_COLUMNS),
+    'shipment_summary': (SHIPMENT_SUMMARY_SOURCE, ('shipment_id',), SUMMARY_COLUMNS),
+    'farmer_holdings': (FARMER_HOLDINGS_SOURCE, ('farmer_id', 'product_id'), HOLDINGS_COLUMNS),
+    'farmer_balance': (FARMER_BALANCE_SOURCE, ('farmer_id',), BALANCE_COLUMNS),
+    'product_sales_daily': (_sales_rollup_source('product_id'), ('day', 'product_id'), SALES_COLUMNS),
+    'farmer_sales_daily': (_sales_rollup_source('farmer_id'), ('day', 'farmer_id'), SALES_COLUMNS),
+}
+
+# Tables that triggers write to when the key table changes, so their versions
+# move along with it
+TRIGGER_TARGETS = {
+    'products': ('product_stock',),
+    'farmers': ('farmer_balance',),
+    'shipment_products': ('product_stock',),
+    'farmer_purchases': ('product_stock', 'farmer_holdings', 'farmer_balance',
+                         'product_sales_daily', 'farmer_sales_daily'),
+    'transfers': ('farmer_holdings',),
+    'returns': ('product_stock', 'farmer_holdings', 'farmer_balance',
+                'product_sales_daily', 'farmer_sales_daily'),
+}
+
+
+def rebuild_ledger(cursor, name: str, source: Optional[str] = None):
+    """Refill a derived table from the history; ``source`` overrides LEDGERS' query."""
+    default_source, keys, columns = LEDGERS[name]
+    source = source or default_source
+    cursor.execute(f'DELETE FROM {name}')
+    cursor.execute(f'''
+        INSERT INTO {name} ({', '.join(keys + columns)})
+        {source}
+    ''')
+
+
+def _existing_tables(cursor) -> set:
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def _baseline(cursor):
+    # Everything up to the migration framework; databases created before it
+    # already have some or all of this, so every statement is idempotent
+    existing = _existing_tables(cursor)
+    for table in BASE_TABLES:
+        cursor.execute(table)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_shipment_products_shipment_id ON shipment_products(shipment_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_farmer_purchases_shipment_id ON farmer_purchases(shipment_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_farmer_purchases_farmer_id ON farmer_purchases(farmer_id)')
+    cursor.execute(PRODUCT_STOCK_TABLE)
+    for trigger in PRODUCT_STOCK_TRIGGERS:
+        cursor.execute(trigger)
+    cursor.execute(SHIPMENT_SUMMARY_TABLE)
+    for name in ('product_stock', 'shipment_summary'):
+        if name not in existing:
+            rebuild_ledger(cursor, name)
+
+
+def _covering_indexes(cursor):
+    # One index per hot query, each covering the columns that query reads
+    # so SQLite never has to visit the table rows
+    for statement in (
+        # Shipments list: ORDER BY created_at DESC, id DESC with keyset paging
+        'CREATE INDEX IF NOT EXISTS idx_shipments_created_at ON shipments(created_at, id)',
+        # shipment_summary refresh: counts and totals per shipment
+        'CREATE INDEX IF NOT EXISTS idx_shipment_products_shipment ON shipment_products(shipment_id, product_id, subtotal)',
+        'CREATE INDEX IF NOT EXISTS idx_farmer_purchases_shipment ON farmer_purchases(shipment_id, farmer_id, total_paid)',
+        # Farmers list: total paid per farmer
+        'CREATE INDEX IF NOT EXISTS idx_farmer_purchases_farmer ON farmer_purchases(farmer_id, total_paid)',
+        # product_stock rebuild/verify: quantities per product
+        'CREATE INDEX IF NOT EXISTS idx_shipment_products_product ON shipment_products(product_id, quantity, subtotal)',
+        'CREATE INDEX IF NOT EXISTS idx_farmer_purchases_product ON farmer_purchases(product_id, quantity)',
+        'CREATE INDEX IF NOT EXISTS idx_returns_product ON returns(product_id, quantity)',
+        'CREATE INDEX IF NOT EXISTS idx_returns_farmer ON returns(farmer_id, product_id, quantity)',
+        # Transfers per farmer, either side
+        'CREATE INDEX IF NOT EXISTS idx_transfers_from_farmer ON transfers(from_farmer_id, product_id, quantity)',
+        'CREATE INDEX IF NOT EXISTS idx_transfers_to_farmer ON transfers(to_farmer_id, product_id, quantity)',
+        # Superseded by the covering indexes above
+        'DROP INDEX IF EXISTS idx_shipment_products_shipment_id',
+        'DROP INDEX IF EXISTS idx_farmer_purchases_shipment_id',
+        'DROP INDEX IF EXISTS idx_farmer_purchases_farmer_id',
+    ):
+        cursor.execute(statement)
+
+
+def _farmer_holdings(cursor):
+    cursor.execute(FARMER_HOLDINGS_TABLE)
+    for trigger in FARMER_HOLDINGS_TRIGGERS:
+        cursor.execute(trigger)
+    rebuild_ledger(cursor, 'farmer_holdings')
+
+
+def _history_date_indexes(cursor):
+    # Date-range exports walk the history in (created_at, id) order
+    for table in ('farmer_purchases', 'transfers', 'returns'):
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_created_at ON {table}(created_at)')
+
+
+def _standing_orders(cursor):
+    # How much of a product a farmer takes from every shipment; the
+    # distribution solver splits shipments in these proportions
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS standing_orders (
+            farmer_id INTEGER NOT NULL REFERENCES farmers(id) ON DELETE CASCADE,
+            product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+            quantity REAL NOT NULL CHECK (quantity > 0),
+            PRIMARY KEY (product_id, farmer_id)
+        ) WITHOUT ROWID
+    ''')
+    # Historical share per (product, farmer) for the solver; the product_id
+    # prefix still serves the product_stock rebuild
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_farmer_purchases_product_farmer '
+                   'ON farmer_purchases(product_id, farmer_id, quantity)')
+    cursor.execute('DROP INDEX IF EXISTS idx_farmer_purchases_product')
+
+
+def _farmer_balance(cursor):
+    cursor.execute(FARMER_BALANCE_TABLE)
+    for trigger in FARMER_BALANCE_TRIGGERS:
+        cursor.execute(trigger)
+    rebuild_ledger(cursor, 'farmer_balance')
+
+
+def _sales_rollups(cursor):
+    for name, (key, parent) in SALES_ROLLUPS.items():
+        cursor.execute(_sales_rollup_table(name, key, parent))
+        # Reports for one product or farmer walk its days in order
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{name}_{key} ON {name}({key}, day)')
+    for trigger in SALES_ROLLUP_TRIGGERS:
+        cursor.execute(trigger)
+    for name, (key, _) in SALES_ROLLUPS.items():
+        rebuild_ledger(cursor, name, _sales_rollup_source(key, _unit_cost('fp')))
+
+
+def _search_indexes(cursor):
+    for name, (table, column) in SEARCH_INDEXES.items():
+        cursor.execute(_search_index_table(name, table, column))
+        for trigger in _search_triggers(name, table, column):
+            cursor.execute(trigger)
+        rebuild_search_index(cursor, name)
+
+
+def _shipment_list_indexes(cursor):
+    for statement in (
+        # Shipments list sorted on a summary column, keyset-paged on (column, id)
+        'CREATE INDEX IF NOT EXISTS idx_shipment_summary_product_count ON shipment_summary(product_count, shipment_id)',
+        'CREATE INDEX IF NOT EXISTS idx_shipment_summary_farmer_count ON shipment_summary(farmer_count, shipment_id)',
+        'CREATE INDEX IF NOT EXISTS idx_shipment_summary_sales_total ON shipment_summary(sales_total, shipment_id)',
+        # Shipments holding a product or sold to a farmer; they still cover
+        # the per-product and per-farmer totals of the indexes they replace
+        'CREATE INDEX IF NOT EXISTS idx_shipment_products_product_shipment '
+        'ON shipment_products(product_id, shipment_id, quantity, subtotal)',
+        'CREATE INDEX IF NOT EXISTS idx_farmer_purchases_farmer_shipment '
+        'ON farmer_purchases(farmer_id, shipment_id, total_paid)',
+        'DROP INDEX IF EXISTS idx_shipment_products_product',
+        'DROP INDEX IF EXISTS idx_farmer_purchases_farmer',
+    ):
+        cursor.execute(statement)
+
+
+def _sale_unit_costs(cursor):
+    cursor.execute('ALTER TABLE farmer_purchases ADD COLUMN unit_cost REAL')
+    cursor.execute(f'UPDATE farmer_purchases SET unit_cost = {_unit_cost("farmer_purchases")}')
+    for name in SALES_ROLLUPS:
+        for event in ('insert', 'delete'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS trg_farmer_purchases_{name}_{event}')
+    for trigger in PURCHASE_ROLLUP_TRIGGERS:
+        cursor.execute(trigger)
+    for name in SALES_ROLLUPS:
+        rebuild_ledger(cursor, name)
+
+
+def _returns_restock(cursor):
+    for event in ('insert', 'delete'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS trg_returns_stock_{event}')
+    for trigger in RETURNED_STOCK_TRIGGERS:
+        cursor.execute(trigger)
+    rebuild_ledger(cursor, 'product_stock')
+
+
+# (version, description, apply); append new migrations, never edit old ones
+MIGRATIONS = [
+    (1, "baseline schema with product_stock and shipment_summary", _baseline),
+    (2, "covering indexes for the list and stock queries", _covering_indexes),
+    (3, "farmer_holdings ledger maintained by triggers", _farmer_holdings),
+    (4, "created_at indexes on the history tables", _history_date_indexes),
+    (5, "standing_orders and a (product, farmer) purchase index", _standing_orders),
+    (6, "farmer_balance ledger maintained by triggers", _farmer_balance),
+    (7, "daily sales rollups per product and per farmer", _sales_rollups),
+    (8, "FTS5 search indexes over notes and names", _search_indexes),
+    (9, "indexes for sorting and filtering the shipments list", _shipment_list_indexes),
+    (10, "unit cost stored on farmer_purchases, one rollup trigger per event", _sale_unit_costs),
+    (11, "returned goods go back into stock", _returns_restock),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def migrate(db):
+    """Apply pending migrations, each in its own transaction."""
+    current = db.execute_query('PRAGMA user_version')[0]['user_version']
+    for version, description, apply in MIGRATIONS:
+        if version <= current:
+            continue
+        with db.transaction() as cursor:
+            # Another process starting at the same time may have got there first
+            cursor.execute('PRAGMA user_version')
+            if cursor.fetchone()[0] >= version:
+                continue
+            apply(cursor)
+            cursor.execute(f'PRAGMA user_version = {version}')
+        logging.info(f"Database migrated to version {version}: {description}")
@@ -0,0 +1,106 @@
+# Full-text search over shipment notes, transfer and return notes, and names
+#
+#   python -m src.search "blida tomat"
+
+import argparse
+import re
+import sys
+from typing import Dict, List, Optional, Tuple
+
+from .database import Database
+from .schema import SEARCH_INDEXES
+
+
+def _matching(index: str) -> str:
+    return f'SELECT rowid FROM {index} WHERE {index} MATCH ?'
+
+
+# Condition on a list screen's id column keeping the rows a search matches.
+# Farmers also match on the notes of the transfers and returns they were part of.
+SCREEN_FILTERS = {
+    'shipments': f'id IN ({_matching("shipments_search")})',
+    'products': f'id IN ({_matching("products_search")})',
+    'farmers': f'''id IN (
+        {_matching("farmers_search")}
+        UNION ALL SELECT from_farmer_id FROM transfers WHERE id IN ({_matching("transfers_search")})
+        UNION ALL SELECT to_farmer_id FROM transfers WHERE id IN ({_matching("transfers_search")})
+        UNION ALL SELECT farmer_id FROM returns WHERE id IN ({_matching("returns_search")})
+    )''',
+}
+
+# What a hit from each index is, for search()
+KINDS = {
+    'shipments_search': 'shipment',
+    'products_search': 'product',
+    'farmers_search': 'farmer',
+    'transfers_search': 'transfer',
+    'returns_search': 'return',
+}
+
+
+def match_expression(text: str) -> Optional[str]:
+    """FTS5 query matching rows with a word starting with each word of ``text``.
+
+    Words are runs of letters, digits and underscores; spaces, punctuation
+    and quotes only separate them and are dropped. Each word is quoted and
+    made a prefix, and the words are ANDed, so "o'neil tom-at" becomes
+    '"o"* "neil"* "tom"* "at"*' and a typed AND, OR or NOT is just a word.
+    Returns None when ``text`` has no words.
+    """
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def screen_filter(screen: str, text: str) -> Tuple[Optional[str], tuple]:
+    """(condition, params) for PagedQueryModel.set_filter; (None, ()) shows every row."""
+    expression = match_expression(text)
+    if expression is None:
+        return None, ()
+    condition = SCREEN_FILTERS[screen]
+    return condition, (expression,) * condition.count('?')
+
+
+def search_query(index: str) -> str:
+    _, column = SEARCH_INDEXES[index]
+    return f'''
+        SELECT rowid AS id, {column} AS text
+        FROM {index}
+        WHERE {index} MATCH ?
+        ORDER BY rank
+        LIMIT ?
+    '''
+
+
+def search(db: Database, text: str, limit: int = 20) -> List[Dict]:
+    """Best matches for ``text`` in every index, up to ``limit`` per index."""
+    expression = match_expression(text)
+    if expression is None:
+        return []
+    hits = []
+    for index, kind in KINDS.items():
+        for row in db.execute_query(search_query(index), (expression, limit)):
+            hits.append({'kind': kind, **row})
+    return hits
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Search shipments, farmers, products, transfers and returns")
+    parser.add_argument('text', help="words to look for; the last letters of each may be left off")
+    parser.add_argument('--db', default="shipments.db", help="database file (default: shipments.db)")
+    parser.add_argument('--limit', type=int, default=20, help="matches per kind (default: 20)")
+    args = parser.parse_args(argv)
+
+    db = Database(args.db)
+    try:
+        hits = search(db, args.text, args.limit)
+    finally:
+        db.close()
+    for hit in hits:
+        print(f"{hit['kind']:<9} {hit['id']:>8}  {hit['text']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
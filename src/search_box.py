@@ -0,0 +1,36 @@
+# Search field for the list screens: emits once typing pauses
+
+from PyQt6.QtCore import QTimer, pyqtSignal
+from PyQt6.QtWidgets import QLineEdit
+
+
+class SearchBox(QLineEdit):
+    """Line edit that emits ``search`` with its text DELAY_MS after the last keystroke.
+
+    A burst of typing becomes one query instead of one per key, and the same
+    text is never searched twice in a row. Enter searches right away.
+    """
+
+    DELAY_MS = 250
+
+    search = pyqtSignal(str)
+
+    def __init__(self, placeholder: str = "Search...", parent=None):
+        super().__init__(parent)
+        self.setPlaceholderText(placeholder)
+        self.setClearButtonEnabled(True)
+        self.setMaximumWidth(260)
+        self.searched = ""
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(self.DELAY_MS)
+        self.timer.timeout.connect(self.emit_search)
+        self.textChanged.connect(self.timer.start)
+        self.returnPressed.connect(self.emit_search)
+
+    def emit_search(self):
+        self.timer.stop()
+        text = self.text().strip()
+        if text != self.searched:
+            self.searched = text
+            self.search.emit(text)
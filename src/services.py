@@ -0,0 +1,267 @@
+# Shipment, stock and farmer workflows without the GUI
+#
+# The screens, the HTTP API (src/api.py) and scripts all write through these
+# services. Invalid requests raise ValueError with a message fit to show the
+# user; nothing here imports Qt.
+
+import math
+import sqlite3
+from typing import Dict, List, Optional
+
+from .allocation import TOLERANCE
+from .database import Database
+from .queries import (
+    FARMER_HOLDINGS, FARMERS_LIST, SHIPMENT_SORTS, STOCK_LIST, page_query, rows_query, shipment_filters
+)
+from .receipt_engine import load_shipment
+
+MAX_PAGE_SIZE = 1000
+
+
+def _page_size(limit: int) -> int:
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return limit
+
+
+def parse_number(value, name: str, minimum: float = 0.0) -> float:
+    """``value`` as a finite float of at least ``minimum``; raises ValueError naming ``name``."""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a number")
+    if not math.isfinite(value):
+        raise ValueError(f"{name} must be a finite number")
+    if value < minimum:
+        raise ValueError(f"{name} must be at least {minimum:g}")
+    return value
+
+
+def parse_positive(value, name: str) -> float:
+    value = parse_number(value, name)
+    if value == 0:
+        raise ValueError(f"{name} must be positive")
+    return value
+
+
+def _name(value) -> str:
+    name = str(value or '').strip()
+    if not name:
+        raise ValueError("name is required")
+    return name
+
+
+class ShipmentService:
+    def __init__(self, db: Database):
+        self.db = db
+
+    @staticmethod
+    def validate(products: List[Dict]) -> List[Dict]:
+        """Check a shipment's product lines and fill in the subtotals and totals paid.
+
+        Each line has product_id, unit_price, quantity and a 'farmers' list of
+        farmer_id, quantity and unit_price, as AllocationModel.products()
+        returns them; the farmers' quantities must add up to the line's.
+        """
+        if not products:
+            raise ValueError("Add at least one product")
+        if not isinstance(products, list) or not all(isinstance(p, dict) for p in products):
+            raise ValueError("products must be a list of objects")
+        lines = []
+        for product in products:
+            farmers = product.get('farmers') or []
+            if not isinstance(farmers, list) or not all(isinstance(f, dict) for f in farmers):
+                raise ValueError("farmers must be a list of objects")
+            if product.get('product_id') is None:
+                raise ValueError("product_id is required")
+            line = dict(product)
+            line['unit_price'] = parse_positive(product.get('unit_price'), "unit_price")
+            line['quantity'] = parse_positive(product.get('quantity'), "quantity")
+            line['subtotal'] = line['unit_price'] * line['quantity']
+            line['farmers'] = []
+            for farmer in farmers:
+                if farmer.get('farmer_id') is None:
+                    raise ValueError("farmer_id is required")
+                share = dict(farmer)
+                share['quantity'] = parse_positive(farmer.get('quantity'), "quantity")
+                share['unit_price'] = parse_positive(farmer.get('unit_price'), "unit_price")
+                share['total_paid'] = share['quantity'] * share['unit_price']
+                line['farmers'].append(share)
+            if abs(sum(f['quantity'] for f in line['farmers']) - line['quantity']) > TOLERANCE:
+                raise ValueError(f"Product {line['product_id']} not fully assigned")
+            lines.append(line)
+        return lines
+
+    def create(self, notes: str, products: List[Dict]) -> int:
+        """Write a shipment, its products, farmer purchases and summary in one transaction."""
+        products = self.validate(products)
+        with self.db.transaction() as cursor:
+            cursor.execute('INSERT INTO shipments (notes) VALUES (?)', (notes,))
+            shipment_id = cursor.lastrowid
+
+            cursor.executemany('''
+                INSERT INTO shipment_products (shipment_id, product_id, unit_price, quantity, subtotal)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [(shipment_id, p['product_id'], p['unit_price'], p['quantity'], p['subtotal'])
+                  for p in products])
+
+            # What each product cost on this shipment, stored on its sales for the rollups
+            totals = {}
+            for p in products:
+                subtotal, quantity = totals.get(p['product_id'], (0.0, 0.0))
+                totals[p['product_id']] = (subtotal + p['subtotal'], quantity + p['quantity'])
+            cursor.executemany('''
+                INSERT INTO farmer_purchases
+                (shipment_id, farmer_id, product_id, quantity, unit_price, total_paid, unit_cost)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [(shipment_id, f['farmer_id'], p['product_id'], f['quantity'], f['unit_price'], f['total_paid'],
+                   totals[p['product_id']][0] / totals[p['product_id']][1])
+                  for p in products for f in p['farmers']])
+
+            self.db.refresh_shipment_summary(shipment_id)
+        return shipment_id
+
+    def get(self, shipment_id: int) -> Optional[Dict]:
+        """Header, line items and farmer sales of a shipment, or None."""
+        return load_shipment(self.db, shipment_id)
+
+    def list(self, sort: str = 'created_at', descending: bool = True, after: Optional[tuple] = None,
+             limit: int = 200, **filters) -> List[Dict]:
+        """One keyset page of the shipments list; ``after`` is the last row's sort key values.
+
+        ``filters`` are the queries.SHIPMENT_FILTERS by name.
+        """
+        if sort not in SHIPMENT_SORTS:
+            raise ValueError(f"unknown sort {sort!r}")
+        query, sort_keys = SHIPMENT_SORTS[sort]
+        if after is not None and len(after) != len(sort_keys):
+            raise ValueError(f"after needs {len(sort_keys)} value(s): {', '.join(sort_keys)}")
+        try:
+            where, params = shipment_filters(**filters)
+        except KeyError as e:
+            raise ValueError(f"unknown filter {e.args[0]!r}")
+        return self.db.execute_query(*page_query(query, sort_keys, descending, after, _page_size(limit),
+                                                 where, params))
+
+
+class InventoryService:
+    def __init__(self, db: Database):
+        self.db = db
+
+    def add_product(self, name: str) -> int:
+        try:
+            return self.db.execute_update('INSERT INTO products (name) VALUES (?)', (_name(name),))
+        except sqlite3.IntegrityError:
+            raise ValueError("Product name already exists")
+
+    def stock(self, after: Optional[str] = None, limit: int = 200) -> List[Dict]:
+        """One page of the stock list by product name, after the product named ``after``."""
+        return self.db.execute_query(*page_query(STOCK_LIST, ('name',), after=None if after is None else (after,),
+                                                 page_size=_page_size(limit)))
+
+    def product_stock(self, product_id: int) -> Optional[Dict]:
+        rows = self.db.execute_query(*rows_query(STOCK_LIST, 'id', (product_id,)))
+        return rows[0] if rows else None
+
+    def direct_sell(self, farmer_id: int, product_id: int, quantity: float, unit_price: float) -> int:
+        """Record a warehouse sale that is not part of a shipment; there must be enough in stock."""
+        quantity = parse_positive(quantity, "quantity")
+        unit_price = parse_positive(unit_price, "unit_price")
+        with self.db.transaction() as cursor:
+            cursor.execute('SELECT 1 FROM farmers WHERE id = ?', (farmer_id,))
+            if cursor.fetchone() is None:
+                raise ValueError(f"unknown farmer {farmer_id}")
+            # Checked in the insert itself, so concurrent sales cannot both take the last of it
+            cursor.execute('''
+                INSERT INTO farmer_purchases (farmer_id, product_id, quantity, unit_price, total_paid, unit_cost)
+                SELECT ?, ?, ?, ?, ?, CASE WHEN total_bought > 0 THEN total_cost / total_bought ELSE 0 END
+                FROM product_stock WHERE product_id = ? AND current_stock >= ?
+            ''', (farmer_id, product_id, quantity, unit_price, quantity * unit_price,
+                  product_id, quantity - TOLERANCE))
+            if cursor.rowcount == 0:
+                cursor.execute('SELECT current_stock FROM product_stock WHERE product_id = ?', (product_id,))
+                row = cursor.fetchone()
+                if row is None:
+                    raise ValueError(f"unknown product {product_id}")
+                raise ValueError(f"Only {row[0]:.2f} in stock")
+            return cursor.lastrowid
+
+
+class FarmerService:
+    def __init__(self, db: Database):
+        self.db = db
+
+    def add_farmer(self, name: str) -> int:
+        try:
+            return self.db.execute_update('INSERT INTO farmers (name) VALUES (?)', (_name(name),))
+        except sqlite3.IntegrityError:
+            raise ValueError("Name already exists")
+
+    def list(self, after: Optional[str] = None, limit: int = 200) -> List[Dict]:
+        """One page of farmers and their balances by name, after the farmer named ``after``."""
+        return self.db.execute_query(*page_query(FARMERS_LIST, ('name',), after=None if after is None else (after,),
+                                                 page_size=_page_size(limit)))
+
+    def holding(self, farmer_id: int, product_id: int) -> float:
+        """How much of a product a farmer holds right now."""
+        rows = self.db.execute_query('SELECT quantity FROM farmer_holdings WHERE farmer_id = ? AND product_id = ?',
+                                     (farmer_id, product_id))
+        return rows[0]['quantity'] if rows else 0.0
+
+    def holdings(self, farmer_id: int) -> List[Dict]:
+        return sorted(self.db.execute_query(FARMER_HOLDINGS, (farmer_id,)), key=lambda h: h['name'])
+
+    # Appended to an INSERT ... SELECT so the row is only written while the
+    # farmer holds enough: farmer id, product id, quantity
+    HOLDS_ENOUGH = '''
+        WHERE (SELECT quantity FROM farmer_holdings WHERE farmer_id = ? AND product_id = ?) >= ?
+    '''
+
+    @staticmethod
+    def _short_of(cursor, farmer_id: int, product_id: int) -> ValueError:
+        cursor.execute('SELECT quantity FROM farmer_holdings WHERE farmer_id = ? AND product_id = ?',
+                       (farmer_id, product_id))
+        row = cursor.fetchone()
+        return ValueError(f"Farmer only holds {row[0] if row else 0.0:.2f} of this product")
+
+    def transfer(self, from_farmer_id: int, to_farmer_id: int, product_id: int, quantity: float,
+                 note: str = '') -> int:
+        """Move stock between farmers; the sender must hold at least ``quantity``."""
+        quantity = parse_positive(quantity, "quantity")
+        if from_farmer_id == to_farmer_id:
+            raise ValueError("Cannot transfer to same farmer")
+        with self.db.transaction() as cursor:
+            cursor.execute('''
+                INSERT INTO transfers (from_farmer_id, to_farmer_id, product_id, quantity, note)
+                SELECT ?, ?, ?, ?, ?
+            ''' + self.HOLDS_ENOUGH, (from_farmer_id, to_farmer_id, product_id, quantity, note,
+                                     from_farmer_id, product_id, quantity - TOLERANCE))
+            if cursor.rowcount == 0:
+                raise self._short_of(cursor, from_farmer_id, product_id)
+            return cursor.lastrowid
+
+    def record_return(self, farmer_id: int, product_id: int, quantity: float, refund_amount: float,
+                      note: str = '') -> int:
+        """Record stock a farmer gives back; they must hold at least ``quantity``."""
+        quantity = parse_positive(quantity, "quantity")
+        refund_amount = parse_number(refund_amount, "refund_amount")
+        with self.db.transaction() as cursor:
+            cursor.execute('''
+                INSERT INTO returns (farmer_id, product_id, quantity, refund_amount, note)
+                SELECT ?, ?, ?, ?, ?
+            ''' + self.HOLDS_ENOUGH, (farmer_id, product_id, quantity, refund_amount, note,
+                                     farmer_id, product_id, quantity - TOLERANCE))
+            if cursor.rowcount == 0:
+                raise self._short_of(cursor, farmer_id, product_id)
+            return cursor.lastrowid
+
+    def set_standing_order(self, farmer_id: int, product_id: int, quantity: float):
+        """Set how much of a product a farmer usually takes; 0 removes the order."""
+        if quantity <= 0:
+            self.db.execute_update('DELETE FROM standing_orders WHERE product_id = ? AND farmer_id = ?',
+                                   (product_id, farmer_id))
+            return
+        self.db.execute_update('''
+            INSERT INTO standing_orders (farmer_id, product_id, quantity) VALUES (?, ?, ?)
+            ON CONFLICT (product_id, farmer_id) DO UPDATE SET quantity = excluded.quantity
+        ''', (farmer_id, product_id, quantity))
@@ -3,22 +3,48 @@
 
 from PyQt6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QTableWidget,
-    QTableWidgetItem, QLabel, QDialog, QFormLayout, QTextEdit,
+    QTableWidgetItem, QTableView, QLabel, QDialog, QFormLayout, QTextEdit,
     QComboBox, QSpinBox, QDoubleSpinBox, QDialogButtonBox,
-    QMessageBox, QHeaderView, QTextBrowser
+    QMessageBox, QHeaderView, QTextBrowser, QTabWidget, QCheckBox, QListWidget, QListWidgetItem, QDateEdit
 )
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import QDate, Qt
+from PyQt6.QtGui import QFont
 from datetime import datetime
 from decimal import Decimal
+import logging
+import sqlite3
 
+from .allocation import TOLERANCE, AllocationModel
 from .database import Database
+from .distribution import RULES, distribute
+from .queries import SHIPMENT_SORTS, SHIPMENTS_LIST, combine_filters, shipment_filters
+from .receipt_engine import farmers_in, load_shipment, render_receipt
+from .search import screen_filter
+from .search_box import SearchBox
+from .services import ShipmentService
+from .table_model import PagedQueryModel
+
+
+SHIPMENT_COLUMNS = [
+    ("ID", lambda r: str(r['id'])),
+    ("Date", lambda r: datetime.fromisoformat(r['created_at']).strftime("%d/%m/%Y %H:%M")),
+    ("Products", lambda r: f"{r['product_count']} products"),
+    ("Customers", lambda r: f"{r['farmer_count']} farmers"),
+    ("Total Paid (DA)", lambda r: f"{Decimal(str(r['total_paid'])).quantize(Decimal('0.01')):,.2f} DA"),
+]
+
+# Column sorts, in column order
+COLUMN_SORTS = [SHIPMENT_SORTS[key] for key in ('id', 'created_at', 'product_count', 'farmer_count', 'total_paid')]
 
 
 class ShipmentsWidget(QWidget):
+    DEPENDS_ON = ('shipments', 'shipment_summary', 'products', 'farmers')
+
     def __init__(self, db: Database):
         super().__init__()
         self.db = db
         self.init_ui()
+        self.load_filter_choices()
         self.load_shipments()
 
     def init_ui(self):
@@ -28,20 +54,61 @@ class ShipmentsWidget(QWidget):
         header_layout.addWidget(QLabel("<h2>Shipments</h2>"))
         header_layout.addStretch()
 
+        self.search_box = SearchBox("Search notes...")
+        self.search_box.search.connect(self.search)
+        header_layout.addWidget(self.search_box)
+
         self.add_button = QPushButton("Add New Shipment")
         self.add_button.clicked.connect(self.add_shipment)
         header_layout.addWidget(self.add_button)
 
         layout.addLayout(header_layout)
 
-        self.table = QTableWidget()
-        self.table.setColumnCount(5)
-        self.table.setHorizontalHeaderLabels(["ID", "Date", "Products", "Customers", "Total Paid (DA)"])
-        self.table.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
-        self.table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        # Every filter becomes part of the page query, see queries.SHIPMENT_FILTERS
+        filters_layout = QHBoxLayout()
+        self.dates_check = QCheckBox("Between")
+        self.from_date = QDateEdit(QDate.currentDate().addMonths(-1))
+        self.to_date = QDateEdit(QDate.currentDate())
+        for edit in (self.from_date, self.to_date):
+            edit.setCalendarPopup(True)
+            edit.setDisplayFormat("yyyy/MM/dd")
+            edit.dateChanged.connect(self.apply_filters)
+        self.dates_check.toggled.connect(self.apply_filters)
+        self.product_filter = QComboBox()
+        self.farmer_filter = QComboBox()
+        for combo in (self.product_filter, self.farmer_filter):
+            combo.currentIndexChanged.connect(self.apply_filters)
+        self.min_total = QDoubleSpinBox()
+        self.max_total = QDoubleSpinBox()
+        for spin in (self.min_total, self.max_total):
+            spin.setRange(0, 1e12)
+            spin.setSuffix(" DA")
+            spin.setSpecialValueText("Any")
+            spin.editingFinished.connect(self.apply_filters)
+        filters_layout.addWidget(self.dates_check)
+        filters_layout.addWidget(self.from_date)
+        filters_layout.addWidget(QLabel("and"))
+        filters_layout.addWidget(self.to_date)
+        filters_layout.addWidget(self.product_filter)
+        filters_layout.addWidget(self.farmer_filter)
+        filters_layout.addWidget(QLabel("Total paid:"))
+        filters_layout.addWidget(self.min_total)
+        filters_layout.addWidget(QLabel("to"))
+        filters_layout.addWidget(self.max_total)
+        filters_layout.addStretch()
+        layout.addLayout(filters_layout)
+
+        self.model = PagedQueryModel(self.db, SHIPMENTS_LIST, ('created_at', 'id'), SHIPMENT_COLUMNS,
+                                     descending=True, background=True, sorts=COLUMN_SORTS, parent=self)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.setSelectionBehavior(QTableView.SelectionBehavior.SelectRows)
         self.table.doubleClicked.connect(self.view_shipment)
 
         header = self.table.horizontalHeader()
+        # Newest first, as the model starts out; sorting is done by the page query
+        header.setSortIndicator(1, Qt.SortOrder.DescendingOrder)
+        self.table.setSortingEnabled(True)
         header.setSectionResizeMode(0, QHeaderView.ResizeMode.ResizeToContents)
         header.setSectionResizeMode(1, QHeaderView.ResizeMode.ResizeToContents)
         header.setSectionResizeMode(2, QHeaderView.ResizeMode.Stretch)
@@ -52,28 +119,47 @@ class ShipmentsWidget(QWidget):
         self.setLayout(layout)
 
     def load_shipments(self):
-        query = '''
-            SELECT s.id, s.created_at, s.notes,
-                   COUNT(DISTINCT sp.product_id) as product_count,
-                   COUNT(DISTINCT fp.farmer_id) as farmer_count,
-                   COALESCE(SUM(fp.total_paid), 0) as total_paid
-            FROM shipments s
-            LEFT JOIN shipment_products sp ON s.id = sp.shipment_id
-            LEFT JOIN farmer_purchases fp ON s.id = fp.shipment_id
-            GROUP BY s.id
-            ORDER BY s.created_at DESC
-        '''
-        shipments = self.db.execute_query(query)
-
-        self.table.setRowCount(len(shipments))
-        for row, shipment in enumerate(shipments):
-            self.table.setItem(row, 0, QTableWidgetItem(str(shipment['id'])))
-            date_obj = datetime.fromisoformat(shipment['created_at'])
-            self.table.setItem(row, 1, QTableWidgetItem(date_obj.strftime("%d/%m/%Y %H:%M")))
-            self.table.setItem(row, 2, QTableWidgetItem(f"{shipment['product_count']} products"))
-            self.table.setItem(row, 3, QTableWidgetItem(f"{shipment['farmer_count']} farmers"))
-            total_paid = Decimal(str(shipment['total_paid'])).quantize(Decimal('0.01'))
-            self.table.setItem(row, 4, QTableWidgetItem(f"{total_paid:,.2f} DA"))
+        self.model.reload()
+
+    def load_filter_choices(self):
+        for combo, label, table in ((self.product_filter, "All products", 'products'),
+                                    (self.farmer_filter, "All farmers", 'farmers')):
+            selected = combo.currentData()
+            combo.blockSignals(True)
+            combo.clear()
+            combo.addItem(label, None)
+            for row in self.db.execute_query(f'SELECT id, name FROM {table} ORDER BY name'):
+                combo.addItem(row['name'], row['id'])
+            combo.setCurrentIndex(max(combo.findData(selected), 0))
+            combo.blockSignals(False)
+
+    def filters(self):
+        dates = self.dates_check.isChecked()
+        return combine_filters([
+            screen_filter('shipments', self.search_box.searched),
+            shipment_filters(
+                date_from=self.from_date.date().toString("yyyy-MM-dd") if dates else None,
+                date_to=self.to_date.date().toString("yyyy-MM-dd") if dates else None,
+                product_id=self.product_filter.currentData(),
+                farmer_id=self.farmer_filter.currentData(),
+                min_total=self.min_total.value() or None,
+                max_total=self.max_total.value() or None,
+            ),
+        ])
+
+    def apply_filters(self):
+        where, params = self.filters()
+        if (where, params) != (self.model.where, self.model.where_params):
+            self.model.set_filter(where, params)
+            self.load_shipments()
+
+    def refresh(self):
+        self.load_filter_choices()
+        self.model.set_filter(*self.filters())
+        self.load_shipments()
+
+    def search(self, text: str):
+        self.apply_filters()
 
     def add_shipment(self):
         dialog = AddShipmentDialog(self.db, self)
@@ -81,10 +167,9 @@ class ShipmentsWidget(QWidget):
             self.load_shipments()
 
     def view_shipment(self):
-        current_row = self.table.currentRow()
-        if current_row >= 0:
-            shipment_id = int(self.table.item(current_row, 0).text())
-            dialog = ShipmentDetailsDialog(self.db, shipment_id, self)
+        shipment = self.model.row_at(self.table.currentIndex().row())
+        if shipment is not None:
+            dialog = ShipmentDetailsDialog(self.db, shipment['id'], self)
             dialog.exec()
 
 
@@ -93,8 +178,8 @@ class AddShipmentDialog(QDialog):
     def __init__(self, db: Database, parent=None):
         super().__init__(parent)
         self.db = db
-        self.products = []
-        self.current_product_idx = None
+        self.allocation = AllocationModel()
+        self.current_product_id = None
         self.init_ui()
 
     def init_ui(self):
@@ -165,6 +250,9 @@ class AddShipmentDialog(QDialog):
         self.add_farmer_btn = QPushButton("Assign to Farmer")
         self.add_farmer_btn.clicked.connect(self.assign_to_farmer)
 
+        self.auto_distribute_btn = QPushButton("Auto Distribute...")
+        self.auto_distribute_btn.clicked.connect(self.auto_distribute)
+
         farmer_form.addWidget(QLabel("Farmer:"))
         farmer_form.addWidget(self.farmer_combo)
         farmer_form.addWidget(QLabel("Quantity:"))
@@ -172,6 +260,7 @@ class AddShipmentDialog(QDialog):
         farmer_form.addWidget(QLabel("Selling Price:"))
         farmer_form.addWidget(self.selling_price_spin)
         farmer_form.addWidget(self.add_farmer_btn)
+        farmer_form.addWidget(self.auto_distribute_btn)
 
         layout.addLayout(farmer_form)
 
@@ -198,134 +287,212 @@ class AddShipmentDialog(QDialog):
 
         self.setLayout(layout)
 
-    # ... (all methods: add_product_to_shipment, update_products_table, select_product_for_farmers,
-    # assign_to_farmer, update_farmers_table, update_sales_total, save_shipment – exact copy from original)
-    # I literally copied every single method from the original AddShipmentDialog – no changes needed
-    # You can copy-paste the entire class body from your original file here
+    # Entries live in self.allocation; each action only touches the table rows it changes
 
     def add_product_to_shipment(self):
         product_id = self.product_combo.currentData()
-        product_name = self.product_combo.currentText()
         unit_price = self.unit_price_spin.value()
         quantity = self.quantity_spin.value()
-        subtotal = unit_price * quantity
-
-        for product in self.products:
-            if product['product_id'] == product_id:
-                QMessageBox.warning(self, "Error", "Product already added")
-                return
-
-        self.products.append({
-            'product_id': product_id, 'name': product_name,
-            'unit_price': unit_price, 'quantity': quantity,
-            'subtotal': subtotal, 'farmers': []
-        })
+        try:
+            row = self.allocation.add_product(product_id, self.product_combo.currentText(), unit_price, quantity)
+        except ValueError as e:
+            QMessageBox.warning(self, "Error", str(e))
+            return
 
-        self.update_products_table()
+        self.products_table.insertRow(row)
+        self.update_product_row(row)
+        self.update_totals()
         self.unit_price_spin.setValue(0)
         self.quantity_spin.setValue(1)
 
-    def update_products_table(self):
-        self.products_table.setRowCount(len(self.products))
-        purchase_total = 0
-        for row, product in enumerate(self.products):
-            self.products_table.setItem(row, 0, QTableWidgetItem(product['name']))
-            self.products_table.setItem(row, 1, QTableWidgetItem(f"DA {product['unit_price']:.2f}"))
-            self.products_table.setItem(row, 2, QTableWidgetItem(str(product['quantity'])))
-            self.products_table.setItem(row, 3, QTableWidgetItem(f"DA {product['subtotal']:.2f}"))
-            farmers_text = f"{len(product['farmers'])} farmers"
-            self.products_table.setItem(row, 4, QTableWidgetItem(farmers_text))
-            purchase_total += product['subtotal']
-        self.purchase_total_label.setText(f"Purchase Total: DA {purchase_total:.2f}")
+    def update_product_row(self, row: int):
+        product = self.allocation.product_at(row)
+        self.products_table.setItem(row, 0, QTableWidgetItem(product['name']))
+        self.products_table.setItem(row, 1, QTableWidgetItem(f"DA {product['unit_price']:.2f}"))
+        self.products_table.setItem(row, 2, QTableWidgetItem(str(product['quantity'])))
+        self.products_table.setItem(row, 3, QTableWidgetItem(f"DA {product['subtotal']:.2f}"))
+        self.products_table.setItem(row, 4, QTableWidgetItem(f"{len(product['farmers'])} farmers"))
 
     def select_product_for_farmers(self):
-        row = self.products_table.currentRow()
-        if row >= 0:
-            self.current_product_idx = row
+        product = self.allocation.product_at(self.products_table.currentRow())
+        if product is not None:
+            self.current_product_id = product['product_id']
             self.update_farmers_table()
 
     def assign_to_farmer(self):
-        if self.current_product_idx is None:
+        if self.current_product_id is None:
             QMessageBox.warning(self, "Error", "Select a product first")
             return
-        farmer_id = self.farmer_combo.currentData()
-        farmer_name = self.farmer_combo.currentText()
-        quantity = self.farmer_quantity_spin.value()
-        selling_price = self.selling_price_spin.value()
+        try:
+            allocation = self.allocation.assign(self.current_product_id, self.farmer_combo.currentData(),
+                                                self.farmer_combo.currentText(),
+                                                self.farmer_quantity_spin.value(), self.selling_price_spin.value())
+        except ValueError as e:
+            QMessageBox.warning(self, "Error", str(e))
+            return
 
-        product = self.products[self.current_product_idx]
+        row = self.farmers_table.rowCount()
+        self.farmers_table.insertRow(row)
+        self.set_farmer_row(row, self.allocation.product(self.current_product_id)['name'], allocation)
+        self.products_table.setItem(self.allocation.row_of(self.current_product_id), 4, QTableWidgetItem(
+            f"{len(self.allocation.product(self.current_product_id)['farmers'])} farmers"))
+        self.update_totals()
 
-        for f in product['farmers']:
-            if f['farmer_id'] == farmer_id:
-                QMessageBox.warning(self, "Error", "Farmer already assigned")
-                return
+        self.farmer_quantity_spin.setValue(0)
+        self.selling_price_spin.setValue(0)
 
-        total_assigned = sum(f['quantity'] for f in product['farmers'])
-        if total_assigned + quantity > product['quantity']:
-            QMessageBox.warning(self, "Error", f"Only {product['quantity'] - total_assigned:.2f} left")
+    def auto_distribute(self):
+        if not len(self.allocation):
+            QMessageBox.warning(self, "Error", "Add at least one product")
+            return
+        dialog = AutoDistributeDialog(self.db, self)
+        if dialog.exec() != QDialog.DialogCode.Accepted:
+            return
+        rule, farmers, markup, redistribute = dialog.settings()
+        if redistribute:
+            quantities = {p['product_id']: p['quantity'] for p in self.allocation}
+            assigned = {}
+        else:
+            # Shares entered by hand stay; only what is left of each product is split
+            quantities = {p['product_id']: self.allocation.remaining(p['product_id']) for p in self.allocation
+                          if self.allocation.remaining(p['product_id']) > TOLERANCE}
+            assigned = {product_id: set(self.allocation.product(product_id)['farmers'])
+                        for product_id in quantities}
+        if not quantities:
+            QMessageBox.information(self, "Auto Distribute", "Every product is already fully assigned")
+            return
+        try:
+            plan, fallbacks = distribute(self.db, rule, quantities, list(farmers), assigned)
+        except (ValueError, sqlite3.Error) as e:
+            QMessageBox.warning(self, "Error", str(e))
             return
 
-        product['farmers'].append({
-            'farmer_id': farmer_id, 'farmer_name': farmer_name,
-            'quantity': quantity, 'unit_price': selling_price,
-            'total_paid': quantity * selling_price
-        })
-
+        for product_id, shares in plan.items():
+            product = self.allocation.product(product_id)
+            price = round(product['unit_price'] * (1 + markup / 100), 2)
+            if redistribute:
+                self.allocation.clear_allocations(product_id)
+            for farmer_id, quantity in shares:
+                self.allocation.assign(product_id, farmer_id, farmers[farmer_id], quantity, price)
+            self.products_table.setItem(self.allocation.row_of(product_id), 4,
+                                        QTableWidgetItem(f"{len(product['farmers'])} farmers"))
         self.update_farmers_table()
-        self.update_products_table()
-        self.update_sales_total()
-
-        self.farmer_quantity_spin.setValue(0)
-        self.selling_price_spin.setValue(0)
+        self.update_totals()
+        left = [self.allocation.product(product_id)['name'] for product_id in quantities if product_id not in plan]
+        if left:
+            QMessageBox.information(self, "Auto Distribute",
+                                    f"Every selected farmer already has a share of {', '.join(left)}; "
+                                    f"assign the rest by hand")
+        if fallbacks:
+            QMessageBox.information(self, "Auto Distribute",
+                                    f"{len(fallbacks)} of {len(plan)} products had nothing to go on "
+                                    f"for this rule and were split equally")
+
+    def set_farmer_row(self, row: int, product_name: str, farmer: dict):
+        self.farmers_table.setItem(row, 0, QTableWidgetItem(product_name))
+        self.farmers_table.setItem(row, 1, QTableWidgetItem(farmer['farmer_name']))
+        self.farmers_table.setItem(row, 2, QTableWidgetItem(str(farmer['quantity'])))
+        self.farmers_table.setItem(row, 3, QTableWidgetItem(f"DA {farmer['unit_price']:.2f}"))
+        self.farmers_table.setItem(row, 4, QTableWidgetItem(f"DA {farmer['total_paid']:.2f}"))
 
     def update_farmers_table(self):
-        self.farmers_table.setRowCount(0)
-        if self.current_product_idx is None:
+        # Only on switching products: the table shows one product's farmers
+        if self.current_product_id is None:
+            self.farmers_table.setRowCount(0)
             return
-        product = self.products[self.current_product_idx]
-        for farmer in product['farmers']:
-            row = self.farmers_table.rowCount()
-            self.farmers_table.insertRow(row)
-            self.farmers_table.setItem(row, 0, QTableWidgetItem(product['name']))
-            self.farmers_table.setItem(row, 1, QTableWidgetItem(farmer['farmer_name']))
-            self.farmers_table.setItem(row, 2, QTableWidgetItem(str(farmer['quantity'])))
-            self.farmers_table.setItem(row, 3, QTableWidgetItem(f"DA {farmer['unit_price']:.2f}"))
-            self.farmers_table.setItem(row, 4, QTableWidgetItem(f"DA {farmer['total_paid']:.2f}"))
-
-    def update_sales_total(self):
-        sales_total = sum(f['total_paid'] for p in self.products for f in p['farmers'])
-        self.sales_total_label.setText(f"Sales Total: DA {sales_total:.2f}")
+        product = self.allocation.product(self.current_product_id)
+        self.farmers_table.setRowCount(len(product['farmers']))
+        for row, farmer in enumerate(product['farmers'].values()):
+            self.set_farmer_row(row, product['name'], farmer)
+
+    def update_totals(self):
+        self.purchase_total_label.setText(f"Purchase Total: DA {self.allocation.purchase_total:.2f}")
+        self.sales_total_label.setText(f"Sales Total: DA {self.allocation.sales_total:.2f}")
 
     def save_shipment(self):
-        if not self.products:
+        if not len(self.allocation):
             QMessageBox.warning(self, "Error", "Add at least one product")
             return
 
-        for product in self.products:
-            if sum(f['quantity'] for f in product['farmers']) != product['quantity']:
-                QMessageBox.warning(self, "Error", f"{product['name']} not fully assigned")
-                return
+        unassigned = self.allocation.unassigned()
+        if unassigned:
+            QMessageBox.warning(self, "Error", f"{unassigned[0]} not fully assigned")
+            return
 
         notes = self.notes_input.toPlainText()
-        shipment_id = self.db.execute_update('INSERT INTO shipments (notes) VALUES (?)', (notes,))
-
-        for product in self.products:
-            self.db.execute_update('''
-                INSERT INTO shipment_products (shipment_id, product_id, unit_price, quantity, subtotal)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (shipment_id, product['product_id'], product['unit_price'], product['quantity'], product['subtotal']))
-
-            for farmer in product['farmers']:
-                self.db.execute_update('''
-                    INSERT INTO farmer_purchases (shipment_id, farmer_id, product_id, quantity, unit_price, total_paid)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (shipment_id, farmer['farmer_id'], product['product_id'],
-                      farmer['quantity'], farmer['unit_price'], farmer['total_paid']))
+        try:
+            shipment_id = ShipmentService(self.db).create(notes, self.allocation.products())
+        except ValueError as e:
+            QMessageBox.warning(self, "Error", str(e))
+            return
+        except sqlite3.Error as e:
+            logging.error(f"Failed to save shipment: {e}")
+            QMessageBox.warning(self, "Error", f"Shipment not saved: {e}")
+            return
 
         QMessageBox.information(self, "Success", f"Shipment #{shipment_id} saved!")
         self.accept()
 
 
+class AutoDistributeDialog(QDialog):
+    """Rule, farmers and markup for AddShipmentDialog.auto_distribute."""
+
+    def __init__(self, db: Database, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Auto Distribute")
+        self.resize(450, 550)
+        layout = QVBoxLayout()
+
+        form = QFormLayout()
+        self.rule_combo = QComboBox()
+        for label, rule in RULES:
+            self.rule_combo.addItem(label, rule)
+        form.addRow("Split by:", self.rule_combo)
+        self.markup_spin = QDoubleSpinBox()
+        self.markup_spin.setRange(0, 1000)
+        self.markup_spin.setValue(20)
+        self.markup_spin.setSuffix(" %")
+        form.addRow("Selling price markup:", self.markup_spin)
+        self.redistribute_check = QCheckBox("Replace the farmer shares already entered")
+        form.addRow(self.redistribute_check)
+        layout.addLayout(form)
+
+        layout.addWidget(QLabel("Farmers:"))
+        self.farmers_list = QListWidget()
+        for f in db.execute_query('SELECT id, name FROM farmers ORDER BY name'):
+            item = QListWidgetItem(f['name'])
+            item.setData(Qt.ItemDataRole.UserRole, f['id'])
+            item.setCheckState(Qt.CheckState.Checked)
+            self.farmers_list.addItem(item)
+        layout.addWidget(self.farmers_list)
+
+        select = QHBoxLayout()
+        select.addWidget(QPushButton("All", clicked=lambda: self.check_all(Qt.CheckState.Checked)))
+        select.addWidget(QPushButton("None", clicked=lambda: self.check_all(Qt.CheckState.Unchecked)))
+        select.addStretch()
+        layout.addLayout(select)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
+        self.setLayout(layout)
+
+    def check_all(self, state):
+        for i in range(self.farmers_list.count()):
+            self.farmers_list.item(i).setCheckState(state)
+
+    def settings(self):
+        """(rule, {farmer_id: name} of the checked farmers, markup %, redistribute)"""
+        farmers = {}
+        for i in range(self.farmers_list.count()):
+            item = self.farmers_list.item(i)
+            if item.checkState() == Qt.CheckState.Checked:
+                farmers[item.data(Qt.ItemDataRole.UserRole)] = item.text()
+        return (self.rule_combo.currentData(), farmers, self.markup_spin.value(),
+                self.redistribute_check.isChecked())
+
+
 class ShipmentDetailsDialog(QDialog):
     # Full ShipmentDetailsDialog from original – exact copy
     def __init__(self, db: Database, shipment_id: int, parent=None):
@@ -369,74 +536,44 @@ class ShipmentDetailsDialog(QDialog):
         self.setLayout(layout)
 
     def load_shipment_details(self):
-        shipment = self.db.execute_query('SELECT * FROM shipments WHERE id = ?', (self.shipment_id,))[0]
+        # One query for the header, items and farmer sales; the receipts reuse it
+        self.shipment = load_shipment(self.db, self.shipment_id)
+        shipment = self.shipment
         date_str = datetime.fromisoformat(shipment['created_at']).strftime("%d/%m/%Y %H:%M")
         self.info_label.setText(f"<h3>Shipment #{shipment['id']}</h3><p><strong>Date:</strong> {date_str}</p><p><strong>Notes:</strong> {shipment['notes'] or 'None'}</p>")
 
-        products = self.db.execute_query('''
-            SELECT p.name, sp.unit_price, sp.quantity, sp.subtotal
-            FROM shipment_products sp
-            JOIN products p ON sp.product_id = p.id
-            WHERE sp.shipment_id = ?
-        ''', (self.shipment_id,))
-
+        products = shipment['items']
         self.products_table.setRowCount(len(products))
         for row, p in enumerate(products):
-            self.products_table.setItem(row, 0, QTableWidgetItem(p['name']))
+            self.products_table.setItem(row, 0, QTableWidgetItem(p['product']))
             self.products_table.setItem(row, 1, QTableWidgetItem(f"DA {p['unit_price']:.2f}"))
             self.products_table.setItem(row, 2, QTableWidgetItem(str(p['quantity'])))
-            self.products_table.setItem(row, 3, QTableWidgetItem(f"DA {p['subtotal']:.2f}"))
+            self.products_table.setItem(row, 3, QTableWidgetItem(f"DA {p['total']:.2f}"))
+
+        self.farmer_receipts_btn.setEnabled(bool(shipment['sales']))
 
     def generate_factory_receipt(self):
-        html = self.create_receipt_html("FACTORY PURCHASE RECEIPT", "blue")
-        self.show_receipt_dialog(html)
+        self.show_receipt_dialog(render_receipt(self.shipment, 'factory'))
 
     def generate_farmer_receipts(self):
-        html = self.create_receipt_html("FARMER SALE RECEIPT", "green")
-        self.show_receipt_dialog(html)
-
-    def create_receipt_html(self, title: str, color: str) -> str:
-        # Exact same HTML generation from original
-        current_time = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
-        shipment = self.db.execute_query('SELECT * FROM shipments WHERE id = ?', (self.shipment_id,))[0]
-        shipment_date = datetime.fromisoformat(shipment['created_at']).strftime("%d/%m/%Y %H:%M")
-
-        products = self.db.execute_query('''
-            SELECT p.name, sp.unit_price, sp.quantity, sp.subtotal
-            FROM shipment_products sp JOIN products p ON sp.product_id = p.id
-            WHERE sp.shipment_id = ?
-        ''', (self.shipment_id,))
-
-        total = sum(p['subtotal'] for p in products)
-
-        rows = ""
-        for p in products:
-            rows += f"<tr><td>{p['name']}</td><td>{p['quantity']}</td><td>DA {p['unit_price']:.2f}</td><td>DA {p['subtotal']:.2f}</td></tr>"
-
-        return f"""
-        <html><head><style>
-            body {{ font-family: Arial; margin: 40px; }}
-            .title {{ font-size: 28px; font-weight: bold; color: {color}; text-align: center; }}
-            table {{ width: 100%; border-collapse: collapse; margin: 30px 0; }}
-            th, td {{ border: 1px solid #000; padding: 12px; text-align: left; }}
-            th {{ background: #f0f0f0; }}
-            .total {{ font-size: 20px; font-weight: bold; text-align: right; }}
-        </style></head><body>
-            <div class="title">{title}<br>#{self.shipment_id}</div>
-            <p style="text-align:center;">Date: {shipment_date}</p>
-            <table><tr><th>Product</th><th>Qty</th><th>Price</th><th>Total</th></tr>{rows}</table>
-            <div class="total">TOTAL: DA {total:.2f}</div>
-        </body></html>
-        """
-
-    def show_receipt_dialog(self, html: str):
+        tabs = QTabWidget()
+        for farmer_id, name in farmers_in(self.shipment):
+            browser = QTextBrowser()
+            browser.setHtml(render_receipt(self.shipment, 'farmer', farmer_id))
+            tabs.addTab(browser, name)
+        self.show_receipt_dialog(tabs)
+
+    def show_receipt_dialog(self, content):
+        # content is receipt HTML, or a widget already holding the receipts
         dialog = QDialog(self)
         dialog.setWindowTitle("Receipt")
         dialog.resize(700, 900)
         layout = QVBoxLayout()
-        browser = QTextBrowser()
-        browser.setHtml(html)
-        layout.addWidget(browser)
+        if isinstance(content, str):
+            browser = QTextBrowser()
+            browser.setHtml(content)
+            content = browser
+        layout.addWidget(content)
         close_btn = QDialogButtonBox(QDialogButtonBox.StandardButton.Close)
         close_btn.rejected.connect(dialog.reject)
         layout.addWidget(close_btn)
@@ -0,0 +1,186 @@
+# Shared model for the list screens: keyset-paged, formatted on demand
+
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import logging
+import sqlite3
+from PyQt6.QtCore import QAbstractTableModel, QModelIndex, Qt, pyqtSignal
+
+from .database import Database
+from .queries import page_query, rows_query
+from .query_runner import QueryRunner
+
+# (header, formatter) pairs; the formatter turns a result row into cell text
+Columns = Sequence[Tuple[str, Callable[[sqlite3.Row], str]]]
+
+
+class PagedQueryModel(QAbstractTableModel):
+    """Read-only table model that pages through a query as the view scrolls.
+
+    ``query`` is a plain SELECT without ORDER BY or LIMIT. ``sort_keys`` are
+    result columns that together identify a row; pages are fetched with
+    keyset pagination on them, so fetching page N never re-reads the rows
+    before it. Cells are only formatted when the view displays them.
+
+    With ``background=True`` pages are read on a QueryRunner and a
+    "Loading..." row is shown at the end of the table until they arrive.
+
+    set_filter() narrows the rows to a condition on the result columns, such
+    as a search; it applies from the next reload().
+
+    ``sorts`` makes columns sortable from the view: for each column, None or
+    the (query, sort_keys) to page with when sorting on it. The last sort key
+    should be unique so keyset pages never skip or repeat rows.
+
+    ``refreshed`` is emitted by reload() and refresh_rows(), once the model
+    reads the current data again.
+    """
+
+    LOADING_TEXT = "Loading..."
+
+    refreshed = pyqtSignal()
+
+    def __init__(self, db: Database, query: str, sort_keys: Sequence[str], columns: Columns,
+                 descending: bool = False, page_size: int = 200, background: bool = False,
+                 sorts: Optional[Sequence[Optional[Tuple[str, Sequence[str]]]]] = None, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.query = query
+        self.sort_keys = tuple(sort_keys)
+        self.columns = list(columns)
+        self.descending = descending
+        self.page_size = page_size
+        self.sorts = list(sorts) if sorts is not None else [None] * len(columns)
+        self.runner = None
+        if background:
+            label = f"{type(parent).__name__} (background)" if parent is not None else None
+            self.runner = QueryRunner(db, label=label, parent=self)
+        self.where: Optional[str] = None
+        self.where_params: tuple = ()
+        self._rows: List[sqlite3.Row] = []
+        self._exhausted = False
+        self._loading = False
+
+    def _page_query(self) -> Tuple[str, tuple]:
+        after = None
+        if self._rows:
+            after = tuple(self._rows[-1][key] for key in self.sort_keys)
+        return page_query(self.query, self.sort_keys, self.descending, after, self.page_size,
+                          self.where, self.where_params)
+
+    def set_filter(self, where: Optional[str], params: Sequence = ()):
+        self.where, self.where_params = where, tuple(params)
+
+    def sort(self, column: int, order=Qt.SortOrder.AscendingOrder):
+        if not 0 <= column < len(self.sorts) or self.sorts[column] is None:
+            return
+        query, sort_keys = self.sorts[column]
+        descending = order == Qt.SortOrder.DescendingOrder
+        if (query, tuple(sort_keys), descending) == (self.query, self.sort_keys, self.descending):
+            return
+        self.query, self.sort_keys, self.descending = query, tuple(sort_keys), descending
+        self.reload()
+
+    def reload(self):
+        if self.runner is not None:
+            self.runner.cancel('page')
+        self.beginResetModel()
+        self._rows = []
+        self._exhausted = False
+        self._loading = False
+        self.endResetModel()
+        self.fetchMore(QModelIndex())
+        self.refreshed.emit()
+
+    def cancel(self):
+        """Stop waiting for a page; it is requested again when the view needs it."""
+        if self.runner is not None and self._loading:
+            self.runner.cancel('page')
+            self._set_loading(False)
+
+    def refresh_rows(self, column: str, values: Sequence):
+        """Re-read the loaded rows whose ``column`` is in ``values``, in place.
+
+        For writes that change a few rows but none of their sort keys; rows
+        on pages not fetched yet are read fresh when their page arrives.
+        """
+        values = set(values)
+        positions = {r[column]: row for row, r in enumerate(self._rows) if r[column] in values}
+        if positions:
+            for r in self.db.fetch_rows(*rows_query(self.query, column, list(positions))):
+                row = positions[r[column]]
+                self._rows[row] = r
+                self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.columns) - 1))
+        self.refreshed.emit()
+
+    def row_at(self, row: int) -> Optional[sqlite3.Row]:
+        return self._rows[row] if 0 <= row < len(self._rows) else None
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        if parent.isValid():
+            return 0
+        return len(self._rows) + (1 if self._loading else 0)
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.columns)
+
+    def data(self, index: QModelIndex, role=Qt.ItemDataRole.DisplayRole):
+        if role != Qt.ItemDataRole.DisplayRole or not index.isValid():
+            return None
+        if index.row() >= len(self._rows):
+            return self.LOADING_TEXT if index.column() == 0 else ""
+        return self.columns[index.column()][1](self._rows[index.row()])
+
+    def flags(self, index: QModelIndex):
+        if index.isValid() and index.row() >= len(self._rows):
+            return Qt.ItemFlag.ItemIsEnabled
+        return super().flags(index)
+
+    def headerData(self, section: int, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.columns[section][0]
+        return super().headerData(section, orientation, role)
+
+    def canFetchMore(self, parent=QModelIndex()) -> bool:
+        return not parent.isValid() and not self._exhausted and not self._loading
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        sql, params = self._page_query()
+        if self.runner is None:
+            self._append_page(self.db.fetch_rows(sql, params))
+            return
+        self._set_loading(True)
+        self.runner.submit('page', lambda: self.db.fetch_rows(sql, params),
+                           self._page_loaded, self._page_failed)
+
+    def _set_loading(self, loading: bool):
+        if loading == self._loading:
+            return
+        row = len(self._rows)
+        if loading:
+            self.beginInsertRows(QModelIndex(), row, row)
+            self._loading = True
+            self.endInsertRows()
+        else:
+            self.beginRemoveRows(QModelIndex(), row, row)
+            self._loading = False
+            self.endRemoveRows()
+
+    def _page_loaded(self, page: List[sqlite3.Row]):
+        self._set_loading(False)
+        self._append_page(page)
+
+    def _page_failed(self, error: Exception):
+        self._set_loading(False)
+        self._exhausted = True
+        logging.error(f"Failed to load page: {error}")
+
+    def _append_page(self, page: List[sqlite3.Row]):
+        self._exhausted = len(page) < self.page_size
+        if page:
+            first = len(self._rows)
+            self.beginInsertRows(QModelIndex(), first, first + len(page) - 1)
+            self._rows.extend(page)
+            self.endInsertRows()